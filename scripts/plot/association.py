@@ -1,6 +1,5 @@
 import click
 import matplotlib.pyplot as plt
-import pandas as pd
 import seaborn as sns
 
 
@@ -20,7 +19,7 @@ FEATURES_TO_PLOT = [
 @click.argument('path_to_ts_association')
 @click.argument('path_to_plot')
 def association_plots(path_to_ts_association, path_to_plot):
-    ts_association = pd.read_pickle(path_to_ts_association)
+    ts_association = uo.read_artifact(path_to_ts_association)
     ts_association = ts_association.filter([_features_to_string(f) for f in FEATURES_TO_PLOT],
                                            axis=1)
     ts_association.rename(columns=_shorten_feature_name, inplace=True)
@@ -23,8 +23,8 @@ ALL_FEATURES = [
 @click.argument('path_to_markov_ts')
 @click.argument('path_to_plot')
 def population_cluster(path_to_seed, path_to_markov_ts, path_to_plot):
-    seed = pd.read_pickle(path_to_seed)
-    markov_ts = _convert_to_numerical_values(pd.read_pickle(path_to_markov_ts))
+    seed = uo.read_artifact(path_to_seed, columns=[str(feature) for feature in ALL_FEATURES])
+    markov_ts = _convert_to_numerical_values(uo.read_artifact(path_to_markov_ts))
     seed, markov_ts = uo.tus.filter_features(seed, markov_ts, ALL_FEATURES)
     sns.set_context('paper')
     fig = plt.figure(figsize=(8, 4), dpi=300)
@@ -65,7 +65,8 @@ def _plot_heatmap(markov_ts, ax):
 def _plot_clustered_by_feature(markov_ts, seed, feature, ax):
     sorted_seed = seed.sort_values(by=str(feature))
     last_entries_in_group = sorted_seed.reset_index()\
-        .groupby(str(feature)).last()[['SN1', 'SN2', 'SN3']]
+        .groupby(str(feature)).last()[['SN1', 'SN2', 'SN3']]\
+        .dropna() # unobserved categories of categorical features
     cluster_boundaries = [
         sorted_seed.reset_index()[
             (sorted_seed.reset_index().SN1 == last_entries_in_group.iloc[i, 0]) &
@@ -1,5 +1,5 @@
 from datetime import datetime, timedelta
-from itertools import count, chain
+from itertools import count
 import math
 from multiprocessing import Pool, cpu_count
 import os
@@ -20,6 +20,8 @@ NUMBER_USUAL_RESIDENTS_HARINGEY = 254926
 RANDOM_SEED = 'haringey-case-study'
 ROOT_FOLDER = Path(os.path.abspath(__file__)).parent.parent
 CACHE_PATH = ROOT_FOLDER / 'build' / 'web-cache'
+MARKOV_CHAIN_CACHE_PATH = ROOT_FOLDER / 'build' / 'markov-chain-cache'
+MARKOV_CHAIN_CACHE_MAX_SIZE = 2 * 1024**3 # bytes
 MIDAS_DATABASE_PATH = ROOT_FOLDER / 'data' / 'Londhour.csv'
 requests_cache.install_cache((CACHE_PATH).as_posix())
 
@@ -32,21 +34,36 @@ requests_cache.install_cache((CACHE_PATH).as_posix())
 def simulation_input(path_to_seed, path_to_markov_ts, path_to_config, path_to_result):
     random.seed(RANDOM_SEED)
     _check_paths(path_to_seed, path_to_markov_ts, path_to_config, path_to_result)
-    seed = pd.read_pickle(path_to_seed)
-    markov_ts = pd.read_pickle(path_to_markov_ts)
     config = uo.read_simulation_config(path_to_config)
     features = config['people-features'] + config['household-features']
+    seed = uo.read_artifact(
+        path_to_seed,
+        columns=[str(feature) for feature in set(features + [uo.PeopleFeature.AGE])]
+    )
+    markov_ts = uo.read_artifact(path_to_markov_ts)
     seed, markov_ts = uo.tus.filter_features(
         seed,
         markov_ts,
         set(features + [uo.PeopleFeature.AGE])
     )
-    markov_chains = _create_markov_chains(
-        seed,
-        markov_ts,
+    markov_chain_cache = uo.MarkovChainCache(MARKOV_CHAIN_CACHE_PATH, MARKOV_CHAIN_CACHE_MAX_SIZE)
+    markov_chain_cache_key = markov_chain_cache.key(
+        Path(path_to_seed),
+        Path(path_to_markov_ts),
         features,
-        config
+        config['time-step-size']
     )
+    markov_chains = markov_chain_cache.get(markov_chain_cache_key)
+    if markov_chains is None:
+        markov_chains = _create_markov_chains(
+            seed,
+            markov_ts,
+            features,
+            config
+        )
+        markov_chain_cache.put(markov_chain_cache_key, markov_chains)
+    else:
+        print("Using {} cached markov chains.".format(len(markov_chains)))
     seed = _amend_seed_by_markov_model(seed, markov_chains, features, config['start-time'])
     seed = _amend_seed_by_metabolic_rate(seed, config)
     census_data_ppl = {feature: feature.read_census_data(config['spatial-resolution'])
@@ -57,7 +74,7 @@ def simulation_input(path_to_seed, path_to_markov_ts, path_to_config, path_to_re
                       for feature in config['household-features']}
     for data in census_data_hh.values():
         assert data.sum().sum() == NUMBER_HOUSEHOLDS_HARINGEY
-    seed = _prepare_seed_index(seed)
+    seed = _prepare_seed_index(uo.synthpop.decode_seed(seed))
     households, citizens = _create_synthetic_population(
         seed,
         census_data_hh,
@@ -86,32 +103,29 @@ def _check_paths(path_to_seed, path_to_markov_ts, path_to_config, path_to_result
 
 
 def _create_markov_chains(seed, markov_ts, features, config):
+    markov_ts = uo.tus.MarkovTimeSeries.from_series(markov_ts)
     seed_groups = seed.groupby([str(feature) for feature in features])
-    print("Dividing the seed into {} cluster.".format(len(seed_groups.groups.keys())))
+    cluster_sizes = seed_groups.size()
+    cluster_sizes = cluster_sizes[cluster_sizes > 0] # categorical features create empty groups
+    print("Dividing the seed into {} cluster.".format(len(cluster_sizes)))
     print("Cluster statistics:")
-    print(seed_groups.size().describe())
+    print(cluster_sizes.describe())
 
-    with Pool(config['number-processes']) as pool:
-        feature_combinations = seed_groups.groups.keys()
-        all_parameters = ( # imap_unordered allows only one parameter, hence the tuple
-            (markov_ts,
-             seed_groups.get_group(features),
-             features,
-             config['time-step-size'])
-            for features in feature_combinations
-        )
-        markov_chains = dict(pool.imap_unordered(uo.tus.markov_chain_for_cluster,
-                             tqdm(all_parameters,
-                                  total=len(feature_combinations),
-                                  desc='Calculating markov chains')))
-    return markov_chains
+    cluster_labels = pd.Series(0, index=seed.index)
+    for feature_combination, index in seed_groups.groups.items():
+        if len(index) > 0:
+            cluster_labels.loc[index] = uo.feature_id(feature_combination)
+    return uo.tus.markov_chains_for_clusters(markov_ts, cluster_labels, config['time-step-size'])
 
 
 def _amend_seed_by_markov_model(seed, markov_chains, features, simulation_start_time):
     seed_groups = seed.groupby([str(feature) for feature in features])
     for feature_combination, index in seed_groups.groups.items():
-        seed.loc[index, 'markov_id'] = uo.feature_id(feature_combination)
-        seed.loc[index, 'initial_activity'] = markov_chains[feature_combination]\
+        if len(index) == 0:
+            continue # categorical features create empty groups
+        markov_id = uo.feature_id(feature_combination)
+        seed.loc[index, 'markov_id'] = markov_id
+        seed.loc[index, 'initial_activity'] = markov_chains[markov_id]\
             .valid_states(simulation_start_time)[0]
     return seed
 
@@ -145,12 +159,8 @@ def _prepare_seed_index(seed):
 def _create_synthetic_population(seed, census_data_hh, census_data_ppl, config):
     random_hh_feature = list(census_data_hh.values())[0]
     regions = list(random_hh_feature.index)
-    controls_hh = {region: {str(feature): census_data_hh[feature].ix[region, :]
-                            for feature in config['household-features']}
-                   for region in regions}
-    controls_ppl = {region: {str(feature): census_data_ppl[feature].ix[region, :]
-                             for feature in config['people-features']}
-                    for region in regions}
+    controls_hh = _controls(census_data_hh, config['household-features'], regions)
+    controls_ppl = _controls(census_data_ppl, config['people-features'], regions)
     number_households = {region: random_hh_feature.ix[region, :].sum() for region in regions}
     household_counter = count(start=1, step=1)
     household_ids = {region: [household_counter.__next__()
@@ -160,38 +170,72 @@ def _create_synthetic_population(seed, census_data_hh, census_data_ppl, config):
                       for region in regions}
     hh_chunk_size = int(NUMBER_HOUSEHOLDS_HARINGEY / config['number-processes'] / 4)
 
+    initial_weights = None
+    if config['hipf-warm-start'] and config['spatial-resolution'].parent is not None:
+        initial_weights = _household_weights_of_parent_regions(seed, regions, config)
+    print("Hierarchical IPF for {} regions.".format(len(regions)))
+    hipf_trace = uo.synthpop.HipfTrace()
+    household_weights = uo.synthpop.run_hipf_regions(seed, controls_hh, controls_ppl,
+                                                     initial_weights, hipf_trace)
+    _print_hipf_trace(hipf_trace)
     with Pool(config['number-processes']) as pool:
-        hipf_params = ((seed, controls_hh[region], controls_ppl[region], region)
-                       for region in regions)
-        household_weights = dict(tqdm(
-            pool.imap_unordered(uo.synthpop.run_hipf, hipf_params),
-            total=len(regions),
-            desc='Hierarchical IPF         '
-        ))
-        household_params = ((region, seed, household_weights[region],
+        household_params = ((region, household_weights[region],
                              random_numbers[region], household_ids[region])
                             for region in regions)
-        households = list(chain(*tqdm(
+        households = pd.concat(list(tqdm(
             pool.imap_unordered(uo.synthpop.sample_households, household_params),
             total=len(regions),
             desc='Sampling households      '
-        )))
-        household_chunks = [households[i:i + hh_chunk_size]
+        )), ignore_index=True)
+        household_chunks = [households.iloc[i:i + hh_chunk_size]
                             for i in range(0, len(households), hh_chunk_size)]
-        citizens = list(chain(*tqdm(
+        seed_members = uo.synthpop.SeedHouseholdMembers(seed)
+        citizens = pd.concat(list(tqdm(
             pool.imap_unordered(
                 uo.synthpop.sample_citizen,
-                ((households, seed) for households in household_chunks)
+                ((households, seed_members) for households in household_chunks)
             ),
             total=math.ceil(NUMBER_HOUSEHOLDS_HARINGEY / hh_chunk_size),
             desc='Sampling individuals     '
-        )))
+        )), ignore_index=True)
 
     assert len(households) == NUMBER_HOUSEHOLDS_HARINGEY
     assert abs(len(citizens) - NUMBER_USUAL_RESIDENTS_HARINGEY) < 2000
     return households, citizens
 
 
+def _print_hipf_trace(hipf_trace):
+    iterations = hipf_trace.iterations
+    print("HIPF ran {}-{} iterations, median {}.".format(
+        iterations.min(), iterations.max(), iterations.median()
+    ))
+    print("Time per step [s]:")
+    print(hipf_trace.step_times.sum().to_string())
+
+
+def _controls(census_data, features, regions):
+    return {region: {str(feature): census_data[feature].ix[region, :] for feature in features}
+            for region in regions}
+
+
+def _household_weights_of_parent_regions(seed, regions, config):
+    # fits the seed to the enclosing regions, as a starting point for fitting the regions
+    layer = config['spatial-resolution']
+    parent_lookup = uo.census.read_parent_lookup(layer)
+    census_data_hh = {feature: feature.read_census_data(layer.parent)
+                      for feature in config['household-features']}
+    census_data_ppl = {feature: feature.read_census_data(layer.parent)
+                       for feature in config['people-features']}
+    parent_regions = list(list(census_data_hh.values())[0].index)
+    print("Hierarchical IPF for {} enclosing regions.".format(len(parent_regions)))
+    parent_weights = uo.synthpop.run_hipf_regions(
+        seed,
+        _controls(census_data_hh, config['household-features'], parent_regions),
+        _controls(census_data_ppl, config['people-features'], parent_regions)
+    )
+    return {region: parent_weights[parent_lookup[region]] for region in regions}
+
+
 def _df_to_input_db(df, table_name, path_to_db):
     disk_engine = sqlalchemy.create_engine('sqlite:///{}'.format(path_to_db))
     df.to_sql(name=table_name, con=disk_engine)
@@ -199,7 +243,7 @@ def _df_to_input_db(df, table_name, path_to_db):
 
 def _write_dwellings_table(households, config, path_to_db):
     df = pd.DataFrame(
-        index=[household.id for household in households],
+        index=households['id'].values,
         data={
             'thermalMassCapacity': config['dwelling']['thermal-mass-capacity'],
             'thermalMassArea': config['dwelling']['thermal-mass-area'],
@@ -215,7 +259,7 @@ def _write_dwellings_table(households, config, path_to_db):
             'maxHeatingPower': config['dwelling']['max-heating-power'],
             'initialTemperature': config['dwelling']['initial-temperature'],
             'heatingControlStrategy': config['dwelling']['heating-control-strategy'],
-            'region': [household.region for household in households]
+            'region': households['region'].values
         }
     )
     _df_to_input_db(df, uo.DWELLINGS_TABLE_NAME, path_to_db)
@@ -225,12 +269,12 @@ def _write_citizens_table(citizens, path_to_db):
     df = pd.DataFrame(
         index=list(range(len(citizens))),
         data={
-            'markovChainId': [citizen.markovId for citizen in citizens],
-            'dwellingId': [citizen.householdId for citizen in citizens],
-            'initialActivity': [str(citizen.initialActivity) for citizen in citizens],
-            'activeMetabolicRate': [citizen.activeMetabolicRate for citizen in citizens],
-            'passiveMetabolicRate': [citizen.passiveMetabolicRate for citizen in citizens],
-            'randomSeed': [citizen.randomSeed for citizen in citizens]
+            'markovChainId': citizens['markovId'].values,
+            'dwellingId': citizens['householdId'].values,
+            'initialActivity': citizens['initialActivity'].map(str).values,
+            'activeMetabolicRate': citizens['activeMetabolicRate'].values,
+            'passiveMetabolicRate': citizens['passiveMetabolicRate'].values,
+            'randomSeed': citizens['randomSeed'].values
         }
     )
     _df_to_input_db(df, uo.PEOPLE_TABLE_NAME, path_to_db)
@@ -240,16 +284,16 @@ def _write_markov_chains(markov_chains, path_to_db):
     markov_index = pd.Series(
         {
             feature_id: "markov{}".format(feature_id)
-            for feature_id in [uo.feature_id(key) for key in markov_chains.keys()]
+            for feature_id in markov_chains.keys()
         },
         name='tablename'
     )
     _df_to_input_db(markov_index, uo.MARKOV_CHAIN_INDEX_TABLE_NAME, path_to_db)
-    for feature_combination, markov_chain in markov_chains.items():
+    for feature_id, markov_chain in markov_chains.items():
         df = markov_chain.to_dataframe()
         df.fromActivity = [str(x) for x in df.fromActivity]
         df.toActivity = [str(x) for x in df.toActivity]
-        _df_to_input_db(df, markov_index[uo.feature_id(feature_combination)], path_to_db)
+        _df_to_input_db(df, markov_index[feature_id], path_to_db)
 
 
 def _write_temperature_table(config, path_to_db):
@@ -17,16 +17,16 @@ FEATURE_TO_KEEP = (str(uo.PeopleFeature.ECONOMIC_ACTIVITY),
 @click.argument('path_to_filtered_result')
 def analyse_association(path_to_seed, path_to_ts_association, path_to_full_result,
                         path_to_filtered_result):
-    seed = pd.read_pickle(path_to_seed)
-    ts_association = pd.read_pickle(path_to_ts_association)
+    seed = uo.read_artifact(path_to_seed)
+    ts_association = uo.read_artifact(path_to_ts_association)
     stats = pd.DataFrame({
         'mean_association': ts_association.mean(),
         'std_association': ts_association.std(),
-        'min_cluster_size': [seed.groupby(features).size().min()
+        'min_cluster_size': [uo.synthpop.cluster_sizes(seed, features).min()
                              for features in ts_association.columns],
-        'mean_cluster_size': [seed.groupby(features).size().mean()
+        'mean_cluster_size': [uo.synthpop.cluster_sizes(seed, features).mean()
                               for features in ts_association.columns],
-        'std_cluster_size': [seed.groupby(features).size().std()
+        'std_cluster_size': [uo.synthpop.cluster_sizes(seed, features).std()
                              for features in ts_association.columns]
     })
     stats.sort_values(by='mean_association', ascending=False, inplace=True)
@@ -9,7 +9,7 @@ import numpy as np
 from tqdm import tqdm
 
 import urbanoccupants as uo
-from urbanoccupants.tus import filter_features, filter_features_and_drop_nan
+from urbanoccupants.tus import FeatureFilter
 
 ALL_FEATURES = [
     uo.PeopleFeature.ECONOMIC_ACTIVITY,
@@ -21,6 +21,7 @@ ALL_FEATURES = [
     uo.PeopleFeature.CARER,
     uo.PeopleFeature.PERSONAL_INCOME
 ]
+_feature_filter = None # of each worker process, see `_init_feature_filter`
 
 
 @click.command()
@@ -36,20 +37,21 @@ def calculate_association(path_to_seed, path_to_markov_ts, path_to_feature_assoc
 
     For the time series it is calculated per time step.
     """
-    seed = pd.read_pickle(path_to_seed)
-    markov_ts = pd.read_pickle(path_to_markov_ts)
-    feature_association = _association_of_features(seed)
+    seed = uo.read_artifact(path_to_seed, columns=[str(feature) for feature in ALL_FEATURES])
+    markov_ts = uo.read_artifact(path_to_markov_ts)
+    feature_filter = FeatureFilter(seed, markov_ts)
+    feature_association = _association_of_features(feature_filter)
     ts_association = _association_of_time_series(seed, markov_ts)
-    feature_association.to_pickle(path_to_feature_association)
-    ts_association.to_pickle(path_to_ts_association)
+    uo.write_artifact(feature_association, path_to_feature_association)
+    uo.write_artifact(ts_association, path_to_ts_association)
 
 
-def _association_of_features(seed):
-    filter_features = filter_features_and_drop_nan
+def _association_of_features(feature_filter):
+    filter_features = feature_filter.filter_seed
     feature_association = pd.Series(
-        index=combinations(ALL_FEATURES, 2),
-        data=[cramers_corrected_stat(pd.crosstab(filter_features(seed, features)[features[0]],
-                                                 filter_features(seed, features)[features[1]]))
+        index=pd.MultiIndex.from_tuples(list(combinations(ALL_FEATURES, 2))),
+        data=[cramers_corrected_stat(pd.crosstab(filter_features(features)[features[0]],
+                                                 filter_features(features)[features[1]]))
               for features in tqdm(combinations([str(feature) for feature in ALL_FEATURES], 2),
                                    total=scipy.special.binom(len(ALL_FEATURES), 2),
                                    desc='Feature-feature association')]
@@ -58,7 +60,8 @@ def _association_of_features(seed):
 
 
 def _association_of_time_series(seed, markov_ts):
-    with Pool(cpu_count()) as pool:
+    # each worker filters by many features, hence it creates its filter only once
+    with Pool(cpu_count(), initializer=_init_feature_filter, initargs=(seed, markov_ts)) as pool:
         feature_strings = [str(feature) for feature in ALL_FEATURES]
         features_1d = [feature for feature in feature_strings]
         features_2d = [(feature1, feature2)
@@ -66,26 +69,24 @@ def _association_of_time_series(seed, markov_ts):
         features_3d = [(feature1, feature2, feature3)
                        for feature1, feature2, feature3 in combinations(feature_strings, 3)]
         feature_combinations = list(chain(features_1d, features_2d, features_3d))
-        all_parameters = ( # imap_unordered allows only one parameter, hence the tuple
-            (seed,
-             markov_ts,
-             features)
-            for features in feature_combinations
-        )
         ts_association = dict(pool.imap_unordered(_cramers_phi_for_features,
-                              tqdm(all_parameters,
+                              tqdm(feature_combinations,
                                    total=len(feature_combinations),
                                    desc='Time series association    ')))
     return pd.DataFrame(ts_association)
 
 
-def _cramers_phi_for_features(params):
-    seed, markov_ts, features = params
+def _init_feature_filter(seed, markov_ts):
+    global _feature_filter
+    _feature_filter = FeatureFilter(seed, markov_ts)
+
+
+def _cramers_phi_for_features(features):
     if isinstance(features, tuple):
         tuple_features = features
     else:
         tuple_features = (features, ) # turning 1d feature to tuple
-    seed, markov_ts = filter_features(seed, markov_ts, tuple_features)
+    seed, markov_ts = _feature_filter.filter(tuple_features)
     markov_ts = markov_ts.unstack(['SN1', 'SN2', 'SN3'])
     markov_ts.columns = markov_ts.columns.droplevel(0)
     return features, markov_ts.apply(_cramers_phi_for_feature(seed), axis=1)
@@ -113,6 +114,9 @@ def cramers_corrected_stat(confusion_matrix):
         Journal of the Korean Statistical Society 42 (2013): 323-328
     """
     # taken from http://stackoverflow.com/a/39266194/1856079
+    # unobserved categories of categorical features lead to empty rows and columns
+    confusion_matrix = confusion_matrix.loc[confusion_matrix.sum(axis=1) > 0,
+                                            confusion_matrix.sum(axis=0) > 0]
     chi2 = scipy.stats.chi2_contingency(confusion_matrix)[0]
     n = confusion_matrix.sum().sum()
     phi2 = chi2 / n
@@ -1,12 +1,27 @@
+from datetime import datetime, timedelta
+
 import click
 import pandas as pd
 import numpy as np
 
 import pytus2000
 import urbanoccupants as uo
+from urbanoccupants.person import activity_codes
 from urbanoccupants.tus import Activity, Location, ACTIVITY_MAP, LOCATION_MAP
 
 EXPECTED_NUMBER_OF_DIARY_ENTRIES = 2 * 24 * 6
+NUMBER_OF_TIME_SLOTS = 24 * 6
+DIARY_START_TIME = datetime(2000, 1, 1, 4, 0) # diaries run from 4am to 4am
+DIARY_TIME_STEP_SIZE = timedelta(minutes=10)
+DIARY_INDEX_COLUMNS = ['SN1', 'SN2', 'SN3', 'SN4']
+DAY_OF_WEEK_COLUMN = 'DDAYW2'
+ACTIVITY_COLUMNS = ['ACT1_{:03d}'.format(slot) for slot in range(1, NUMBER_OF_TIME_SLOTS + 1)]
+LOCATION_COLUMNS = ['WHER_{:03d}'.format(slot) for slot in range(1, NUMBER_OF_TIME_SLOTS + 1)]
+CHUNK_SIZE = 2000 # diaries
+MISSING = -1
+HOME, SLEEP_AT_HOME, NOT_AT_HOME = activity_codes(
+    [uo.Activity.HOME, uo.Activity.SLEEP_AT_HOME, uo.Activity.NOT_AT_HOME]
+)
 
 
 @click.command()
@@ -20,101 +35,149 @@ def read_markov_ts(path_to_input, path_to_output):
     Individuals are dropped if there aren't noth diaries available, one for the
     weekday, and one for the weekend day.
 
-    Output is written in plain pickle format.
+    Output is written as an artifact, see `urbanoccupants.storage`.
     """
-    diary_data = _read_diary_data(path_to_input)
-    diary_data_ts = _read_diary_data_as_timeseries(path_to_input)
-    markov_ts = _transform_to_markov_timeseries(diary_data_ts)
-    print("Read diaries for {} individuals.".format(_number_individiuals(markov_ts)))
-    markov_ts = _ffill_nan(markov_ts)
-    markov_ts = _drop_nan(markov_ts)
-    assert not markov_ts.isnull().any().any()
-    markov_ts = _remove_individuals_with_less_than_two_diaries(markov_ts)
-    markov_ts = _add_daytype(diary_data, markov_ts)
-    print("Writing diaries for {} individuals.".format(_number_individiuals(markov_ts)))
-    markov_ts.to_pickle(path_to_output)
-
-
-def _number_individiuals(markov_ts):
-    return markov_ts.reset_index().groupby(['SN1', 'SN2', 'SN3']).size().shape[0]
-
-
-def _read_diary_data(input_file_path):
-    return pytus2000.read_diary_file(input_file_path)
-
-
-def _read_diary_data_as_timeseries(input_file_path):
-    return pytus2000.read_diary_file_as_timeseries(input_file_path)[['activity', 'location']]
-
-
-def _transform_to_markov_timeseries(diary_data_ts):
-    simple_ts = pd.DataFrame({
-        'location': diary_data_ts.location.map(LOCATION_MAP),
-        'activity': diary_data_ts.activity.map(ACTIVITY_MAP)
-    })
-    markov_ts = pd.Series(index=simple_ts.index, dtype='category')
-    markov_ts.cat.add_categories([state for state in uo.Activity], inplace=True)
-    mask_home = ((simple_ts.location == Location.HOME) &
-                 (simple_ts.activity != Activity.SLEEP))
-    mask_sleep = (((simple_ts.location == Location.HOME) |
-                   (simple_ts.location == Location.IMPLICIT)) &
-                  (simple_ts.activity == Activity.SLEEP))
-    mask_nan = pd.isnull(simple_ts.location) | pd.isnull(simple_ts.activity)
-    markov_ts[:] = uo.Activity.NOT_AT_HOME
-    markov_ts[mask_home] = uo.Activity.HOME
-    markov_ts[mask_sleep] = uo.Activity.SLEEP_AT_HOME
-    markov_ts[mask_nan] = np.nan
-    return markov_ts
-
-
-def _ffill_nan(markov_ts):
+    diary_index, diary_activity_codes, weekday = _read_diaries(path_to_input)
+    print("Read diaries for {} individuals.".format(_number_individiuals(diary_index)))
+    diary_activity_codes = _ffill_nan(diary_activity_codes)
+    valid_diaries = _drop_nan(diary_activity_codes)
+    diary_index = diary_index[valid_diaries]
+    diary_activity_codes = diary_activity_codes[valid_diaries]
+    weekday = weekday[valid_diaries]
+    assert not (diary_activity_codes == MISSING).any()
+    valid_diaries = _remove_individuals_with_less_than_two_diaries(diary_index)
+    diary_index = diary_index[valid_diaries]
+    diary_activity_codes = diary_activity_codes[valid_diaries]
+    weekday = weekday[valid_diaries]
+    markov_ts = _to_markov_timeseries(diary_index, diary_activity_codes, weekday)
+    print("Writing diaries for {} individuals.".format(_number_individiuals(diary_index)))
+    uo.write_artifact(markov_ts, path_to_output)
+
+
+def _number_individiuals(diary_index):
+    return len(diary_index.droplevel('SN4').drop_duplicates())
+
+
+def _read_diaries(path_to_input):
+    # Reads the diary file once and in chunks, reading only the columns needed. Activities
+    # are directly mapped to integer coded occupancy states.
+    # Returns the index of all diaries, their activity codes of shape (diaries, time slots),
+    # and a mask of weekday diaries.
+    columns = _find_columns(
+        path_to_input,
+        DIARY_INDEX_COLUMNS + [DAY_OF_WEEK_COLUMN] + ACTIVITY_COLUMNS + LOCATION_COLUMNS
+    )
+    location_lut = _lookup_table(LOCATION_MAP)
+    activity_lut = _lookup_table(ACTIVITY_MAP)
+    weekday_value = pytus2000.diary.DDAYW2.WEEKDAY_MON___FRI.value
+    indices = []
+    codes = []
+    weekdays = []
+    chunks = pd.read_csv(path_to_input, sep='\t', usecols=list(columns.values()),
+                         chunksize=CHUNK_SIZE)
+    for chunk in chunks:
+        indices.append(chunk[[columns[column] for column in DIARY_INDEX_COLUMNS]].values)
+        codes.append(_occupancy_codes(
+            locations=_lookup(location_lut, chunk[[columns[c] for c in LOCATION_COLUMNS]].values),
+            activities=_lookup(activity_lut, chunk[[columns[c] for c in ACTIVITY_COLUMNS]].values)
+        ))
+        weekdays.append(chunk[columns[DAY_OF_WEEK_COLUMN]].values == weekday_value)
+    diary_index = pd.MultiIndex.from_arrays(np.concatenate(indices).T,
+                                            names=DIARY_INDEX_COLUMNS)
+    return diary_index, np.concatenate(codes), np.concatenate(weekdays)
+
+
+def _find_columns(path_to_input, column_names):
+    # maps the given column names to the ones in the file, ignoring case
+    with open(path_to_input, 'r') as input_file:
+        header = input_file.readline().rstrip('\r\n').split('\t')
+    columns = {column.upper(): column for column in header}
+    missing_columns = [column for column in column_names if column not in columns]
+    if missing_columns:
+        raise ValueError('Diary file is missing columns: {}.'.format(missing_columns))
+    return {column: columns[column] for column in column_names}
+
+
+def _lookup_table(tus_map):
+    # a sorted array of raw TUS values, and the values of their mapped enums, or MISSING
+    keys = sorted(tus_map.keys(), key=lambda key: key.value)
+    raw_values = np.array([key.value for key in keys])
+    target_values = np.array([MISSING if pd.isnull(tus_map[key]) else tus_map[key].value
+                              for key in keys])
+    return raw_values, target_values
+
+
+def _lookup(lookup_table, raw_values):
+    # raw values not in the lookup table, including nan, are missing
+    keys, values = lookup_table
+    positions = np.clip(np.searchsorted(keys, raw_values), 0, len(keys) - 1)
+    return np.where(keys[positions] == raw_values, values[positions], MISSING)
+
+
+def _occupancy_codes(locations, activities):
+    at_home = locations == Location.HOME.value
+    asleep = activities == Activity.SLEEP.value
+    codes = np.full(locations.shape, NOT_AT_HOME, dtype=np.int8)
+    codes[at_home & ~asleep] = HOME
+    codes[(at_home | (locations == Location.IMPLICIT.value)) & asleep] = SLEEP_AT_HOME
+    codes[(locations == MISSING) | (activities == MISSING)] = MISSING
+    return codes
+
+
+def _ffill_nan(diary_activity_codes):
     # Unknowns will be filled by forward fill. That is, whenever a state is unknown it is
     # expected that the last known state is still valid.
 
     # When doing that, it is important to not forward fill between diaries (all diaries are
-    # below each other). Hence, they must be grouped into diaries first and then forward filled.
+    # rows of the matrix). Hence, they are forward filled row by row.
     # This will lead to the fact that not all Unknowns can be filled (the ones at the beginning
     # of the day), but that is wanted.
-    n_missing = markov_ts.isnull().sum()
+    missing = diary_activity_codes == MISSING
     print("{:.2f}% of the diary entries are missing and will be forward filled."
-          .format(n_missing / markov_ts.shape[0] * 100))
-    markov_ts = markov_ts.groupby([markov_ts.index.get_level_values('SN1'),
-                                   markov_ts.index.get_level_values('SN2'),
-                                   markov_ts.index.get_level_values('SN3'),
-                                   markov_ts.index.get_level_values('SN4')]).fillna(method='ffill')
-    return markov_ts
+          .format(missing.sum() / missing.size * 100))
+    last_known_slot = np.where(missing, 0, np.arange(missing.shape[1]))
+    last_known_slot = np.maximum.accumulate(last_known_slot, axis=1)
+    return diary_activity_codes[np.arange(missing.shape[0])[:, np.newaxis], last_known_slot]
 
 
-def _drop_nan(markov_ts):
-    # Remove all diaries with at least one NaN.
-    n_missing = markov_ts.isnull().sum()
+def _drop_nan(diary_activity_codes):
+    # Masks all diaries without any NaN.
+    missing = diary_activity_codes == MISSING
     print("{:.2f}% of the diary entries are still missing and their diaries will be dropped."
-          .format(n_missing / markov_ts.shape[0] * 100))
-    nan_mask = markov_ts.groupby(by=lambda index: (index[0], index[1], index[2], index[3]))\
-        .apply(lambda values: values.isnull().any())
-    return pd.DataFrame(markov_ts)[markov_ts.index.droplevel('time_of_day')
-                                   .isin(nan_mask[~nan_mask].index)]
-
-
-def _remove_individuals_with_less_than_two_diaries(markov_ts):
-    valid_mask = markov_ts.groupby([markov_ts.index.get_level_values('SN1'),
-                                    markov_ts.index.get_level_values('SN2'),
-                                    markov_ts.index.get_level_values('SN3')])\
-        .apply(lambda values: len(values) == EXPECTED_NUMBER_OF_DIARY_ENTRIES)
+          .format(missing.sum() / missing.size * 100))
+    return ~missing.any(axis=1)
+
+
+def _remove_individuals_with_less_than_two_diaries(diary_index):
+    # Masks all diaries of individuals with exactly two diaries.
+    individuals = diary_index.droplevel('SN4')
+    unique_individuals = individuals.drop_duplicates()
+    individual_positions = unique_individuals.get_indexer(individuals)
+    valid_individuals = np.bincount(individual_positions) * NUMBER_OF_TIME_SLOTS ==\
+        EXPECTED_NUMBER_OF_DIARY_ENTRIES
     print('{} individuals have less than two diaries and will be removed.'
-          .format(valid_mask.shape[0] - valid_mask.sum()))
-    return markov_ts[markov_ts.index.droplevel(['SN4', 'time_of_day'])
-                     .isin(valid_mask[valid_mask].index)]
-
-
-def _add_daytype(diary_data, markov_ts):
-    weekdays = diary_data[diary_data.DDAYW2 == pytus2000.diary.DDAYW2.WEEKDAY_MON___FRI]
-    markov_ts['daytype'] = 'weekend'
-    markov_ts.loc[markov_ts.index.droplevel('time_of_day').isin(weekdays.index), 'daytype'] =\
-        'weekday'
-    markov_ts = markov_ts.reset_index(level=['SN4', 'time_of_day'])\
-        .set_index(['daytype', 'time_of_day'], append=True)
-    return markov_ts.drop('SN4', axis=1)
+          .format(len(unique_individuals) - valid_individuals.sum()))
+    return valid_individuals[individual_positions]
+
+
+def _to_markov_timeseries(diary_index, diary_activity_codes, weekday):
+    # Creates the single columned dataframe with index (SN1, SN2, SN3, daytype, time_of_day).
+    number_diaries, number_time_slots = diary_activity_codes.shape
+    times_of_day = [(DIARY_START_TIME + slot * DIARY_TIME_STEP_SIZE).time()
+                    for slot in range(number_time_slots)]
+    daytypes = np.where(weekday, 'weekday', 'weekend').astype(object)
+    index = pd.MultiIndex.from_arrays(
+        [diary_index.get_level_values(level).repeat(number_time_slots)
+         for level in ['SN1', 'SN2', 'SN3']] +
+        [daytypes.repeat(number_time_slots),
+         np.array(times_of_day * number_diaries, dtype=object)],
+        names=['SN1', 'SN2', 'SN3', 'daytype', 'time_of_day']
+    )
+    return pd.DataFrame(
+        {0: pd.Categorical.from_codes(diary_activity_codes.ravel(),
+                                      categories=list(uo.Activity))},
+        index=index
+    )
 
 
 if __name__ == '__main__':
@@ -4,7 +4,8 @@ import click
 import pandas as pd
 import pytus2000
 
-from urbanoccupants import PeopleFeature, HouseholdFeature
+from urbanoccupants import PeopleFeature, HouseholdFeature, write_artifact
+from urbanoccupants.synthpop import encode_seed
 from urbanoccupants.types import HouseholdType
 from urbanoccupants.tus import filter_features_and_drop_nan
 
@@ -23,14 +24,15 @@ def read_seed(path_to_individuals, path_to_households, path_to_output):
     e.g. a couple with children household must have at least 3 individuals, otherwise
     it is discarded as well.
 
-    Output is written in plain pickle format.
+    Feature columns are encoded as ordered categoricals, see `urbanoccupants.synthpop.encode_seed`.
+    Output is written as an artifact, see `urbanoccupants.storage`.
     """
     individual_data = _read_raw_data(path_to_individuals, path_to_households)
     print("Read {} individuals.".format(individual_data.shape[0]))
     seed = _map_to_internal_types(individual_data)
     seed = _filter_invalid_households(seed)
     print("Write {} individuals.".format(seed.shape[0]))
-    seed.to_pickle(path_to_output)
+    write_artifact(encode_seed(seed), path_to_output)
 
 
 def _read_raw_data(path_to_individuals, path_to_households):
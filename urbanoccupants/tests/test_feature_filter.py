@@ -0,0 +1,93 @@
+from datetime import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from urbanoccupants import Activity
+from urbanoccupants.tus import FeatureFilter, MarkovTimeSeries, filter_features
+
+
+PERSONS = [(1, 1, 1), (1, 1, 2), (2, 1, 1), (3, 1, 1)]
+
+
+@pytest.fixture
+def seed():
+    return pd.DataFrame(
+        index=pd.MultiIndex.from_tuples(PERSONS + [(4, 1, 1)], names=['SN1', 'SN2', 'SN3']),
+        data={
+            'feature1': [1, np.nan, 2, 2, 1],
+            'feature2': ['a', 'b', np.nan, 'a', 'b'],
+            'feature3': [1, 2, 3, 4, 5]
+        }
+    )
+
+
+@pytest.fixture
+def markov_ts():
+    # person (4, 1, 1) has no diaries, person (5, 1, 1) is not in the seed
+    persons = PERSONS + [(5, 1, 1)]
+    keys = [person + (daytype, time_of_day)
+            for person in persons
+            for daytype in ['weekday', 'weekend']
+            for time_of_day in [time(0, 0), time(12, 0)]]
+    return pd.Series(
+        [Activity.HOME] * len(keys),
+        index=pd.MultiIndex.from_tuples(keys, names=['SN1', 'SN2', 'SN3', 'daytype', 'time_of_day'])
+    )
+
+
+def persons(seed):
+    return list(seed.index)
+
+
+def diary_persons(markov_ts):
+    return sorted(set(markov_ts.index.droplevel(['daytype', 'time_of_day'])))
+
+
+@pytest.mark.parametrize('features,expected_persons', [
+    (['feature1'], [(1, 1, 1), (2, 1, 1), (3, 1, 1)]),
+    (['feature2'], [(1, 1, 1), (1, 1, 2), (3, 1, 1)]),
+    (['feature1', 'feature2'], [(1, 1, 1), (3, 1, 1)]),
+    (['feature2', 'feature1'], [(1, 1, 1), (3, 1, 1)]),
+    (['feature3'], PERSONS)
+])
+def test_filter(seed, markov_ts, features, expected_persons):
+    feature_filter = FeatureFilter(seed, markov_ts)
+    filtered_seed, filtered_markov_ts = feature_filter.filter(features)
+    assert list(filtered_seed.columns) == features
+    assert persons(filtered_seed) == expected_persons
+    assert diary_persons(filtered_markov_ts) == expected_persons
+
+
+def test_filter_features(seed, markov_ts):
+    filtered_seed, filtered_markov_ts = filter_features(seed, markov_ts, ['feature1'])
+    expected_seed = seed[['feature1']].dropna().iloc[:3]
+    person_keys = markov_ts.index.droplevel(['daytype', 'time_of_day'])
+    expected_markov_ts = markov_ts[person_keys.isin(expected_seed.index)]
+    assert filtered_seed.equals(expected_seed)
+    assert filtered_markov_ts.equals(expected_markov_ts)
+
+
+def test_filter_markov_time_series_container(seed, markov_ts):
+    feature_filter = FeatureFilter(seed, MarkovTimeSeries.from_series(markov_ts))
+    filtered_seed, filtered_markov_ts = feature_filter.filter(['feature1', 'feature2'])
+    assert persons(filtered_seed) == [(1, 1, 1), (3, 1, 1)]
+    assert list(filtered_markov_ts.person_index) == [(1, 1, 1), (3, 1, 1)]
+
+
+def test_filter_seed_keeps_individuals_without_diaries(seed, markov_ts):
+    filtered_seed = FeatureFilter(seed, markov_ts).filter_seed(['feature1'])
+    assert persons(filtered_seed) == [(1, 1, 1), (2, 1, 1), (3, 1, 1), (4, 1, 1)]
+
+
+def test_masks_are_cached_by_set_of_features(seed, markov_ts):
+    feature_filter = FeatureFilter(seed, markov_ts)
+    mask = feature_filter.seed_mask(['feature1', 'feature2'])
+    assert feature_filter.seed_mask(('feature2', 'feature1')) is mask
+
+
+def test_filter_to_empty_seed_fails(seed, markov_ts):
+    seed['feature3'] = np.nan
+    with pytest.raises(AssertionError):
+        FeatureFilter(seed, markov_ts).filter(['feature3'])
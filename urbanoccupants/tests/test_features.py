@@ -1,8 +1,16 @@
 from enum import Enum
 
+import numpy as np
 import pandas as pd
+import pytest
+from pytus2000 import individual, household
 
-from urbanoccupants.synthpop import feature_id, _pairing_function
+from urbanoccupants import PeopleFeature, HouseholdFeature
+from urbanoccupants.synthpop import feature_id, _pairing_function, encode_seed, decode_seed, \
+    cluster_sizes
+from urbanoccupants.tus import dwellingtype_map
+from urbanoccupants.types import AgeStructure, HouseholdType, EconomicActivity, Pseudo, \
+    DwellingType
 
 
 class Feature(Enum):
@@ -31,3 +39,132 @@ def test_3d_feature_tuple():
 def test_3d_tuple_series():
     assert (feature_id(pd.Series([Feature.A, Feature.B, Feature.C])) ==
             _pairing_function(_pairing_function(1, 2), 3))
+
+
+@pytest.fixture
+def seed():
+    return pd.DataFrame({
+        str(PeopleFeature.AGE): [AgeStructure.AGE_75_TO_84, AgeStructure.AGE_0_TO_4, np.nan],
+        str(HouseholdFeature.HOUSEHOLD_TYPE): [HouseholdType.ONE_PERSON_HOUSEHOLD] * 3,
+        'other': [1, 2, 3]
+    })
+
+
+def test_encoded_seed_has_integer_codes(seed):
+    encoded_seed = encode_seed(seed)
+    ages = encoded_seed[str(PeopleFeature.AGE)]
+    assert ages.cat.codes.dtype == np.int8
+    assert list(ages.cat.categories) == sorted(AgeStructure)
+    assert encoded_seed['other'].dtype == seed['other'].dtype
+
+
+@pytest.mark.parametrize('features', [
+    str(PeopleFeature.AGE),
+    (str(PeopleFeature.AGE), str(HouseholdFeature.HOUSEHOLD_TYPE)),
+    (PeopleFeature.AGE, HouseholdFeature.HOUSEHOLD_TYPE)
+])
+def test_cluster_sizes_of_encoded_seed_like_plain_seed(seed, features):
+    sizes = cluster_sizes(seed, features)
+    encoded_sizes = cluster_sizes(encode_seed(seed), features)
+    assert list(encoded_sizes) == list(sizes) == [1, 1]
+    for statistic in ['min', 'mean', 'std']:
+        assert getattr(encoded_sizes, statistic)() == getattr(sizes, statistic)()
+
+
+def test_encoded_seed_compares_like_enums(seed):
+    encoded_seed = encode_seed(seed)
+    below18 = encoded_seed[str(PeopleFeature.AGE)] < AgeStructure.AGE_18_TO_19
+    assert list(below18) == [False, True, False]
+
+
+def test_encoding_roundtrip(seed):
+    decoded_seed = decode_seed(encode_seed(seed))
+    assert decoded_seed[str(PeopleFeature.AGE)].dtype == object
+    assert decoded_seed.equals(seed)
+
+
+def test_encoding_invalid_values_fails(seed):
+    seed[str(PeopleFeature.AGE)] = HouseholdType.ONE_PERSON_HOUSEHOLD
+    with pytest.raises(ValueError):
+        encode_seed(seed)
+
+
+@pytest.mark.parametrize('feature', [
+    PeopleFeature.ECONOMIC_ACTIVITY, PeopleFeature.QUALIFICATION, PeopleFeature.CARER,
+    HouseholdFeature.HOUSEHOLD_TYPE, HouseholdFeature.REGION
+])
+def test_tus_mapping_equals_dictionary_lookup(feature):
+    tus_values = pd.Series(list(feature.tus_mapping.keys()) + [np.nan])
+    age = pd.Series(30, index=tus_values.index)
+    expected = tus_values.map(feature.tus_mapping)
+    uo_values = feature.tus_value_to_uo_value(tus_values, age)
+    assert list(uo_values.cat.categories) == sorted(feature.uo_type)
+    assert list(uo_values.astype(object).fillna('nan')) == list(expected.fillna('nan'))
+
+
+def test_tus_mapping_of_raw_values():
+    tus_values = pd.Series([key.value for key in individual.PROVCARE])
+    enum_values = pd.Series(list(individual.PROVCARE))
+    age = pd.Series(30, index=tus_values.index)
+    assert PeopleFeature.CARER.tus_value_to_uo_value(tus_values, age).equals(
+        PeopleFeature.CARER.tus_value_to_uo_value(enum_values, age)
+    )
+
+
+def test_tus_mapping_of_nan_key():
+    tus_values = pd.Series([individual.CHILD.YES, np.nan])
+    uo_values = PeopleFeature.PSEUDO.tus_value_to_uo_value(tus_values, age=None)
+    assert list(uo_values) == [Pseudo.SINGLETON, Pseudo.SINGLETON]
+
+
+def test_tus_mapping_of_age():
+    tus_values = pd.Series([8, 14, -1])
+    uo_values = PeopleFeature.AGE.tus_value_to_uo_value(tus_values, tus_values)
+    assert list(uo_values.astype(object).fillna('nan')) == \
+        [AgeStructure.AGE_8_TO_9, AgeStructure.AGE_10_TO_14, 'nan']
+
+
+def test_tus_mapping_overrides_young_and_old():
+    tus_values = pd.Series([individual.ECONACT2.ECON_ACTIVE___EMPLOYEE___FULL_TIME] * 2 + [np.nan])
+    age = pd.Series([12, 80, 40])
+    uo_values = PeopleFeature.ECONOMIC_ACTIVITY.tus_value_to_uo_value(tus_values, age)
+    assert list(uo_values.astype(object).fillna('nan')) == \
+        [EconomicActivity.BELOW_16, EconomicActivity.ABOVE_74, 'nan']
+
+
+def test_dwelling_type_mapping():
+    hq13 = pd.DataFrame([
+        [household.HQ13A.A_HOUSE_OR_BUNGALOW, household.HQ13B.SEMI_DETACHED, np.nan, np.nan],
+        [household.HQ13A.A_FLAT_OR_MAISONETTE, np.nan,
+         household.HQ13C.A_PURPOSE_BUILT_BLOCK, np.nan],
+        [household.HQ13A.OTHER, np.nan, np.nan,
+         household.HQ13D.A_CARAVAN__MOBILE_HOME_OR_HOUSEBOAT],
+        [household.HQ13A.A_ROOMROOMS, np.nan, np.nan, np.nan],
+        [household.HQ13A.MISSING1, np.nan, np.nan, np.nan],
+        [household.HQ13A.A_HOUSE_OR_BUNGALOW, np.nan, np.nan, np.nan]
+    ], columns=HouseholdFeature.DWELLING_TYPE.tus_variable_name, index=list('abcdef'))
+    uo_values = HouseholdFeature.DWELLING_TYPE.tus_value_to_uo_value(hq13, age=None)
+    assert list(uo_values.index) == list('abcdef')
+    assert list(uo_values.astype(object).fillna('nan')) == [
+        DwellingType.SEMI_DETACHED_WHOLE_HOUSE_OR_BUNGALOW,
+        DwellingType.FLAT_PURPOSE_BUILT_BLOCK,
+        DwellingType.CARAVAN,
+        DwellingType.OTHER,
+        'nan',
+        'nan'
+    ]
+
+
+@pytest.mark.parametrize('row,dwelling_type', [
+    ((household.HQ13A.A_HOUSE_OR_BUNGALOW, household.HQ13B.DETACHED, np.nan, np.nan),
+     DwellingType.DETACHED_WHOLE_HOUSE_OR_BUNGALOW),
+    ((household.HQ13A.A_FLAT_OR_MAISONETTE.value, np.nan,
+      household.HQ13C.A_CONVERTED_HOUSESOME_OTHER_KIND_OF_BUILDING.value, np.nan),
+     DwellingType.FLAT_CONVERTED_OR_SHARED_HOUSE)
+])
+def test_dwelling_type_map_of_single_household(row, dwelling_type):
+    assert dwellingtype_map(row) is dwelling_type
+
+
+def test_dwelling_type_map_of_missing_dwelling_type():
+    assert np.isnan(dwellingtype_map((household.HQ13A.MISSING1, np.nan, np.nan, np.nan)))
@@ -15,7 +15,9 @@ import pandas as pd
 from pandas.util.testing import assert_series_equal
 import pytest
 
-from urbanoccupants.hipf import fit_hipf, _all_residuals
+from urbanoccupants.hipf import fit_hipf, fit_hipf_regions, HipfTrace, _all_residuals, \
+    _ControlIndicators, _HouseholdMembers
+from urbanoccupants.synthpop import run_hipf
 
 
 RESOURCES_PATH = Path(__file__).parent / 'resources'
@@ -73,7 +75,6 @@ def assert_weights_equal(expected_weights, weights, precision=1):
     assert_series_equal(expected_weights, weights, check_less_precise=precision)
 
 
-@pytest.mark.xfail(reason="Currently the algorithms do not seem to be equal.")
 def test_same_result_like_mlipf(reference_sample, expected_weights, controls_individuals,
                                 controls_households):
     weights = fit_hipf(
@@ -143,3 +144,170 @@ def test_fails_with_invalid_type_reference_sample(reference_sample,
             controls_households=controls_households,
             maxiter=2
         )
+
+
+def test_indicators_fit_like_mapping_to_controls(reference_sample, controls_individuals):
+    weights = pd.Series(np.linspace(0.5, 1.5, reference_sample.shape[0]),
+                        index=reference_sample.index)
+    expected_weights = weights.copy()
+    for control_name, control_values in controls_individuals.items():
+        categories = reference_sample[control_name]
+        summed_weights = expected_weights.groupby(categories).sum()
+        expected_weights = (expected_weights * categories.map(control_values) /
+                            categories.map(summed_weights))
+    fitted_weights = _ControlIndicators(reference_sample, [controls_individuals]).fit(
+        weights.values[np.newaxis, :], regions=np.ones(1, dtype=np.bool_)
+    )
+    np.testing.assert_allclose(fitted_weights[0], expected_weights.values)
+
+
+def test_indicators_fit_unknown_categories_to_nan(reference_sample):
+    fitted_weights = _ControlIndicators(reference_sample, [{'GENDER': {'X': 434}}]).fit(
+        np.ones((1, reference_sample.shape[0])), regions=np.ones(1, dtype=np.bool_)
+    )[0]
+    unknown = (reference_sample['GENDER'] != 'X').values
+    assert np.isnan(fitted_weights[unknown]).all()
+    assert np.isclose(fitted_weights[~unknown].sum(), 434)
+
+
+def test_household_members_of_unsorted_sample():
+    person_index = pd.MultiIndex.from_tuples([(2, 5), (1, 3), (2, 4), (1, 7), (3, 8)])
+    household_members = _HouseholdMembers(pd.Index([1, 2, 3]), person_index)
+    person_weights = household_members.expand(np.array([[1.0, 2.0, 3.0]]))
+    assert list(person_weights[0]) == [2.0, 1.0, 2.0, 1.0, 3.0]
+    household_weights = household_members.aggregate(np.array([[2.0, 1.0, 4.0, np.nan, np.nan]]))
+    assert list(household_weights[0, :2]) == [1.0, 3.0]
+    assert np.isnan(household_weights[0, 2])
+
+
+def test_fit_regions_like_single_regions(reference_sample, controls_households,
+                                         controls_individuals):
+    controls_ppl = {
+        'region1': controls_individuals,
+        'region2': {'WKSTAT': {0: 400, 1: 454}, 'GENDER': {'X': 420, 'Y': 434}}
+    }
+    controls_hh = {'region1': controls_households, 'region2': {'CAR': {0: 120, 1: 252}}}
+    weights = fit_hipf_regions(
+        reference_sample=reference_sample,
+        controls_individuals=controls_ppl,
+        controls_households=controls_hh,
+        weights_tol=1e-6,
+        residuals_tol=1e-6,
+        maxiter=200
+    )
+    assert list(weights.index) == ['region1', 'region2']
+    for region in ['region1', 'region2']:
+        expected_weights = fit_hipf(
+            reference_sample=reference_sample,
+            controls_individuals=controls_ppl[region],
+            controls_households=controls_hh[region],
+            weights_tol=1e-6,
+            residuals_tol=1e-6,
+            maxiter=200
+        )
+        np.testing.assert_allclose(weights.loc[region].values, expected_weights.values)
+
+
+def test_fit_regions_fails_with_different_categories(reference_sample, controls_households,
+                                                     controls_individuals):
+    with pytest.raises(AssertionError):
+        fit_hipf_regions(
+            reference_sample=reference_sample,
+            controls_individuals={'region1': controls_individuals,
+                                  'region2': {'WKSTAT': {0: 854}, 'GENDER': {'X': 854}}},
+            controls_households={'region1': controls_households,
+                                 'region2': controls_households},
+            maxiter=2
+        )
+
+
+def test_warm_start_from_solution(reference_sample, controls_households, controls_individuals):
+    params = {
+        'reference_sample': reference_sample,
+        'controls_individuals': controls_individuals,
+        'controls_households': controls_households,
+        'weights_tol': 1e-6,
+        'residuals_tol': 1e-6
+    }
+    weights = fit_hipf(maxiter=200, **params)
+    warm_started_weights = fit_hipf(maxiter=1, initial_weights=weights, **params)
+    np.testing.assert_allclose(warm_started_weights.values, weights.values, rtol=1e-4)
+
+
+def test_fails_with_incomplete_initial_weights(reference_sample, controls_households,
+                                               controls_individuals):
+    with pytest.raises(AssertionError):
+        fit_hipf(
+            reference_sample=reference_sample,
+            controls_individuals=controls_individuals,
+            controls_households=controls_households,
+            initial_weights=pd.Series({0: 1.0}),
+            maxiter=2
+        )
+
+
+def test_trace_records_each_iteration(reference_sample, controls_households,
+                                      controls_individuals):
+    trace = HipfTrace()
+    weights = fit_hipf(
+        reference_sample=reference_sample,
+        controls_individuals=controls_individuals,
+        controls_households=controls_households,
+        residuals_tol=1e-6,
+        maxiter=200,
+        trace=trace
+    )
+    number_iterations = trace.iterations[None]
+    assert 1 < number_iterations < 200
+    assert list(trace.step_times.columns) == HipfTrace.STEPS
+    assert len(trace.step_times.index) == number_iterations
+    assert (trace.step_times.values >= 0).all()
+    residuals = _all_residuals(reference_sample, weights, controls_households,
+                               controls_individuals)
+    assert trace.max_residuals[None].iloc[-1] == pytest.approx(residuals.abs().max())
+    assert trace.max_residuals[None].iloc[-1] < 1e-6
+    assert trace.max_residuals[None].iloc[-2] >= 1e-6
+
+
+def test_trace_records_regions_until_converged(reference_sample, controls_households,
+                                               controls_individuals):
+    solution = fit_hipf(
+        reference_sample=reference_sample,
+        controls_individuals=controls_individuals,
+        controls_households=controls_households,
+        weights_tol=1e-6,
+        maxiter=200
+    )
+    trace = HipfTrace()
+    fit_hipf_regions(
+        reference_sample=reference_sample,
+        initial_weights={'region1': solution, 'region2': pd.Series(1.0, index=solution.index)},
+        controls_individuals={
+            'region1': controls_individuals,
+            'region2': {'WKSTAT': {0: 400, 1: 454}, 'GENDER': {'X': 420, 'Y': 434}}
+        },
+        controls_households={'region1': controls_households, 'region2': {'CAR': {0: 120, 1: 252}}},
+        weights_tol=1e-3,
+        maxiter=200,
+        trace=trace
+    )
+    iterations = trace.iterations
+    assert iterations['region1'] < iterations['region2']
+    max_weight_changes = trace.max_weight_changes
+    for region in ['region1', 'region2']:
+        assert max_weight_changes[region].count() == iterations[region]
+        assert max_weight_changes[region].dropna().iloc[-1] < 1e-3
+
+
+def test_run_hipf_returns_region_and_weights(reference_sample, controls_households,
+                                             controls_individuals):
+    controls_hh = {name: pd.Series(control) for name, control in controls_households.items()}
+    controls_ppl = {name: pd.Series(control) for name, control in controls_individuals.items()}
+    trace = HipfTrace()
+    weights = dict([
+        run_hipf((reference_sample, controls_hh, controls_ppl, 'region1')),
+        run_hipf((reference_sample, controls_hh, controls_ppl, 'region2', trace))
+    ])
+    assert sorted(weights.keys()) == ['region1', 'region2']
+    np.testing.assert_allclose(weights['region1'].values, weights['region2'].values)
+    assert trace.iterations[None] > 0
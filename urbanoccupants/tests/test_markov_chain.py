@@ -4,6 +4,7 @@ import math
 from io import StringIO
 import random
 
+import numpy as np
 import pandas as pd
 from pandas.util.testing import assert_frame_equal
 import pytest
@@ -98,6 +99,15 @@ def markov_chain_from_single_time_series(single_time_series):
     )
 
 
+@pytest.fixture
+def markov_chain_from_activity_codes(weekday_time_series, weekend_day_time_series):
+    return WeekMarkovChain.from_activity_codes(
+        weekday_activity_codes=person.activity_codes(weekday_time_series.values.T),
+        weekend_activity_codes=person.activity_codes(weekend_day_time_series.values.T),
+        time_step_size=timedelta(hours=12)
+    )
+
+
 @pytest.fixture
 def markov_chain_as_dataframe():
     day_column = ['weekday'] * 4 + ['weekend'] * 4
@@ -224,3 +234,284 @@ def test_dataframe_representation(markov_chain, markov_chain_as_dataframe):
         check_exact=False,
         check_less_precise=2
     )
+
+
+def test_transition_probabilities_shape(markov_chain):
+    assert markov_chain.transition_probabilities.shape == (2, 2, len(Activity), len(Activity))
+
+
+@pytest.mark.parametrize('day,time_slot,from_activity,to_activity,probability', [
+    ('weekday', 0, Activity.HOME, Activity.HOME, 1 / 3),
+    ('weekday', 0, Activity.HOME, Activity.NOT_AT_HOME, 2 / 3),
+    ('weekend', 0, Activity.HOME, Activity.HOME, 2 / 3),
+    ('weekend', 1, Activity.NOT_AT_HOME, Activity.HOME, 1.0),
+    ('weekend', 1, Activity.SLEEP_AT_HOME, Activity.HOME, 0.0)
+])
+def test_transition_probabilities(markov_chain, day, time_slot, from_activity, to_activity,
+                                  probability):
+    activities = list(Activity)
+    assert math.isclose(
+        markov_chain.transition_probabilities[
+            person.DAY_TYPES.index(day),
+            time_slot,
+            activities.index(from_activity),
+            activities.index(to_activity)
+        ],
+        probability
+    )
+
+
+def test_transition_probabilities_are_read_only(markov_chain):
+    with pytest.raises(ValueError):
+        markov_chain.transition_probabilities[0, 0, 0, 0] = 0.5
+
+
+def test_cumulative_probabilities(markov_chain):
+    activities = list(Activity)
+    weekday_home = markov_chain.cumulative_probabilities[
+        person.DAY_TYPES.index('weekday'), 0, activities.index(Activity.HOME)
+    ]
+    weekday_not_at_home = markov_chain.cumulative_probabilities[
+        person.DAY_TYPES.index('weekday'), 0, activities.index(Activity.NOT_AT_HOME)
+    ]
+    assert math.isclose(weekday_home[activities.index(Activity.HOME)], 1 / 3)
+    assert weekday_home[-1] == 1.0
+    assert (np.diff(weekday_home) >= 0).all()
+    assert (weekday_not_at_home == 0.0).all()
+
+
+def test_cumulative_probabilities_are_read_only(markov_chain):
+    with pytest.raises(ValueError):
+        markov_chain.cumulative_probabilities[0, 0, 0, 0] = 0.5
+
+
+@pytest.mark.parametrize('random_number,expected_activity', [
+    (0.0, Activity.HOME),
+    (0.33, Activity.HOME),
+    (0.34, Activity.NOT_AT_HOME),
+    (0.999, Activity.NOT_AT_HOME)
+])
+def test_move_by_inverse_transform_sampling(markov_chain, random_number, expected_activity):
+    next_activity = markov_chain.move(
+        current_state=Activity.HOME,
+        current_time=MIDNIGHT_WEEKDAY,
+        random_func=lambda a, b: random_number
+    )
+    assert next_activity == expected_activity
+
+
+def test_transition_counts():
+    activity_codes = np.array([
+        [[0, 2], [0, 0]],
+        [[0, 0], [1, 2]],
+        [[0, 2], [0, 0]]
+    ])
+    counts = person.transition_counts(activity_codes, group_codes=[1, 0, 1], number_groups=2)
+    assert counts.shape == (2, 2, 2, len(Activity), len(Activity))
+    assert counts.sum() == 3 * 2 * 2
+    assert counts[1, 0, 0, 0, 2] == 2 # group 1, weekday, first slot, HOME -> NOT_AT_HOME
+    assert counts[1, 0, 1, 2, 0] == 2 # last slot wraps around to first slot of same day
+    assert counts[0, 1, 0, 1, 2] == 1
+    assert counts[0, 0, 0, 0, 0] == 1
+
+
+def test_from_transition_counts(markov_chain, weekday_time_series, weekend_day_time_series):
+    activity_codes = np.stack([person.activity_codes(weekday_time_series.values.T),
+                               person.activity_codes(weekend_day_time_series.values.T)], axis=1)
+    counts = person.transition_counts(activity_codes, group_codes=[0, 0, 0], number_groups=1)
+    chain = WeekMarkovChain.from_transition_counts(counts[0], timedelta(hours=12))
+    assert (chain.transition_probabilities == markov_chain.transition_probabilities).all()
+
+
+def test_ticks_per_week(markov_chain):
+    assert markov_chain.ticks_per_week == 14
+
+
+@pytest.mark.parametrize('time_stamp,tick', [
+    (datetime(2017, 3, 6, 0, 0), 0), # Monday
+    (MIDNIGHT_WEEKDAY, 4),
+    (NOON_WEEKDAY, 5),
+    (MIDNIGHT_WEEKEND, 12),
+    (NOON_WEEKEND, 13)
+])
+def test_time_to_tick(markov_chain, time_stamp, tick):
+    assert markov_chain.time_to_tick(time_stamp) == tick
+
+
+def test_tick_to_time(markov_chain):
+    week_start = datetime(2017, 3, 6, 0, 0)
+    assert markov_chain.tick_to_time(4, week_start) == MIDNIGHT_WEEKDAY
+    assert markov_chain.tick_to_time(14, week_start) == datetime(2017, 3, 13, 0, 0)
+
+
+def test_tick_to_time_fails_for_invalid_week_start(markov_chain):
+    with pytest.raises(AssertionError):
+        markov_chain.tick_to_time(4, MIDNIGHT_WEEKDAY)
+
+
+@pytest.mark.parametrize('time_stamp', [
+    MIDNIGHT_WEEKDAY, NOON_WEEKDAY, MIDNIGHT_WEEKEND, NOON_WEEKEND
+])
+def test_valid_states_at_tick(markov_chain, time_stamp):
+    tick = markov_chain.time_to_tick(time_stamp)
+    assert markov_chain.valid_states_at_tick(tick) == markov_chain.valid_states(time_stamp)
+    assert markov_chain.valid_states_at_tick(tick + 3 * 14) == markov_chain.valid_states(time_stamp)
+
+
+def test_move_at_tick(markov_chain):
+    tick = markov_chain.time_to_tick(MIDNIGHT_WEEKDAY)
+    for random_number in [0.0, 0.5, 0.999]:
+        random_func = lambda a, b: random_number
+        expected = markov_chain.move(Activity.HOME, MIDNIGHT_WEEKDAY, random_func)
+        assert markov_chain.move_at_tick(Activity.HOME, tick, random_func) == expected
+        assert markov_chain.move_at_tick(Activity.HOME, tick + 14, random_func) == expected
+
+
+def test_resample_to_same_time_step_size(markov_chain):
+    resampled = markov_chain.resample(timedelta(hours=12))
+    assert resampled.time_step_size == timedelta(hours=12)
+    assert np.allclose(resampled.transition_probabilities, markov_chain.transition_probabilities)
+
+
+def test_resample_multiplies_transition_matrices(markov_chain):
+    resampled = markov_chain.resample(timedelta(hours=24))
+    probabilities = markov_chain.transition_probabilities
+    assert resampled.time_step_size == timedelta(hours=24)
+    assert resampled.transition_probabilities.shape == (2, 1, len(Activity), len(Activity))
+    for day in range(2):
+        assert np.allclose(
+            resampled.transition_probabilities[day, 0],
+            probabilities[day, 0] @ probabilities[day, 1]
+        )
+
+
+def test_resampled_chain_moves_like_original(markov_chain_from_single_time_series, random_func):
+    resampled = markov_chain_from_single_time_series.resample(timedelta(hours=24))
+    for time_stamp in [MIDNIGHT_WEEKDAY, MIDNIGHT_WEEKEND]:
+        assert resampled.move(Activity.NOT_AT_HOME, time_stamp, random_func) == \
+            Activity.NOT_AT_HOME
+
+
+@pytest.mark.parametrize('time_step_size', [
+    timedelta(hours=6), timedelta(hours=18), timedelta(hours=36)
+])
+def test_resample_to_invalid_time_step_size_fails(markov_chain, time_step_size):
+    with pytest.raises(ValueError):
+        markov_chain.resample(time_step_size)
+
+
+def test_move_from_invalid_state_fails(markov_chain, random_func):
+    with pytest.raises(ValueError):
+        markov_chain.move(
+            current_state=Activity.NOT_AT_HOME,
+            current_time=MIDNIGHT_WEEKDAY,
+            random_func=random_func
+        )
+
+
+def test_activity_codes_are_indices_of_activities():
+    codes = person.activity_codes([[Activity.HOME, Activity.NOT_AT_HOME],
+                                   [Activity.SLEEP_AT_HOME, Activity.HOME]])
+    assert codes.dtype == np.int8
+    assert codes.tolist() == [[0, 2], [1, 0]]
+
+
+def test_activity_codes_fail_for_missing_values():
+    with pytest.raises(ValueError):
+        person.activity_codes([Activity.HOME, None])
+
+
+def test_same_probabilities_from_activity_codes(markov_chain, markov_chain_from_activity_codes):
+    assert (markov_chain.transition_probabilities ==
+            markov_chain_from_activity_codes.transition_probabilities).all()
+
+
+def test_activity_codes_with_invalid_number_of_time_slots_fail(weekday_time_series):
+    activity_codes = person.activity_codes(weekday_time_series.values.T)
+    with pytest.raises(ValueError):
+        WeekMarkovChain.from_activity_codes(
+            weekday_activity_codes=activity_codes,
+            weekend_activity_codes=activity_codes,
+            time_step_size=timedelta(hours=6)
+        )
+
+
+def test_arrow_representation(markov_chain):
+    pytest.importorskip('pyarrow')
+    df = markov_chain.to_dataframe()
+    table = markov_chain.to_arrow().to_pandas()
+    assert list(table[person.MARKOV_CHAIN_DAY_COLUMN_NAME]) == list(df.index.get_level_values(0))
+    assert (list(table[person.MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME]) ==
+            list(df.index.get_level_values(1)))
+    assert (list(table[person.MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME]) ==
+            [str(activity) for activity in df[person.MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME]])
+    assert (list(table[person.MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME]) ==
+            [str(activity) for activity in df[person.MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME]])
+    assert (list(table[person.MARKOV_CHAIN_PROBABILITY_COLUMN_NAME]) ==
+            list(df[person.MARKOV_CHAIN_PROBABILITY_COLUMN_NAME]))
+
+
+def test_dataframe_roundtrip(markov_chain):
+    restored_markov_chain = WeekMarkovChain.from_dataframe(
+        markov_chain.to_dataframe(),
+        time_step_size=markov_chain.time_step_size
+    )
+    assert (restored_markov_chain.transition_probabilities ==
+            markov_chain.transition_probabilities).all()
+
+
+def test_trusted_construction_takes_probabilities_as_they_are(dead_locked_markov_chain):
+    transition_probabilities = np.array(dead_locked_markov_chain.transition_probabilities)
+    transition_probabilities[0, 0] = 0 # invalidate by removing all transitions at midnight
+    restored_markov_chain = WeekMarkovChain.from_transition_probabilities(
+        transition_probabilities,
+        time_step_size=dead_locked_markov_chain.time_step_size,
+        trusted=True
+    )
+    assert (restored_markov_chain.transition_probabilities == transition_probabilities).all()
+
+
+def test_untrusted_construction_repairs_dead_locks(dead_locked_markov_chain):
+    transition_probabilities = np.array(dead_locked_markov_chain.transition_probabilities)
+    transition_probabilities[0, 0] = 0 # invalidate by removing all transitions at midnight
+    restored_markov_chain = WeekMarkovChain.from_transition_probabilities(
+        transition_probabilities,
+        time_step_size=dead_locked_markov_chain.time_step_size
+    )
+    # the end states at noon of weekdays and weekend days must be valid at midnight
+    assert (set(restored_markov_chain.valid_states(MIDNIGHT_WEEKDAY)) ==
+            {Activity.HOME, Activity.NOT_AT_HOME})
+
+
+def test_untrusted_construction_fails_with_invalid_probabilities(markov_chain):
+    transition_probabilities = np.array(markov_chain.transition_probabilities) * 0.5
+    with pytest.raises(AssertionError):
+        WeekMarkovChain.from_transition_probabilities(
+            transition_probabilities,
+            time_step_size=markov_chain.time_step_size
+        )
+
+
+def test_binary_roundtrip_of_markov_chains(markov_chain, dead_locked_markov_chain, tmpdir):
+    path = str(tmpdir.join('markov-chains.bin'))
+    person.write_week_markov_chains({3: markov_chain, 7: dead_locked_markov_chain}, path)
+    markov_chains = person.read_week_markov_chains(path)
+    assert list(markov_chains.keys()) == [3, 7]
+    assert markov_chains[3].time_step_size == markov_chain.time_step_size
+    assert (markov_chains[3].transition_probabilities ==
+            markov_chain.transition_probabilities).all()
+    assert (markov_chains[7].transition_probabilities ==
+            dead_locked_markov_chain.transition_probabilities).all()
+
+
+def test_writing_no_markov_chains_fails(tmpdir):
+    with pytest.raises(ValueError) as error:
+        person.write_week_markov_chains({}, str(tmpdir.join('markov-chains.bin')))
+    assert 'no markov chains' in str(error.value)
+
+
+def test_reading_invalid_markov_chains_file_fails(tmpdir):
+    path = tmpdir.join('markov-chains.bin')
+    path.write('not a markov chain')
+    with pytest.raises(ValueError):
+        person.read_week_markov_chains(str(path))
@@ -0,0 +1,119 @@
+from datetime import timedelta
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from urbanoccupants import Activity, WeekMarkovChain, MarkovChainCache
+import urbanoccupants.utils
+
+
+TIME_STEP_SIZE = timedelta(hours=12)
+
+
+@pytest.fixture
+def markov_chain():
+    transition_probabilities = np.zeros((2, 2, len(Activity), len(Activity)))
+    transition_probabilities[:, :, 0, 0] = 1.0
+    return WeekMarkovChain.from_transition_probabilities(transition_probabilities, TIME_STEP_SIZE)
+
+
+@pytest.fixture
+def cache_path(tmpdir):
+    return Path(str(tmpdir.join('cache')))
+
+
+def entry_size(cache_path):
+    return next(cache_path.iterdir()).stat().st_size
+
+
+def test_cache_miss(cache_path):
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=2**20)
+    assert cache.get(cache.key('seed', TIME_STEP_SIZE)) is None
+
+
+def test_cache_hit(cache_path, markov_chain):
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=2**20)
+    key = cache.key('seed', TIME_STEP_SIZE)
+    cache.put(key, {4: markov_chain})
+    markov_chains = MarkovChainCache(cache_path, max_size_in_bytes=2**20).get(key)
+    assert list(markov_chains.keys()) == [4]
+    assert (markov_chains[4].transition_probabilities ==
+            markov_chain.transition_probabilities).all()
+
+
+def test_key_depends_on_file_content(tmpdir):
+    path = Path(str(tmpdir.join('seed.pickle')))
+    path.write_bytes(b'seed')
+    key1 = MarkovChainCache.key(path, TIME_STEP_SIZE)
+    assert MarkovChainCache.key(path, TIME_STEP_SIZE) == key1
+    path.write_bytes(b'another seed')
+    assert MarkovChainCache.key(path, TIME_STEP_SIZE) != key1
+
+
+def test_key_depends_on_order_of_inputs():
+    assert MarkovChainCache.key('a', 'b') != MarkovChainCache.key('b', 'a')
+    assert MarkovChainCache.key('ab', '') != MarkovChainCache.key('a', 'b')
+
+
+def test_key_depends_on_version(monkeypatch):
+    key1 = MarkovChainCache.key('seed', TIME_STEP_SIZE)
+    monkeypatch.setattr(urbanoccupants.utils, 'MARKOV_CHAIN_CACHE_VERSION',
+                        urbanoccupants.utils.MARKOV_CHAIN_CACHE_VERSION + 1)
+    assert MarkovChainCache.key('seed', TIME_STEP_SIZE) != key1
+
+
+def test_failed_put_leaves_no_files(cache_path, monkeypatch):
+    def failing_write(markov_chains, path):
+        Path(path).write_bytes(b'incomplete')
+        raise IOError()
+    monkeypatch.setattr(urbanoccupants.utils, 'write_week_markov_chains', failing_write)
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=2**20)
+    with pytest.raises(IOError):
+        cache.put('a', {})
+    assert list(cache_path.iterdir()) == []
+
+
+def test_leftover_temporary_files_get_removed(cache_path, markov_chain):
+    leftover = cache_path / ('leftover' + urbanoccupants.utils.MARKOV_CHAIN_CACHE_TMP_FILE_SUFFIX)
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=2**20)
+    leftover.write_bytes(b'incomplete')
+    os.utime(str(leftover), (1000, 1000))
+    cache.put('a', {1: markov_chain})
+    assert not leftover.exists()
+    assert cache.get('a') is not None
+
+
+def test_temporary_files_of_running_writes_are_kept(cache_path, markov_chain):
+    in_progress = cache_path / ('in-progress' +
+                                urbanoccupants.utils.MARKOV_CHAIN_CACHE_TMP_FILE_SUFFIX)
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=1)
+    in_progress.write_bytes(b'incomplete')
+    cache.put('a', {1: markov_chain})
+    cache.put('b', {1: markov_chain})
+    assert in_progress.exists()
+    assert cache.get('b') is not None
+
+
+def test_least_recently_used_entry_gets_evicted(cache_path, markov_chain):
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=2**20)
+    cache.put('a', {1: markov_chain})
+    size = entry_size(cache_path)
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=int(2.5 * size))
+    cache.put('b', {1: markov_chain})
+    os.utime(str(cache_path / 'a.chains'), (1000, 1000))
+    os.utime(str(cache_path / 'b.chains'), (2000, 2000))
+    assert cache.get('a') is not None # marks 'a' as recently used
+    cache.put('c', {1: markov_chain})
+    assert cache.get('a') is not None
+    assert cache.get('b') is None
+    assert cache.get('c') is not None
+
+
+def test_most_recent_entry_is_never_evicted(cache_path, markov_chain):
+    cache = MarkovChainCache(cache_path, max_size_in_bytes=1)
+    cache.put('a', {1: markov_chain})
+    cache.put('b', {1: markov_chain})
+    assert cache.get('a') is None
+    assert cache.get('b') is not None
@@ -0,0 +1,139 @@
+from datetime import time, timedelta
+from itertools import product
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from urbanoccupants import Activity, WeekMarkovChain
+from urbanoccupants.tus import MarkovTimeSeries, markov_chain_for_cluster, \
+    markov_chains_for_clusters
+
+
+PERSONS = [(1, 1, 1), (1, 1, 2), (2, 1, 1)]
+TIMES = [time(0, 0), time(12, 0)]
+ACTIVITIES = {
+    ((1, 1, 1), 'weekday'): [Activity.HOME, Activity.NOT_AT_HOME],
+    ((1, 1, 1), 'weekend'): [Activity.HOME, Activity.HOME],
+    ((1, 1, 2), 'weekday'): [Activity.HOME, Activity.HOME],
+    ((1, 1, 2), 'weekend'): [Activity.HOME, Activity.HOME],
+    ((2, 1, 1), 'weekday'): [Activity.HOME, Activity.NOT_AT_HOME],
+    ((2, 1, 1), 'weekend'): [Activity.SLEEP_AT_HOME, Activity.NOT_AT_HOME]
+}
+
+
+@pytest.fixture
+def markov_ts_series():
+    keys = [(sn1, sn2, sn3, daytype, time_of_day)
+            for (sn1, sn2, sn3), daytype, time_of_day
+            in product(PERSONS, ['weekday', 'weekend'], TIMES)]
+    values = [ACTIVITIES[(key[:3], key[3])][TIMES.index(key[4])] for key in keys]
+    index = pd.MultiIndex.from_tuples(keys, names=['SN1', 'SN2', 'SN3', 'daytype', 'time_of_day'])
+    return pd.Series(values, index=index)
+
+
+@pytest.fixture
+def markov_ts(markov_ts_series):
+    return MarkovTimeSeries.from_series(markov_ts_series)
+
+
+def test_shape(markov_ts):
+    assert len(markov_ts) == 3
+    assert markov_ts.activity_codes.shape == (3, 2, 2)
+    assert markov_ts.activity_codes.dtype == np.int8
+    assert markov_ts.time_step_size == timedelta(hours=12)
+
+
+def test_activity_codes_are_read_only(markov_ts):
+    with pytest.raises(ValueError):
+        markov_ts.activity_codes[0, 0, 0] = 0
+
+
+def test_from_series_does_not_depend_on_order(markov_ts, markov_ts_series):
+    shuffled = markov_ts_series.iloc[np.random.RandomState(42).permutation(12)]
+    shuffled_ts = MarkovTimeSeries.from_series(shuffled).select(markov_ts.person_index)
+    assert (shuffled_ts.activity_codes == markov_ts.activity_codes).all()
+
+
+def test_from_single_column_dataframe(markov_ts, markov_ts_series):
+    markov_ts_from_df = MarkovTimeSeries.from_series(pd.DataFrame(markov_ts_series))
+    assert (markov_ts_from_df.activity_codes == markov_ts.activity_codes).all()
+
+
+def test_roundtrip(markov_ts, markov_ts_series):
+    series = markov_ts.to_series()
+    assert list(series.index) == list(markov_ts_series.index)
+    assert list(series.values) == list(markov_ts_series.values)
+
+
+def test_select(markov_ts):
+    selected = markov_ts.select([(2, 1, 1), (1, 1, 1)])
+    assert list(selected.person_index) == [(2, 1, 1), (1, 1, 1)]
+    weekend = selected.to_series().loc[(2, 1, 1, 'weekend')]
+    assert list(weekend) == ACTIVITIES[((2, 1, 1), 'weekend')]
+
+
+def test_select_unknown_person_fails(markov_ts):
+    with pytest.raises(ValueError):
+        markov_ts.select([(3, 1, 1)])
+
+
+def test_from_series_with_duplicates_fails(markov_ts_series):
+    with pytest.raises(ValueError):
+        MarkovTimeSeries.from_series(pd.concat([markov_ts_series, markov_ts_series.iloc[:1]]))
+
+
+def test_from_incomplete_series_fails(markov_ts_series):
+    with pytest.raises(ValueError):
+        MarkovTimeSeries.from_series(markov_ts_series.iloc[:-2])
+
+
+def test_subsample(markov_ts):
+    subsampled = markov_ts.subsample(timedelta(hours=24))
+    assert subsampled.time_step_size == timedelta(hours=24)
+    assert (subsampled.activity_codes == markov_ts.activity_codes[:, :, :1]).all()
+
+
+def test_markov_chain_for_cluster(markov_ts, markov_ts_series):
+    group_of_people = pd.DataFrame(index=markov_ts.person_index[:2])
+    features, chain = markov_chain_for_cluster(
+        (markov_ts, group_of_people, 'features', timedelta(hours=12))
+    )
+    expected = WeekMarkovChain(
+        weekday_time_series=pd.DataFrame({
+            'person1': ACTIVITIES[((1, 1, 1), 'weekday')],
+            'person2': ACTIVITIES[((1, 1, 2), 'weekday')]
+        }, index=TIMES),
+        weekend_time_series=pd.DataFrame({
+            'person1': ACTIVITIES[((1, 1, 1), 'weekend')],
+            'person2': ACTIVITIES[((1, 1, 2), 'weekend')]
+        }, index=TIMES),
+        time_step_size=timedelta(hours=12)
+    )
+    assert features == 'features'
+    assert (chain.transition_probabilities == expected.transition_probabilities).all()
+    _, chain_from_series = markov_chain_for_cluster(
+        (markov_ts_series, group_of_people, 'features', timedelta(hours=12))
+    )
+    assert (chain_from_series.transition_probabilities == expected.transition_probabilities).all()
+
+
+def test_markov_chains_for_clusters(markov_ts):
+    cluster_labels = pd.Series(['a', 'b', 'a'], index=markov_ts.person_index)
+    markov_chains = markov_chains_for_clusters(markov_ts, cluster_labels, timedelta(hours=12))
+    assert set(markov_chains.keys()) == {'a', 'b'}
+    for label, persons in [('a', [(1, 1, 1), (2, 1, 1)]), ('b', [(1, 1, 2)])]:
+        group_of_people = pd.DataFrame(index=pd.MultiIndex.from_tuples(persons))
+        _, expected = markov_chain_for_cluster(
+            (markov_ts, group_of_people, label, timedelta(hours=12))
+        )
+        assert (markov_chains[label].transition_probabilities ==
+                expected.transition_probabilities).all()
+
+
+def test_markov_chains_for_clusters_ignores_unlabeled_people(markov_ts):
+    cluster_labels = pd.Series([1], index=markov_ts.person_index[1:2])
+    markov_chains = markov_chains_for_clusters(markov_ts, cluster_labels, timedelta(hours=24))
+    assert list(markov_chains.keys()) == [1]
+    assert markov_chains[1].time_step_size == timedelta(hours=24)
+    assert markov_chains[1].valid_states_at_tick(0) == [Activity.HOME]
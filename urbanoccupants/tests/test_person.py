@@ -3,10 +3,12 @@ from datetime import datetime, timedelta, time
 from unittest.mock import Mock
 import random
 
+import numpy as np
 import pykov
 import pytest
 
-from urbanoccupants import Person, Activity, WeekMarkovChain
+from urbanoccupants import Person, PopulationSimulator, Activity, WeekMarkovChain
+from urbanoccupants.person import activity_codes
 
 
 TIME_STEP_SIZE = timedelta(hours=1)
@@ -19,6 +21,39 @@ def week_markov_chain():
     return chain
 
 
+@pytest.fixture
+def deterministic_week_markov_chain():
+    # everyone is at home in the first half of the day, and not at home in the second half
+    day = activity_codes([Activity.HOME] * 12 + [Activity.NOT_AT_HOME] * 12)
+    return WeekMarkovChain.from_activity_codes(
+        weekday_activity_codes=np.array([day]),
+        weekend_activity_codes=np.array([day]),
+        time_step_size=TIME_STEP_SIZE
+    )
+
+
+@pytest.fixture
+def random_week_markov_chain():
+    day1 = activity_codes([Activity.HOME] * 12 + [Activity.NOT_AT_HOME] * 12)
+    day2 = activity_codes([Activity.HOME] * 6 + [Activity.SLEEP_AT_HOME] * 18)
+    return WeekMarkovChain.from_activity_codes(
+        weekday_activity_codes=np.array([day1, day2]),
+        weekend_activity_codes=np.array([day2, day1]),
+        time_step_size=TIME_STEP_SIZE
+    )
+
+
+def population_simulator(markov_chain, random_seeds):
+    return PopulationSimulator(
+        markov_chains={1: markov_chain},
+        markov_ids=[1] * len(random_seeds),
+        initial_activities=[Activity.HOME] * len(random_seeds),
+        random_seeds=random_seeds,
+        initial_time=datetime(2016, 12, 18, 0, 00),
+        time_step_size=TIME_STEP_SIZE
+    )
+
+
 @pytest.fixture
 def person(week_markov_chain):
     return Person(
@@ -47,3 +82,58 @@ def test_chooses_next_activity(person, week_markov_chain, next_activity):
     week_markov_chain.move.return_value = next_activity
     person.step()
     assert person.activity == next_activity
+
+
+def test_steps_in_ticks(week_markov_chain):
+    person = Person(
+        week_markov_chain=week_markov_chain,
+        number_generator=random.uniform,
+        initial_activity=Activity.NOT_AT_HOME,
+        initial_time=40,
+        time_step_size=timedelta(hours=1)
+    )
+    week_markov_chain.move_at_tick.return_value = Activity.HOME
+    person.step()
+    person.step()
+    assert person.activity == Activity.HOME
+    assert [call[1]['tick'] for call in week_markov_chain.move_at_tick.call_args_list] == [40, 41]
+    assert not week_markov_chain.move.called
+
+
+def test_population_simulator_follows_deterministic_chain(deterministic_week_markov_chain):
+    simulator = population_simulator(deterministic_week_markov_chain, random_seeds=range(10))
+    for unused in range(12):
+        assert (simulator.activities == Activity.HOME).all()
+        simulator.step()
+    assert (simulator.activities == Activity.NOT_AT_HOME).all()
+    assert simulator.time == datetime(2016, 12, 18, 12, 00)
+
+
+def test_population_simulator_is_reproducible(random_week_markov_chain):
+    simulator1 = population_simulator(random_week_markov_chain, random_seeds=range(100))
+    simulator2 = population_simulator(random_week_markov_chain, random_seeds=range(100))
+    for unused in range(48):
+        simulator1.step()
+        simulator2.step()
+        assert (simulator1.activity_codes == simulator2.activity_codes).all()
+
+
+def test_citizens_are_independent_of_population(random_week_markov_chain):
+    population = population_simulator(random_week_markov_chain, random_seeds=range(100))
+    subpopulation = population_simulator(random_week_markov_chain, random_seeds=range(50, 60))
+    for unused in range(48):
+        population.step()
+        subpopulation.step()
+        assert (population.activity_codes[50:60] == subpopulation.activity_codes).all()
+
+
+def test_population_simulator_fails_with_unknown_markov_id(random_week_markov_chain):
+    with pytest.raises(ValueError):
+        PopulationSimulator(
+            markov_chains={1: random_week_markov_chain},
+            markov_ids=[1, 2],
+            initial_activities=[Activity.HOME, Activity.HOME],
+            random_seeds=[1, 2],
+            initial_time=datetime(2016, 12, 18, 0, 00),
+            time_step_size=TIME_STEP_SIZE
+        )
@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from urbanoccupants import Activity
+from urbanoccupants.synthpop import sample_households, sample_citizen, Household, Citizen, \
+    SeedHouseholdMembers, RANDOM_SEED, MAX_HOUSEHOLD_SIZE
+
+
+SEED_HOUSEHOLDS = [(1, 1), (2, 1), (3, 1), (3, 2)]
+
+
+@pytest.fixture
+def seed():
+    # members of household (3, 1) are not next to each other
+    household_ids = [(1, 1), (3, 1), (2, 1), (3, 1), (3, 2)]
+    return pd.DataFrame(
+        index=pd.MultiIndex.from_arrays([pd.Index(household_ids, tupleize_cols=False),
+                                         [1, 1, 1, 2, 1]],
+                                        names=['household_id', 'person_id']),
+        data={
+            'markov_id': [10, 11, 12, 13, 14],
+            'initial_activity': [Activity.HOME, Activity.SLEEP_AT_HOME, Activity.HOME,
+                                 Activity.NOT_AT_HOME, Activity.HOME],
+            'metabolic_heat_gain_active': [140.0, 70.0, 140.0, 140.0, 140.0],
+            'metabolic_heat_gain_passive': [70.0, 35.0, 70.0, 70.0, 70.0]
+        }
+    )
+
+
+@pytest.fixture
+def households():
+    return pd.DataFrame(
+        {'id': [5, 6, 7], 'seedId': [(3, 1), (1, 1), (3, 1)], 'region': 'region'},
+        columns=Household._fields
+    )
+
+
+@pytest.fixture
+def household_weights():
+    return pd.Series([2.0, 0.0, 1.0, 5.0], index=pd.Index(SEED_HOUSEHOLDS, tupleize_cols=False))
+
+
+def sample_households_by_scan(household_weights, random_numbers):
+    cum_norm_hh_weights = (household_weights / household_weights.sum()).cumsum()
+    return [cum_norm_hh_weights[cum_norm_hh_weights >= random_number].index[0]
+            for random_number in random_numbers]
+
+
+def test_sample_households(household_weights):
+    households = sample_households(
+        ('region', household_weights, [0.1, 0.3, 0.9], [10, 11, 12])
+    )
+    assert list(households.columns) == list(Household._fields)
+    assert list(households.id) == [10, 11, 12]
+    assert list(households.seedId) == [(1, 1), (3, 1), (3, 2)]
+    assert list(households.region) == ['region'] * 3
+
+
+def test_sample_households_like_scan(household_weights):
+    random_numbers = list(np.random.RandomState(42).uniform(0, 1, size=100)) + [0.25, 0.375]
+    households = sample_households(
+        ('region', household_weights, random_numbers, list(range(len(random_numbers))))
+    )
+    assert list(households.seedId) == sample_households_by_scan(household_weights,
+                                                                random_numbers)
+
+
+def test_sample_households_never_from_households_without_weight(household_weights):
+    households = sample_households(('region', household_weights, [0.25], [1]))
+    assert list(households.seedId) == [(1, 1)]
+
+
+def test_sample_citizen(seed, households):
+    citizens = sample_citizen((households, seed))
+    assert list(citizens.columns) == list(Citizen._fields)
+    assert list(citizens.householdId) == [5, 5, 6, 7, 7]
+    assert list(citizens.markovId) == [11, 13, 10, 11, 13]
+    assert list(citizens.initialActivity) == [Activity.SLEEP_AT_HOME, Activity.NOT_AT_HOME,
+                                              Activity.HOME, Activity.SLEEP_AT_HOME,
+                                              Activity.NOT_AT_HOME]
+    assert list(citizens.activeMetabolicRate) == [70.0, 140.0, 140.0, 70.0, 140.0]
+    assert list(citizens.passiveMetabolicRate) == [35.0, 70.0, 70.0, 35.0, 70.0]
+    assert list(citizens.randomSeed) == [
+        RANDOM_SEED + household_id * MAX_HOUSEHOLD_SIZE + occupant_id
+        for household_id, occupant_id in [(5, 0), (5, 1), (6, 0), (7, 0), (7, 1)]
+    ]
+
+
+def test_sample_citizen_from_seed_household_members(seed, households):
+    citizens = sample_citizen((households, SeedHouseholdMembers(seed)))
+    assert citizens.equals(sample_citizen((households, seed)))
+
+
+def test_sample_no_citizen(seed, households):
+    citizens = sample_citizen((households.iloc[:0], seed))
+    assert len(citizens) == 0
+    assert list(citizens.columns) == list(Citizen._fields)
+
+
+def test_sample_citizen_of_unknown_household_fails(seed):
+    households = pd.DataFrame({'id': [5], 'seedId': [(4, 1)], 'region': 'region'},
+                              columns=Household._fields)
+    with pytest.raises(AssertionError):
+        sample_citizen((households, seed))
@@ -0,0 +1,135 @@
+from datetime import time
+from itertools import combinations
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+import pytest
+
+from urbanoccupants import Activity, PeopleFeature, HouseholdFeature, read_artifact, \
+    write_artifact
+from urbanoccupants.synthpop import encode_seed
+from urbanoccupants.types import AgeStructure
+
+
+@pytest.fixture
+def seed():
+    index = pd.MultiIndex.from_tuples([(1, 1, 1), (1, 1, 2), (2, 1, 1)],
+                                      names=['SN1', 'SN2', 'SN3'])
+    return encode_seed(pd.DataFrame(
+        index=index,
+        data={
+            str(PeopleFeature.AGE): [AgeStructure.AGE_0_TO_4, np.nan, AgeStructure.AGE_90_AND_OVER],
+            'metabolic_rate': [70.0, np.nan, 85.0]
+        }
+    ))
+
+
+@pytest.fixture
+def markov_ts():
+    index = pd.MultiIndex.from_tuples(
+        [(1, 1, 1, 'weekday', time(0, 0)), (1, 1, 1, 'weekday', time(12, 0))],
+        names=['SN1', 'SN2', 'SN3', 'daytype', 'time_of_day']
+    )
+    return pd.DataFrame({0: [Activity.HOME, Activity.NOT_AT_HOME]}, index=index)
+
+
+@pytest.fixture(params=['.feather', '.pickle'])
+def path(tmpdir, request):
+    return str(tmpdir.join('artifact' + request.param))
+
+
+def test_seed_roundtrip(seed, path):
+    write_artifact(seed, path)
+    read_seed = read_artifact(path)
+    assert read_seed.equals(seed)
+    ages = read_seed[str(PeopleFeature.AGE)]
+    assert list(ages.cat.categories) == sorted(AgeStructure)
+    assert ages.cat.ordered
+
+
+def test_markov_ts_roundtrip(markov_ts, path):
+    write_artifact(markov_ts, path)
+    read_markov_ts = read_artifact(path)
+    assert read_markov_ts.equals(markov_ts)
+    assert read_markov_ts[0].dtype == object
+
+
+def test_frame_with_tuple_labels_roundtrip(path):
+    ts_association = pd.DataFrame({'a': [0.1], ('a', 'b'): [0.2]})
+    write_artifact(ts_association, path)
+    assert list(read_artifact(path).columns) == list(ts_association.columns)
+
+
+def test_series_with_feature_index_roundtrip(tmpdir):
+    # features are stored by name, pickle would compare them by value
+    path = str(tmpdir.join('artifact.feather'))
+    feature_association = pd.Series(
+        [0.1],
+        index=pd.MultiIndex.from_tuples([(PeopleFeature.AGE, PeopleFeature.CARER)])
+    )
+    write_artifact(feature_association, path)
+    assert read_artifact(path).equals(feature_association)
+
+
+def test_read_requested_columns_only(seed, path):
+    write_artifact(seed, path)
+    read_seed = read_artifact(path, columns=['metabolic_rate'])
+    assert list(read_seed.columns) == ['metabolic_rate']
+    assert read_seed.index.equals(seed.index)
+
+
+def test_read_unknown_column_fails(seed, tmpdir):
+    path = str(tmpdir.join('artifact.feather'))
+    write_artifact(seed, path)
+    with pytest.raises(ValueError):
+        read_artifact(path, columns=['unknown'])
+
+
+def test_series_with_mixed_feature_index_roundtrip(tmpdir):
+    path = str(tmpdir.join('artifact.feather'))
+    features = [PeopleFeature.AGE, HouseholdFeature.HOUSEHOLD_TYPE, PeopleFeature.CARER,
+                HouseholdFeature.DWELLING_TYPE]
+    feature_association = pd.Series(
+        np.arange(6, dtype=np.float64),
+        index=pd.MultiIndex.from_tuples(list(combinations(features, 2)))
+    )
+    write_artifact(feature_association, path)
+    read_feature_association = read_artifact(path)
+    assert read_feature_association.equals(feature_association)
+    assert list(read_feature_association.index) == list(feature_association.index)
+
+
+def test_unnamed_series_roundtrip(path):
+    series = pd.Series([1.0, 2.0], index=pd.MultiIndex.from_tuples([(1, 'a'), (2, 'b')]))
+    write_artifact(series, path)
+    read_series = read_artifact(path)
+    assert read_series.name is None
+    assert read_series.equals(series)
+
+
+def test_named_series_roundtrip(path):
+    series = pd.Series([1.0, 2.0], index=['a', 'b'], name=('a', 1))
+    write_artifact(series, path)
+    assert read_artifact(path).name == ('a', 1)
+
+
+def test_multi_index_levels_are_not_categorical(markov_ts, tmpdir):
+    path = str(tmpdir.join('artifact.feather'))
+    write_artifact(markov_ts, path)
+    index = read_artifact(path).index
+    for level in range(index.nlevels):
+        assert not is_categorical_dtype(index.levels[level])
+
+
+def test_mixed_enum_column_roundtrip(path):
+    data = pd.DataFrame({'mixed': [Activity.HOME, AgeStructure.AGE_0_TO_4, np.nan]})
+    write_artifact(data, path)
+    assert list(read_artifact(path)['mixed'].fillna('nan')) == \
+        [Activity.HOME, AgeStructure.AGE_0_TO_4, 'nan']
+
+
+def test_enums_mixed_with_other_values_fail(tmpdir):
+    data = pd.DataFrame({'mixed': [Activity.HOME, 'home']})
+    with pytest.raises(ValueError):
+        write_artifact(data, str(tmpdir.join('artifact.feather')))
@@ -1,7 +1,8 @@
-from .person import Person, Activity, WeekMarkovChain
+from .person import Person, PopulationSimulator, Activity, WeekMarkovChain
 from .census import GeographicalLayer
 from .synthpop import PeopleFeature, HouseholdFeature, feature_id
 from .version import __version__
-from .utils import read_simulation_config
+from .utils import read_simulation_config, MarkovChainCache
+from .storage import read_artifact, write_artifact
 from .datamodel import MARKOV_CHAIN_INDEX_TABLE_NAME, DWELLINGS_TABLE_NAME, PEOPLE_TABLE_NAME, \
     ENVIRONMENT_TABLE_NAME, PARAMETERS_TABLE_NAME
@@ -84,6 +84,17 @@ class GeographicalLayer(Enum):
         self.borough_col_name = borough_col_name
         self.index_col_name = index_col_name
 
+    @property
+    def parent(self):
+        """The layer whose regions enclose the regions of this layer, or None.
+
+        OAs lie within LSOAs, and LSOAs lie within MSOAs. Wards do not nest with the other layers.
+        """
+        return {
+            GeographicalLayer.OA: GeographicalLayer.LSOA,
+            GeographicalLayer.LSOA: GeographicalLayer.MSOA
+        }.get(self)
+
 
 AGE_STRUCTURE_MAP = {
     "Age 0 to 4": AgeStructure.AGE_0_TO_4,
@@ -181,6 +192,20 @@ def read_haringey_shape_file(geographical_layer=GeographicalLayer.LSOA):
     return data.set_index(geographical_layer.index_col_name)
 
 
+def read_parent_lookup(geographical_layer=GeographicalLayer.LSOA):
+    """Retrieves the enclosing region of each region of the layer in Haringey.
+
+    Returns a Series indexed by the ids of the regions in the given layer, holding the ids of
+    the enclosing regions in `geographical_layer.parent`. The lookup is read from the shape
+    files of the London Data Store, see `read_haringey_shape_file`.
+    """
+    parent = geographical_layer.parent
+    if parent is None:
+        raise ValueError('Geographical layer {} has no parent layer.'.format(geographical_layer))
+    shapes = read_haringey_shape_file(geographical_layer)
+    return shapes[parent.index_col_name]
+
+
 def read_age_structure_data(geographical_layer=GeographicalLayer.LSOA):
     """Retrieves age structure date from Census 2011 for Haringey.
 
@@ -1,13 +1,15 @@
 from itertools import filterfalse, chain
 from functools import reduce
+import time
 
 import pandas as pd
 import numpy as np
 from numpy.polynomial import Polynomial
+import scipy.sparse
 
 
 def fit_hipf(reference_sample, controls_individuals, controls_households, maxiter,
-             weights_tol=None, residuals_tol=None):
+             weights_tol=None, residuals_tol=None, initial_weights=None, trace=None):
     """Hierarchical Iterative Proportional Fitting.
 
     Algorithm taken from
@@ -37,39 +39,177 @@ def fit_hipf(reference_sample, controls_individuals, controls_households, maxite
                               totals). Whenever the residuals are smaller than the given tolerance,
                               stop. (optional)
         maxiter:              Maximum number of iterations.
+        initial_weights:      Household weights to start from, a pandas Series indexed by
+                              household_id, e.g. the solution for an enclosing region or of a
+                              previous run with similar controls. Default is 1 for all
+                              households. (optional)
+        trace:                A `HipfTrace` that records the convergence and timing of each
+                              iteration. (optional)
+    """
+    weights = fit_hipf_regions(
+        reference_sample=reference_sample,
+        controls_individuals={None: controls_individuals},
+        controls_households={None: controls_households},
+        maxiter=maxiter,
+        weights_tol=weights_tol,
+        residuals_tol=residuals_tol,
+        initial_weights=None if initial_weights is None else {None: initial_weights},
+        trace=trace
+    )
+    return weights.iloc[0].rename(None)
+
+
+def fit_hipf_regions(reference_sample, controls_individuals, controls_households, maxiter,
+                     weights_tol=None, residuals_tol=None, initial_weights=None, trace=None):
+    """Hierarchical Iterative Proportional Fitting of one reference sample to many regions.
+
+    Fits the reference sample to the controls of all regions at once, as a matrix of weights
+    with one row per region. Regions that have converged are not updated any further, all other
+    regions continue until they converge themselves or until `maxiter` is reached. For each
+    region, the result is the same as fitting the region alone with `fit_hipf`.
+
+    Parameters:
+        reference_sample:     The reference sample to be fited to the controls, see `fit_hipf`.
+        controls_individuals: A dict from region to the control variables for individuals in
+                              that region, see `fit_hipf`. All regions must have the same
+                              controls and categories.
+        controls_households:  A dict from region to the control variables for households, in
+                              the same format as the controls for individuals.
+        weights_tol:          Convergence tolerance on the weights, see `fit_hipf`. (optional)
+        residuals_tol:        Convergence tolerance on the residuals, see `fit_hipf`. (optional)
+        maxiter:              Maximum number of iterations.
+        initial_weights:      A dict from region to the household weights to start from in that
+                              region, see `fit_hipf`. (optional)
+        trace:                A `HipfTrace` that records the convergence of each region and
+                              the timing of each iteration. (optional)
+
+    Returns:
+        a DataFrame of household weights with regions as index and household ids as columns
     """
     assert isinstance(reference_sample, pd.DataFrame)
     assert reference_sample.index.nlevels == 2
     assert len(controls_individuals) > 0
-    assert len(controls_households) > 0
-    assert _consistent_keys(controls_individuals, reference_sample)
-    assert _consistent_keys(controls_households, reference_sample)
-    assert _consistent_grand_totals(controls_individuals)
-    assert _consistent_grand_totals(controls_households)
-
-    weights = pd.Series(
-        index=_household_groups(reference_sample).count().index.get_level_values(0),
-        data=1.0,
-        dtype=np.float64
-    )
+    assert set(controls_individuals.keys()) == set(controls_households.keys())
+    regions = list(controls_individuals.keys())
+    controls_individuals = [controls_individuals[region] for region in regions]
+    controls_households = [controls_households[region] for region in regions]
+    for controls in chain(controls_individuals, controls_households):
+        assert len(controls) > 0
+        assert _consistent_keys(controls, reference_sample)
+        assert _consistent_grand_totals(controls)
+
+    household_groups = _household_groups(reference_sample)
+    household_ids = household_groups.count().index.get_level_values(0)
+    household_indicators = _ControlIndicators(household_groups.first(), controls_households)
+    person_indicators = _ControlIndicators(reference_sample, controls_individuals)
+    household_members = _HouseholdMembers(household_ids, reference_sample.index)
+    household_sizes = household_groups[reference_sample.columns[0]].count().values
+    grand_totals_hh = np.array([_grand_total(controls) for controls in controls_households])
+    grand_totals_ind = np.array([_grand_total(controls) for controls in controls_individuals])
+    residuals = _Residuals(household_indicators, person_indicators, household_members)
+    if initial_weights is None:
+        weights = np.ones((len(regions), len(household_ids)), dtype=np.float64)
+    else:
+        weights = np.array([initial_weights[region].reindex(household_ids).values
+                            for region in regions], dtype=np.float64)
+        assert not np.isnan(weights).any(), 'Initial weights are missing for some households.'
+    if trace is not None:
+        trace._start(regions)
+    active = np.ones(len(regions), dtype=np.bool_) # regions that have not yet converged
     for i in range(1, maxiter + 1):
-        next_weights = _fit(_household_groups(reference_sample).first(), weights,
-                            controls_households)
-        weights_person = _expand_weights_to_person(next_weights, reference_sample.index)
-        weights_person = _fit(reference_sample, weights_person, controls_individuals)
-        next_weights = _aggregate_person_weights_to_household(weights_person)
-        next_weights = _rescale_weights(reference_sample, next_weights,
-                                        controls_individuals, controls_households)
-        previous_weights = weights.copy()
-        weights = next_weights.copy()
-        if (residuals_tol is not None and
-            _residuals_tolerance_reached(reference_sample, weights, controls_households,
-                                         controls_individuals, residuals_tol)):
+        start = time.perf_counter()
+        previous_weights = weights[active]
+        next_weights = household_indicators.fit(previous_weights, active)
+        household_fit_end = time.perf_counter()
+        weights_person = household_members.expand(next_weights)
+        weights_person = person_indicators.fit(weights_person, active)
+        next_weights = household_members.aggregate(weights_person)
+        person_fit_end = time.perf_counter()
+        next_weights = _rescale_weights(household_sizes, next_weights,
+                                        grand_totals_ind[active], grand_totals_hh[active])
+        rescale_end = time.perf_counter()
+        weights[active] = next_weights
+        converged = np.zeros(len(next_weights), dtype=np.bool_)
+        max_residuals = max_weight_changes = None
+        if residuals_tol is not None or trace is not None:
+            max_residuals = _nanmax(np.abs(residuals(next_weights, active)))
+            if residuals_tol is not None:
+                converged |= max_residuals < residuals_tol
+        if weights_tol is not None or trace is not None:
+            max_weight_changes = _nanmax(np.abs(next_weights / previous_weights - 1))
+            if weights_tol is not None:
+                converged |= max_weight_changes < weights_tol
+        if trace is not None:
+            trace._record(active, max_residuals, max_weight_changes, [
+                household_fit_end - start,
+                person_fit_end - household_fit_end,
+                rescale_end - person_fit_end
+            ])
+        active[active] = ~converged
+        if not active.any():
             break
-        if (weights_tol is not None and
-                _weights_tolerance_reached(next_weights, previous_weights, weights_tol)):
-            break
-    return weights
+    return pd.DataFrame(weights, index=regions, columns=household_ids)
+
+
+class HipfTrace():
+    """Records the convergence and the timing of a HIPF run, iteration by iteration.
+
+    Give an instance to `fit_hipf` or `fit_hipf_regions`, it will be reset at the start of the
+    run. For each iteration and region, it records the maximum absolute residual and the maximum
+    relative change of the weights. Converged regions are not fitted any further and have no
+    values in later iterations. For each iteration, it records the wall time in seconds spent in
+    the steps of the algorithm, for all regions together.
+    """
+
+    STEPS = ['household fit', 'person fit', 'rescale']
+
+    def __init__(self):
+        self._start([])
+
+    def _start(self, regions):
+        self.__regions = list(regions)
+        self.__active = []
+        self.__max_residuals = []
+        self.__max_weight_changes = []
+        self.__step_times = []
+
+    def _record(self, active, max_residuals, max_weight_changes, step_times):
+        self.__active.append(active.copy())
+        self.__max_residuals.append(self.__per_region(active, max_residuals))
+        self.__max_weight_changes.append(self.__per_region(active, max_weight_changes))
+        self.__step_times.append(step_times)
+
+    def __per_region(self, active, values):
+        per_region = np.full(len(self.__regions), np.nan)
+        per_region[active] = values
+        return per_region
+
+    def __iteration_index(self):
+        return pd.RangeIndex(1, len(self.__step_times) + 1, name='iteration')
+
+    @property
+    def iterations(self):
+        """The number of iterations of each region, a Series indexed by region."""
+        active = np.array(self.__active, dtype=np.bool_).reshape(-1, len(self.__regions))
+        return pd.Series(active.sum(axis=0), index=self.__regions)
+
+    @property
+    def max_residuals(self):
+        """The maximum absolute residual, a DataFrame of iterations x regions."""
+        return pd.DataFrame(self.__max_residuals, index=self.__iteration_index(),
+                            columns=self.__regions)
+
+    @property
+    def max_weight_changes(self):
+        """The maximum relative change of the weights, a DataFrame of iterations x regions."""
+        return pd.DataFrame(self.__max_weight_changes, index=self.__iteration_index(),
+                            columns=self.__regions)
+
+    @property
+    def step_times(self):
+        """The wall time of each step in seconds, a DataFrame of iterations x steps."""
+        return pd.DataFrame(self.__step_times, index=self.__iteration_index(),
+                            columns=self.STEPS)
 
 
 def _consistent_keys(controls, reference_sample):
@@ -87,40 +227,22 @@ def _household_groups(reference_sample):
     return reference_sample.groupby(reference_sample.index.get_level_values(0))
 
 
-def _residuals_tolerance_reached(reference_sample, weights, controls_households,
-                                 controls_individuals, tol):
-    residuals = _all_residuals(reference_sample, weights, controls_households, controls_individuals)
-    return residuals.abs().max() < tol
-
-
 def _all_residuals(reference_sample, weights, controls_households, controls_individuals):
-    household_ref_sample = _household_groups(reference_sample).first()
-    residuals_household = _residuals(
-        reference_sample=_household_groups(reference_sample).first(),
-        weights=weights,
-        controls=controls_households
-    )
-    residuals_individual = _residuals(
-        reference_sample=reference_sample,
-        weights=_expand_weights_to_person(weights, reference_sample.index),
-        controls=controls_individuals
+    household_groups = _household_groups(reference_sample)
+    household_ids = household_groups.count().index.get_level_values(0)
+    residuals = _Residuals(
+        household_indicators=_ControlIndicators(household_groups.first(), [controls_households]),
+        person_indicators=_ControlIndicators(reference_sample, [controls_individuals]),
+        household_members=_HouseholdMembers(household_ids, reference_sample.index)
     )
-    return pd.Series(list(chain(residuals_household, residuals_individual)))
+    return pd.Series(residuals(weights.reindex(household_ids).values[np.newaxis, :],
+                               np.ones(1, dtype=np.bool_))[0])
 
 
-def _residuals(reference_sample, weights, controls):
-    residuals = []
-    residuals.append(weights.sum() / _grand_total(controls) - 1)
-    for control_name, control_values in controls.items():
-        actual_values = {key: weights[reference_sample[control_name] == key].sum()
-                         for key, value in control_values.items()}
-        for key in control_values.keys():
-            residuals.append(actual_values[key] / control_values[key] - 1)
-    return residuals
-
-
-def _weights_tolerance_reached(weights, previous_weights, tol):
-    return (weights / previous_weights - 1).abs().max() < tol
+def _nanmax(values):
+    # row-wise maximum skipping nan, nan where all values are nan
+    values = np.where(np.isnan(values), -np.inf, values).max(axis=1)
+    return np.where(np.isneginf(values), np.nan, values)
 
 
 def _grand_total(controls):
@@ -129,38 +251,172 @@ def _grand_total(controls):
     return grand_totals[0]
 
 
-def _fit(reference_sample, weights, controls):
-    new_weights = weights.copy()
-    for control_name, control_values in controls.items():
-        summed_weights = {key: new_weights[reference_sample[control_name] == key].sum()
-                          for key, value in control_values.items()}
-        control_values = reference_sample[control_name].map(control_values)
-        summed_weights = reference_sample[control_name].map(summed_weights)
-        new_weights = new_weights * control_values / summed_weights
-    return new_weights
+class _ControlIndicators():
+    """Sparse indicator matrices of the categories of controls in a sample.
 
+    The matrix of a control has one row per category of the control, and one column per row in
+    the sample, with ones where a sample row is of the category. Summing weights per category is
+    hence a sparse matrix-vector product, or a matrix-matrix product for the weights of many
+    regions. Sample rows whose value is not a category of the control get nan weights when
+    fitted, like all rows would if they were fitted by a mapping of their values to control
+    totals.
+
+    Parameters:
+        * sample:   DataFrame with one column per control
+        * controls: list of controls, one per region, each a dict from control name to a dict
+                    of control totals per category; all regions must have the same controls
+                    and categories
+    """
 
-def _aggregate_person_weights_to_household(person_weights):
-    return person_weights.groupby(person_weights.index.get_level_values(0)).mean()
+    def __init__(self, sample, controls):
+        self.__grand_totals = np.array([_grand_total(region_controls)
+                                        for region_controls in controls])
+        self.__controls = []
+        for control_name, control_values in controls[0].items():
+            categories = list(control_values.keys())
+            for region_controls in controls:
+                assert set(region_controls[control_name].keys()) == set(categories), \
+                    'Control {} has different categories in different regions.'.format(control_name)
+            codes = np.full(sample.shape[0], -1, dtype=np.int32)
+            for code, category in enumerate(categories):
+                codes[(sample[control_name] == category).values] = code
+            sample_rows = np.flatnonzero(codes >= 0)
+            indicators = scipy.sparse.csr_matrix(
+                (np.ones(len(sample_rows)), (codes[sample_rows], sample_rows)),
+                shape=(len(categories), sample.shape[0])
+            )
+            totals = np.array([[region_controls[control_name][category]
+                                for category in categories]
+                               for region_controls in controls], dtype=np.float64)
+            self.__controls.append((indicators, codes, totals))
+
+    def fit(self, weights, regions):
+        """Fits the weights of all sample rows to the controls, one control after another.
+
+        Parameters:
+            * weights: the weights of all sample rows, one row of weights per selected region
+            * regions: boolean mask selecting the regions of the weights
+        """
+        for indicators, codes, totals in self.__controls:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                factors = totals[regions] / _summed_weights(indicators, weights)
+            factors = np.concatenate([factors, np.full((len(factors), 1), np.nan)], axis=1)
+            weights = weights * factors[:, codes] # code -1 points to the trailing nan
+        return weights
+
+    @property
+    def grand_totals(self):
+        """The grand totals of the controls, one per region."""
+        return self.__grand_totals
+
+    def category_indicators(self):
+        """The indicator matrices of all controls stacked, one row per category."""
+        return scipy.sparse.vstack([indicators for indicators, _, _ in self.__controls])
+
+    def category_totals(self):
+        """The control totals of all categories, one row per region."""
+        return np.concatenate([totals for _, _, totals in self.__controls], axis=1)
+
+
+def _summed_weights(indicators, weights):
+    # weights are (regions x rows), result is (regions x categories); nan weights are skipped
+    return indicators.dot(np.where(np.isnan(weights), 0.0, weights).T).T
+
+
+class _HouseholdMembers():
+    """CSR style index from households to their members in the reference sample.
+
+    Persons are sorted by household once, so that the members of the i-th household are the
+    persons `order[offsets[i]:offsets[i + 1]]`.
 
+    Parameters:
+        * household_ids: the ids of all households, in the order of the household weights
+        * person_index:  the (household_id, person_id) index of the reference sample
+    """
 
-def _expand_weights_to_person(weights, person_index):
-    person_weights = weights.copy()
-    person_weights = pd.DataFrame(person_weights)
-    person_weights['person_id'] = 1
-    person_weights.set_index('person_id', append=True, inplace=True)
-    person_weights = person_weights.reindex(person_index)
-    person_weights.fillna(method='ffill', inplace=True)
-    return person_weights.iloc[:, 0] # return series not dataframe
+    def __init__(self, household_ids, person_index):
+        self.__person_households = household_ids.get_indexer(person_index.get_level_values(0))
+        assert (self.__person_households >= 0).all()
+        self.__order = np.argsort(self.__person_households, kind='mergesort')
+        household_sizes = np.bincount(self.__person_households, minlength=len(household_ids))
+        self.__offsets = np.concatenate([[0], np.cumsum(household_sizes)])
+
+    def membership(self):
+        """Sparse matrix with one row per person, and a one in the column of its household."""
+        number_persons = len(self.__person_households)
+        return scipy.sparse.csr_matrix(
+            (np.ones(number_persons), (np.arange(number_persons), self.__person_households)),
+            shape=(number_persons, len(self.__offsets) - 1)
+        )
+
+    def expand(self, household_weights):
+        """Gives each person the weight of its household, for each row of weights."""
+        return household_weights[:, self.__person_households]
+
+    def aggregate(self, person_weights):
+        """The mean weight of the members of each household, skipping nan weights."""
+        person_weights = person_weights[:, self.__order]
+        is_nan = np.isnan(person_weights)
+        starts = self.__offsets[:-1]
+        summed_weights = np.add.reduceat(np.where(is_nan, 0.0, person_weights), starts, axis=1)
+        number_weights = np.add.reduceat((~is_nan).astype(np.int64), starts, axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return summed_weights / number_weights
+
+
+class _Residuals():
+    """Relative differences of household weights to the grand totals and category totals.
+
+    The totals of the persons in a category are the household weights multiplied with the number
+    of members in that category per household. These counts are aggregated from the indicators
+    once, hence the residuals of all controls are a single sparse product with the household
+    weights, without expanding them to persons.
 
+    Parameters:
+        * household_indicators: `_ControlIndicators` of the households
+        * person_indicators:    `_ControlIndicators` of the persons
+        * household_members:    `_HouseholdMembers` of the reference sample
+    """
 
-def _rescale_weights(reference_sample, weights, controls_individuals, controls_households):
-    grand_total_hh = _grand_total(controls_households)
-    grand_total_ind = _grand_total(controls_individuals)
-    household_sizes = _household_groups(reference_sample)[reference_sample.columns[0]].count()
+    def __init__(self, household_indicators, person_indicators, household_members):
+        membership = household_members.membership()
+        number_persons, number_households = membership.shape
+        self.__counts = scipy.sparse.vstack([
+            scipy.sparse.csr_matrix(np.ones((1, number_households))),
+            household_indicators.category_indicators(),
+            scipy.sparse.csr_matrix(np.ones((1, number_persons))).dot(membership),
+            person_indicators.category_indicators().dot(membership)
+        ]).tocsr()
+        self.__totals = np.concatenate([
+            household_indicators.grand_totals[:, np.newaxis],
+            household_indicators.category_totals(),
+            person_indicators.grand_totals[:, np.newaxis],
+            person_indicators.category_totals()
+        ], axis=1)
+
+    def __call__(self, weights, regions):
+        """Residuals of the household weights, one row per selected region.
+
+        The first column is the residual of the grand total of households, followed by the
+        residuals of all household categories, the grand total of persons, and all person
+        categories.
+        """
+        return _summed_weights(self.__counts, weights) / self.__totals[regions] - 1
+
+
+def _rescale_weights(household_sizes, weights, grand_totals_ind, grand_totals_hh):
     largest_household_size = household_sizes.max()
-    Fp = [weights[household_sizes == p].sum()
-          for p in range(0, largest_household_size + 1)]
+    Fp = np.array([np.nansum(weights[:, household_sizes == p], axis=1)
+                   for p in range(0, largest_household_size + 1)]).T
+    fhprime_by_fh = np.array([
+        _rescale_factors(Fp[region], grand_totals_ind[region], grand_totals_hh[region])
+        for region in range(len(weights))
+    ]).reshape(len(weights), largest_household_size + 1)
+    return fhprime_by_fh[:, household_sizes] * weights
+
+
+def _rescale_factors(Fp, grand_total_ind, grand_total_hh):
+    largest_household_size = len(Fp) - 1
     polynom = [(grand_total_hh / grand_total_ind * p - 1) * Fp[p]
                for p in range(0, largest_household_size + 1)]
     roots = Polynomial(polynom).roots()
@@ -168,8 +424,4 @@ def _rescale_weights(reference_sample, weights, controls_individuals, controls_h
     assert len(dx) == 1
     d = np.real(dx[0])
     c = grand_total_hh / sum(Fp[p] * d ** p for p in range(1, largest_household_size + 1))
-    fhprime_by_fh = {p: c * d ** p for p in range(1, largest_household_size + 1)}
-
-    fhprime_by_fh = household_sizes.map(fhprime_by_fh)
-    new_weights = fhprime_by_fh * weights
-    return new_weights
+    return [np.nan] + [c * d ** p for p in range(1, largest_household_size + 1)]
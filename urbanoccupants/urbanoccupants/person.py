@@ -1,9 +1,11 @@
 from collections import OrderedDict
 import datetime
 from enum import Enum
-import math
+import json
+import numbers
+import struct
 
-import pykov
+import numpy as np
 import pandas as pd
 
 
@@ -12,6 +14,11 @@ MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME = 'time'
 MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME = 'fromActivity'
 MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME = 'toActivity'
 MARKOV_CHAIN_PROBABILITY_COLUMN_NAME = 'probability'
+DAY_TYPES = ('weekday', 'weekend')
+_DAY_TYPE_INDEX = {day: index for index, day in enumerate(DAY_TYPES)}
+_WEEKDAY_DAY_TYPE_INDEX = np.array([0, 0, 0, 0, 0, 1, 1]) # indexed by datetime.weekday()
+_MARKOV_CHAINS_FILE_MAGIC = b'UOCHAINS'
+_MARKOV_CHAINS_FILE_ALIGNMENT = 64
 
 
 class OrderedEnum(Enum):
@@ -46,6 +53,73 @@ class Activity(OrderedEnum):
         return self.name
 
 
+_ACTIVITIES = list(Activity)
+_ACTIVITY_INDEX = {activity: index for index, activity in enumerate(_ACTIVITIES)}
+_ACTIVITY_ARRAY = np.array(_ACTIVITIES, dtype=object)
+
+
+def activity_codes(activities):
+    """Encodes Activities as their index in `Activity`.
+
+    Parameters:
+        * activities: an array-like of arbitrary shape containing Activities
+
+    Returns:
+        an int8 array of the same shape
+    """
+    activities = np.asarray(activities)
+    codes = pd.Categorical(activities.ravel(), categories=_ACTIVITIES).codes
+    if (codes < 0).any():
+        raise ValueError('Activities contain unknown or missing values.')
+    return codes.astype(np.int8).reshape(activities.shape)
+
+
+def activities_from_codes(codes):
+    """Decodes Activities from their index in `Activity`, the inverse of `activity_codes`.
+
+    Parameters:
+        * codes: an integer array-like of arbitrary shape
+
+    Returns:
+        an object array of Activities of the same shape
+    """
+    return _ACTIVITY_ARRAY[np.asarray(codes)]
+
+
+def transition_counts(activity_codes, group_codes, number_groups):
+    """Counts the transitions between activities of groups of persons in one pass.
+
+    The transition from the last time slot of a day is the one to the first time slot of the
+    same day.
+
+    Parameters:
+        * activity_codes: integer array of shape (persons, day types, time slots) with the
+                          activities coded as by `activity_codes`
+        * group_codes:    the group of each person, an integer in [0, number_groups)
+        * number_groups:  the number of groups
+
+    Returns:
+        an integer array of shape (groups, day types, time slots, activities, activities)
+    """
+    activity_codes = np.asarray(activity_codes, dtype=np.intp)
+    group_codes = np.asarray(group_codes, dtype=np.intp)
+    number_persons, number_day_types, number_time_slots = activity_codes.shape
+    assert group_codes.shape == (number_persons, )
+    number_activities = len(_ACTIVITIES)
+    next_activity_codes = np.roll(activity_codes, -1, axis=2)
+    day_slots = np.arange(number_day_types * number_time_slots)\
+        .reshape(number_day_types, number_time_slots)
+    day_slots = group_codes[:, np.newaxis, np.newaxis] * number_day_types * number_time_slots +\
+        day_slots
+    flat_indices = (day_slots * number_activities + activity_codes) * number_activities +\
+        next_activity_codes
+    return np.bincount(
+        flat_indices.ravel(),
+        minlength=number_groups * number_day_types * number_time_slots * number_activities**2
+    ).reshape(number_groups, number_day_types, number_time_slots, number_activities,
+              number_activities)
+
+
 class Person():
     """The model of a citizen making choices on activities and locations.
 
@@ -55,7 +129,8 @@ class Person():
         * number_generator:       a callable returning a random number between min and max
                                   parameters
         * initial_activity:       the activity at initial time
-        * initial_time:           the initial time
+        * initial_time:           the initial time, either a datetime or an integer tick of the
+                                  week as defined by `WeekMarkovChain.time_to_tick`
         * time_step_size:         the time step size of the simulation, must be consistent with
                                   time step size of markov chains
 
@@ -79,17 +154,27 @@ class Person():
         self.__number_generator = number_generator
         self.__time = initial_time
         self.__time_step_size = time_step_size
+        self.__ticks = isinstance(initial_time, numbers.Integral)
 
     def step(self):
         """Run simulation for one time step.
 
         Chooses new activity.
-        Updates internal time by time step.
+        Updates internal time by time step, or by one tick.
         """
         self.activity = self._choose_next_activity()
-        self.__time += self.__time_step_size
+        if self.__ticks:
+            self.__time += 1
+        else:
+            self.__time += self.__time_step_size
 
     def _choose_next_activity(self):
+        if self.__ticks:
+            return self.__chain.move_at_tick(
+                current_state=self.activity,
+                tick=self.__time,
+                random_func=self.__number_generator
+            )
         return self.__chain.move(
             current_state=self.activity,
             current_time=self.__time,
@@ -97,9 +182,92 @@ class Person():
         )
 
 
+class PopulationSimulator():
+    """The model of a whole population of citizens making choices on activities.
+
+    This is equivalent to one `Person` per citizen, but the activities of all citizens are held
+    in one array and are advanced together in each time step. Next activities are drawn from
+    the transition probabilities of the markov chains by inverse transform sampling.
+
+    Each citizen draws its random numbers from its own stream, a splitmix64 sequence seeded
+    with its random seed. Hence, the activities of a citizen are reproducible from its seed and
+    do not depend on the rest of the population.
+
+    Parameters:
+        * markov_chains:      a dict from markov id to the people.WeekMarkovChain of that id
+        * markov_ids:         the markov id of each citizen
+        * initial_activities: the activity of each citizen at initial time
+        * random_seeds:       the random seed of each citizen, e.g. `Citizen.randomSeed`
+        * initial_time:       the initial time
+        * time_step_size:     the time step size of the simulation, must be consistent with
+                              time step size of markov chains
+    """
+
+    def __init__(self, markov_chains, markov_ids, initial_activities, random_seeds,
+                 initial_time, time_step_size):
+        assert all(chain.time_step_size == time_step_size for chain in markov_chains.values())
+        chain_ids = pd.Index(list(markov_chains.keys()))
+        self.__chain_indices = chain_ids.get_indexer(markov_ids)
+        if (self.__chain_indices < 0).any():
+            raise ValueError('There are citizens with unknown markov ids.')
+        self.__cumulative_probabilities = np.stack(
+            [markov_chains[chain_id].cumulative_probabilities for chain_id in chain_ids]
+        )
+        number_time_slots = self.__cumulative_probabilities.shape[2]
+        self.__tick_day_types, self.__tick_time_slots = _week_ticks(number_time_slots)
+        self.__tick = _time_to_tick(initial_time, time_step_size, number_time_slots)
+        self.__activity_codes = activity_codes(initial_activities).astype(np.intp)
+        self.__random_seeds = np.asarray(random_seeds, dtype=np.uint64)
+        assert self.__chain_indices.shape == self.__activity_codes.shape
+        assert self.__chain_indices.shape == self.__random_seeds.shape
+        self.__time = initial_time
+        self.__time_step_size = time_step_size
+        self.__number_steps = 0
+
+    @property
+    def time(self):
+        return self.__time
+
+    @property
+    def activity_codes(self):
+        """The current activity of each citizen, coded as by `activity_codes`."""
+        return self.__activity_codes.copy()
+
+    @property
+    def activities(self):
+        """The current Activity of each citizen."""
+        return activities_from_codes(self.__activity_codes)
+
+    def step(self):
+        """Run simulation for one time step.
+
+        Chooses new activities of all citizens.
+        Updates internal time by time step.
+        """
+        cumulative_probabilities = self.__cumulative_probabilities[
+            self.__chain_indices,
+            self.__tick_day_types[self.__tick],
+            self.__tick_time_slots[self.__tick],
+            self.__activity_codes
+        ]
+        random_numbers = _splitmix64_uniform(self.__random_seeds, self.__number_steps)
+        next_activity_codes = (cumulative_probabilities <= random_numbers[:, np.newaxis])\
+            .sum(axis=1)
+        if (next_activity_codes == len(_ACTIVITIES)).any():
+            raise ValueError('There are citizens in invalid states at {}.'.format(self.__time))
+        self.__activity_codes = next_activity_codes
+        self.__time += self.__time_step_size
+        self.__tick = (self.__tick + 1) % len(self.__tick_day_types)
+        self.__number_steps += 1
+
+
 class WeekMarkovChain():
     """A time heterogeneous markov chain of people activities for one week.
 
+    Internally, the chain is a dense tensor of transition probabilities indexed by
+    [day type, time slot, from activity, to activity], where day types are ordered as in
+    `DAY_TYPES`, time slots start at midnight, and activities are ordered as in `Activity`.
+
     Parameters:
         * weekday_time_series: 24h time series of Activities with given time step size of a
                                weekday. The index should be instances of time, and there can
@@ -110,153 +278,396 @@ class WeekMarkovChain():
     """
 
     def __init__(self, weekday_time_series, weekend_time_series, time_step_size):
-        self.__time_step_size = time_step_size
         if weekday_time_series.isnull().any().any():
             raise ValueError('Weekday time series contains missing values.')
         if weekend_time_series.isnull().any().any():
             raise ValueError('Weekend time series contains missing values.')
-        self.__chain = {
-            'weekday': WeekMarkovChain._day_markov_chain(weekday_time_series, time_step_size),
-            'weekend': WeekMarkovChain._day_markov_chain(weekend_time_series, time_step_size)
-        }
-        self._add_missing_transitions()
-        # there is a chance that after the first round of adding transitions, the markov chain is
-        # still not valid (the first element could have a new element now that the second doesn't
-        # have). This is ignored for the moment, as the chain is validated anyway again.
-        self._validate()
+        self._initialise(
+            transition_counts=np.stack([
+                WeekMarkovChain._transition_counts(
+                    WeekMarkovChain._day_activity_codes(weekday_time_series, time_step_size)
+                ),
+                WeekMarkovChain._transition_counts(
+                    WeekMarkovChain._day_activity_codes(weekend_time_series, time_step_size)
+                )
+            ]),
+            time_step_size=time_step_size
+        )
+
+    @classmethod
+    def from_activity_codes(cls, weekday_activity_codes, weekend_activity_codes, time_step_size):
+        """Creates a markov chain from integer coded activities.
+
+        This is equivalent to the default constructor, but avoids the overhead of time series
+        of Activities.
+
+        Parameters:
+            * weekday_activity_codes: 2D array of shape (persons, time slots) of a weekday, with
+                                      the activities coded as by `activity_codes`. Time slots
+                                      start at midnight and are of given time step size.
+            * weekend_activity_codes: As weekday_activity_codes, but for a weekend day.
+            * time_step_size:         A timedelta representing the time step size of above
+                                      activities.
+        """
+        number_time_slots = len(list(WeekMarkovChain._day_time_step_generator(time_step_size)))
+        for activity_codes in [weekday_activity_codes, weekend_activity_codes]:
+            if np.ndim(activity_codes) != 2 or np.shape(activity_codes)[1] != number_time_slots:
+                raise ValueError('Activity codes must be of shape (persons, {}), but are {}.'
+                                 .format(number_time_slots, np.shape(activity_codes)))
+        chain = cls.__new__(cls)
+        chain._initialise(
+            transition_counts=np.stack([
+                WeekMarkovChain._transition_counts(weekday_activity_codes),
+                WeekMarkovChain._transition_counts(weekend_activity_codes)
+            ]),
+            time_step_size=time_step_size
+        )
+        return chain
+
+    @classmethod
+    def from_transition_counts(cls, transition_counts, time_step_size):
+        """Creates a markov chain from counts of observed transitions.
+
+        Parameters:
+            * transition_counts: tensor of the number of observed transitions indexed by
+                                 [day type, time slot, from activity, to activity], e.g. as
+                                 created by `transition_counts`.
+            * time_step_size:    A timedelta representing the time step size of the
+                                 markov chain.
+        """
+        chain = cls.__new__(cls)
+        chain._initialise(transition_counts=transition_counts, time_step_size=time_step_size)
+        return chain
+
+    @classmethod
+    def from_transition_probabilities(cls, transition_probabilities, time_step_size,
+                                      trusted=False):
+        """Creates a markov chain from a tensor of transition probabilities.
+
+        Parameters:
+            * transition_probabilities: tensor of transition probabilities indexed by
+                                        [day type, time slot, from activity, to activity],
+                                        see `transition_probabilities`.
+            * time_step_size:           A timedelta representing the time step size of the
+                                        markov chain.
+            * trusted:                  If True, the probabilities are used as they are, without
+                                        copying, repairing, or validating them. Use this only for
+                                        probabilities of a chain that has been validated before,
+                                        e.g. when loading it from a cache or file.
+        """
+        chain = cls.__new__(cls)
+        chain._set_probabilities(transition_probabilities, time_step_size, copy=not trusted)
+        if not trusted:
+            chain._add_missing_transitions()
+            chain._validate()
+        chain.__probabilities.flags.writeable = False
+        return chain
+
+    @classmethod
+    def from_dataframe(cls, df, time_step_size, trusted=False):
+        """Creates a markov chain from its dataframe representation.
+
+        This is the inverse of `to_dataframe`. See `from_transition_probabilities` for
+        the meaning of `trusted`.
+        """
+        time_stamps = pd.Index(list(WeekMarkovChain._day_time_step_generator(time_step_size)))
+        day_indices = pd.Index(DAY_TYPES).get_indexer(df.index.get_level_values(0))
+        time_slots = time_stamps.get_indexer(df.index.get_level_values(1))
+        if (day_indices < 0).any() or (time_slots < 0).any():
+            raise ValueError('Dataframe contains unknown days or times.')
+        number_activities = len(_ACTIVITIES)
+        transition_probabilities = np.zeros((len(DAY_TYPES), len(time_stamps),
+                                             number_activities, number_activities))
+        transition_probabilities[
+            day_indices,
+            time_slots,
+            activity_codes(df[MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME]),
+            activity_codes(df[MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME])
+        ] = df[MARKOV_CHAIN_PROBABILITY_COLUMN_NAME].values
+        return cls.from_transition_probabilities(transition_probabilities, time_step_size,
+                                                 trusted=trusted)
 
     @property
     def time_step_size(self):
         return self.__time_step_size
 
+    @property
+    def transition_probabilities(self):
+        """The read-only tensor of transition probabilities.
+
+        Indexed by [day type, time slot, from activity, to activity].
+        """
+        return self.__probabilities
+
+    @property
+    def cumulative_probabilities(self):
+        """The read-only tensor of normalised cumulative transition probabilities.
+
+        Indexed like `transition_probabilities`. Rows of valid start states end in exactly 1,
+        all other rows are 0. For a uniform random number r in [0, 1), the next activity is the
+        first one with a cumulative probability larger than r.
+
+        The tensor is built once, on first use.
+        """
+        if self.__cumulative_probabilities is None:
+            self.__cumulative_probabilities = WeekMarkovChain._cumulative_probabilities(
+                self.__probabilities
+            )
+        return self.__cumulative_probabilities
+
+    @property
+    def ticks_per_week(self):
+        """The number of time steps in a week."""
+        return len(self.__tick_day_types)
+
+    def time_to_tick(self, time_stamp):
+        """Returns the tick of the week of given time stamp.
+
+        Ticks count the time steps of a week, starting with 0 at Monday midnight.
+        """
+        return _time_to_tick(time_stamp, self.__time_step_size, len(self.__time_stamps))
+
+    def tick_to_time(self, tick, week_start):
+        """Returns the time stamp of given tick.
+
+        Parameters:
+            * tick:       the number of time steps since week start, may exceed one week
+            * week_start: a Monday midnight
+        """
+        assert week_start.weekday() == 0 and week_start.time() == datetime.time(0, 0)
+        return week_start + tick * self.__time_step_size
+
     def move(self, current_state, current_time, random_func):
-        return self.__chain[WeekMarkovChain._weekday(current_time)][current_time.time()].move(
-            state=current_state,
-            random_func=random_func
-        )
+        return self.move_at_tick(current_state, self.time_to_tick(current_time), random_func)
+
+    def move_at_tick(self, current_state, tick, random_func):
+        """Like `move`, but at given tick. Ticks beyond one week wrap around."""
+        tick = tick % len(self.__tick_day_types)
+        cumulative_probabilities = self.cumulative_probabilities[
+            self.__tick_day_types[tick],
+            self.__tick_time_slots[tick],
+            _ACTIVITY_INDEX[current_state]
+        ]
+        if cumulative_probabilities[-1] == 0:
+            raise ValueError('{} is not a valid state at tick {}.'.format(current_state, tick))
+        next_index = np.searchsorted(cumulative_probabilities, random_func(0, 1), side='right')
+        return _ACTIVITIES[min(next_index, len(_ACTIVITIES) - 1)]
 
     def valid_states(self, time_stamp):
         """Returns all valid states at given time stamp."""
-        return [item[0][0] for item in
-                self.__chain[WeekMarkovChain._weekday(time_stamp)][time_stamp.time()].items()]
+        return self.valid_states_at_tick(self.time_to_tick(time_stamp))
+
+    def valid_states_at_tick(self, tick):
+        """Returns all valid states at given tick. Ticks beyond one week wrap around."""
+        tick = tick % len(self.__tick_day_types)
+        probabilities = self.__probabilities[self.__tick_day_types[tick],
+                                             self.__tick_time_slots[tick]]
+        return [_ACTIVITIES[index] for index in np.flatnonzero(probabilities.sum(axis=1) > 0)]
+
+    def pykov_chain(self, time_stamp):
+        """Returns the single markov chain valid at given time stamp as a `pykov.Chain`.
+
+        This exists for compatibility only, pykov is not needed anywhere else.
+        """
+        import pykov
+        probabilities = self.__probabilities[_DAY_TYPE_INDEX[WeekMarkovChain._weekday(time_stamp)],
+                                             self._time_slot(time_stamp)]
+        from_indices, to_indices = np.nonzero(probabilities)
+        return pykov.Chain(OrderedDict(
+            ((_ACTIVITIES[from_index], _ACTIVITIES[to_index]),
+             probabilities[from_index, to_index])
+            for from_index, to_index in zip(from_indices, to_indices)
+        ))
+
+    def resample(self, time_step_size):
+        """Derives a markov chain with a coarser time step size.
+
+        The transition matrix of each coarse time step is the product of the transition
+        matrices of the fine time steps it consists of. Time steps never span two days.
+
+        Parameters:
+            * time_step_size: the new time step size, must be a multiple of the current one
+                              and must divide a day
+        """
+        factor, remainder = divmod(time_step_size, self.__time_step_size)
+        number_time_slots = len(self.__time_stamps)
+        if remainder or factor < 1 or number_time_slots % factor != 0:
+            raise ValueError('Cannot resample markov chain from time step size {} to {}.'
+                             .format(self.__time_step_size, time_step_size))
+        number_activities = len(_ACTIVITIES)
+        fine_probabilities = self.__probabilities.reshape(
+            len(DAY_TYPES), number_time_slots // factor, factor, number_activities,
+            number_activities
+        )
+        coarse_probabilities = fine_probabilities[:, :, 0]
+        for step in range(1, factor):
+            coarse_probabilities = np.matmul(coarse_probabilities, fine_probabilities[:, :, step])
+        return WeekMarkovChain.from_transition_probabilities(coarse_probabilities, time_step_size)
 
     def to_dataframe(self):
         """Creates a dataframe representation of a time heterogeneous markov chain.
 
         Can be used to serialise the markov chain into csv or sql.
         """
-        df = pd.DataFrame(columns=[
-            MARKOV_CHAIN_DAY_COLUMN_NAME,
-            MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME,
-            MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME,
-            MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME,
-            MARKOV_CHAIN_PROBABILITY_COLUMN_NAME
-        ])
-        for day, day_chain in self.__chain.items():
-            assert day in ['weekday', 'weekend']
-            for time_stamp, single_markov_chain in day_chain.items():
-                assert isinstance(time_stamp, datetime.time)
-                single_df = pd.DataFrame({
-                    MARKOV_CHAIN_DAY_COLUMN_NAME: day,
-                    MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME: time_stamp,
-                    MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME: [element[0]
-                                                             for element in single_markov_chain],
-                    MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME: [element[1]
-                                                           for element in single_markov_chain],
-                    MARKOV_CHAIN_PROBABILITY_COLUMN_NAME: [single_markov_chain[element]
-                                                           for element in single_markov_chain]
-                })
-                df = df.append(single_df, ignore_index=True)
-        assert not df.isnull().any().any()
+        day_indices, time_slots, from_indices, to_indices = np.nonzero(self.__probabilities)
+        df = pd.DataFrame(
+            data={
+                MARKOV_CHAIN_DAY_COLUMN_NAME: np.array(DAY_TYPES, dtype=object)[day_indices],
+                MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME: self.__time_stamps[time_slots],
+                MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME: _ACTIVITY_ARRAY[from_indices],
+                MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME: _ACTIVITY_ARRAY[to_indices],
+                MARKOV_CHAIN_PROBABILITY_COLUMN_NAME: self.__probabilities[day_indices, time_slots,
+                                                                           from_indices, to_indices]
+            },
+            columns=[
+                MARKOV_CHAIN_DAY_COLUMN_NAME,
+                MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME,
+                MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME,
+                MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME,
+                MARKOV_CHAIN_PROBABILITY_COLUMN_NAME
+            ]
+        )
         df.set_index(
             [MARKOV_CHAIN_DAY_COLUMN_NAME, MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME],
             inplace=True
         )
         return df
 
+    def to_arrow(self):
+        """Creates an Arrow table representation of a time heterogeneous markov chain.
+
+        The table holds the same long-form data as `to_dataframe`, with day and activities
+        as dictionary encoded strings. Requires pyarrow.
+        """
+        import pyarrow as pa
+        day_indices, time_slots, from_indices, to_indices = np.nonzero(self.__probabilities)
+        activity_names = pa.array([str(activity) for activity in _ACTIVITIES])
+        time_step_microseconds = int(self.__time_step_size.total_seconds()) * 10**6
+        return pa.Table.from_arrays(
+            [
+                pa.DictionaryArray.from_arrays(day_indices.astype(np.int8),
+                                               pa.array(list(DAY_TYPES))),
+                pa.array(time_slots.astype(np.int64) * time_step_microseconds,
+                         type=pa.time64('us')),
+                pa.DictionaryArray.from_arrays(from_indices.astype(np.int8), activity_names),
+                pa.DictionaryArray.from_arrays(to_indices.astype(np.int8), activity_names),
+                pa.array(self.__probabilities[day_indices, time_slots, from_indices, to_indices])
+            ],
+            names=[
+                MARKOV_CHAIN_DAY_COLUMN_NAME,
+                MARKOV_CHAIN_TIME_OF_DAY_COLUMN_NAME,
+                MARKOV_CHAIN_FROM_ACTIVITY_COLUMN_NAME,
+                MARKOV_CHAIN_TO_ACTIVITY_COLUMN_NAME,
+                MARKOV_CHAIN_PROBABILITY_COLUMN_NAME
+            ]
+        )
+
+    def to_parquet(self, path):
+        """Writes the Arrow table representation of the markov chain to a Parquet file.
+
+        Requires pyarrow.
+        """
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), str(path))
+
+    def _initialise(self, transition_counts, time_step_size):
+        self._set_probabilities(WeekMarkovChain._probabilities(transition_counts), time_step_size)
+        self._add_missing_transitions()
+        self._validate()
+        self.__probabilities.flags.writeable = False
+
+    def _set_probabilities(self, probabilities, time_step_size, copy=True):
+        self.__time_step_size = time_step_size
+        self.__time_stamps = np.array(
+            list(WeekMarkovChain._day_time_step_generator(time_step_size)),
+            dtype=object
+        )
+        if copy:
+            self.__probabilities = np.array(probabilities, dtype=np.float64)
+        else:
+            self.__probabilities = np.asarray(probabilities, dtype=np.float64).view()
+        self.__cumulative_probabilities = None
+        self.__tick_day_types, self.__tick_time_slots = _week_ticks(len(self.__time_stamps))
+        number_activities = len(_ACTIVITIES)
+        if self.__probabilities.shape != (len(DAY_TYPES), len(self.__time_stamps),
+                                          number_activities, number_activities):
+            raise ValueError('Transition probabilities of shape {} do not match time step size {}.'
+                             .format(self.__probabilities.shape, time_step_size))
+
+    def _time_slot(self, time_stamp):
+        return _time_slot(time_stamp, self.__time_step_size)
+
     def _validate(self):
-        assert 'weekday' in self.__chain.keys()
-        assert 'weekend' in self.__chain.keys()
-        assert all(isinstance(time_step, datetime.time)
-                   for time_step in self.__chain['weekday'].keys())
-        assert all(isinstance(time_step, datetime.time)
-                   for time_step in self.__chain['weekend'].keys())
-        assert all(isinstance(activity, Activity)
-                   for chain in self.__chain['weekday'].values()
-                   for activity in chain.states())
-        assert all(isinstance(activity, Activity)
-                   for chain in self.__chain['weekend'].values()
-                   for activity in chain.states())
-        assert self._valid_transitions()
+        assert (self.__probabilities >= 0).all()
+        assert not self._missing_start_states().any()
         assert self._valid_probabilities()
 
     def _valid_probabilities(self):
-        return all(WeekMarkovChain._probabilities_add_to_one(self.__chain[day][time])
-                   for day in ['weekday', 'weekend']
-                   for time in WeekMarkovChain._day_time_step_generator(self.__time_step_size))
+        row_sums = self.__probabilities.sum(axis=-1)
+        start_states = row_sums > 0
+        return np.allclose(row_sums[start_states], 1.0, rtol=0, atol=0.001)
+
+    def _missing_start_states(self):
+        # Masks all states over the week which are end states of the previous time step,
+        # but aren't start states. Indexed by [day type, time slot, state].
+        start_states = self.__probabilities.sum(axis=-1) > 0
+        end_states = self.__probabilities.sum(axis=-2) > 0
+        required_start_states = np.empty_like(start_states)
+        required_start_states[:, 1:] = end_states[:, :-1]
+        # during a week, each day type follows each day type
+        required_start_states[:, 0] = end_states[:, -1].any(axis=0)
+        return required_start_states & ~start_states
 
-    @staticmethod
-    def _probabilities_add_to_one(markov_chain):
-        start_states = [item[0][0] for item in markov_chain.items()]
-        return all(math.isclose(
-                   sum(item[1] for item in markov_chain.items() if item[0][0] == start_state),
-                   1.0,
-                   abs_tol=0.001
-                   ) for start_state in start_states)
-
-    def _valid_transitions(self):
-        flags = [WeekMarkovChain._valid_transition(self.__chain[day][time],
-                                                   self.__chain[next_day][next_time])
-                 for day, time, next_day, next_time
-                 in WeekMarkovChain._all_possible_time_combinations(self.__time_step_size)]
-        return all(flags)
+    def _add_missing_transitions(self):
+        # Missing start states remain in the same state, as nothing is known about their
+        # transitions. As this can lead to new end states, repeat until nothing is missing.
+        missing_start_states = self._missing_start_states()
+        while missing_start_states.any():
+            days, time_slots, states = np.nonzero(missing_start_states)
+            self.__probabilities[days, time_slots, states, states] = 1.0
+            missing_start_states = self._missing_start_states()
 
     @staticmethod
-    def _valid_transition(single_markov_chain, next_single_markov_chain):
-        end_states_first = [x[0][1] for x in single_markov_chain.items()]
-        start_states_second = [x[0][0] for x in next_single_markov_chain.items()]
-        return all([state in start_states_second for state in end_states_first])
+    def _weekday(time_stamp):
+        return DAY_TYPES[_WEEKDAY_DAY_TYPE_INDEX[time_stamp.weekday()]]
 
-    def _add_missing_transitions(self):
-        for day, time in WeekMarkovChain._week_time_steps_generator(self.__time_step_size):
-            next_day, next_time = WeekMarkovChain._add_delta_to_day_and_time(day, time,
-                                                                             self.__time_step_size)
-            current_chain = self.__chain[day][time].items()
-            next_chain = self.__chain[next_day][next_time].items()
-            end_states_current_chain = [x[0][1] for x in current_chain]
-            start_states_next_chain = [x[0][0] for x in next_chain]
-            missing_start_states = [state for state in end_states_current_chain
-                                    if state not in start_states_next_chain]
-            for missing_state in missing_start_states:
-                self._add_transition(
-                    day=next_day,
-                    time=next_time,
-                    from_activity=missing_state,
-                    to_activity=missing_state,
-                    probability=1.0
-                )
+    @staticmethod
+    def _day_activity_codes(day_time_series, time_step_size):
+        time_steps = list(WeekMarkovChain._day_time_step_generator(time_step_size))
+        return activity_codes(day_time_series.ix[time_steps].values.T)
 
-    def _add_transition(self, day, time, from_activity, to_activity, probability):
-        chain = self.__chain[day][time]
-        elements = OrderedDict(chain)
-        elements[(from_activity, to_activity)] = probability
-        self.__chain[day][time] = pykov.Chain(elements)
+    @staticmethod
+    def _transition_counts(day_activity_codes):
+        day_activity_codes = np.asarray(day_activity_codes)[:, np.newaxis, :]
+        return transition_counts(
+            day_activity_codes,
+            group_codes=np.zeros(day_activity_codes.shape[0], dtype=np.intp),
+            number_groups=1
+        )[0, 0]
 
     @staticmethod
-    def _weekday(time_stamp):
-        day_number = time_stamp.weekday()
-        assert day_number in list(range(7))
-        if day_number in list(range(5)):
-            return 'weekday'
-        else:
-            return 'weekend'
+    def _probabilities(transition_counts):
+        current_instances = transition_counts.sum(axis=-1, keepdims=True)
+        return np.divide(
+            transition_counts,
+            current_instances,
+            out=np.zeros(transition_counts.shape, dtype=np.float64),
+            where=current_instances > 0
+        )
 
     @staticmethod
-    def _day_markov_chain(day_time_series, time_step_size):
-        return {
-            time_step: WeekMarkovChain._markov_chain(time_step, day_time_series, time_step_size)
-            for time_step in WeekMarkovChain._day_time_step_generator(time_step_size)
-        }
+    def _cumulative_probabilities(probabilities):
+        cumulative_probabilities = np.cumsum(probabilities, axis=-1)
+        totals = cumulative_probabilities[..., -1:]
+        cumulative_probabilities = np.divide(
+            cumulative_probabilities,
+            totals,
+            out=np.zeros(cumulative_probabilities.shape, dtype=np.float64),
+            where=totals > 0
+        )
+        cumulative_probabilities[..., -1] = totals[..., 0] > 0 # exactly 1 despite rounding
+        cumulative_probabilities.flags.writeable = False
+        return cumulative_probabilities
 
     @staticmethod
     def _day_time_step_generator(time_step_size):
@@ -266,59 +677,107 @@ class WeekMarkovChain():
             yield WeekMarkovChain._add_delta_to_time(start_time,
                                                      datetime.timedelta(minutes=minutes))
 
-    @staticmethod
-    def _week_time_steps_generator(time_step_size):
-        # starts Tuesday so that there are all possible combinations between work and weekend days
-        for day in ['weekday', 'weekday', 'weekday', 'weekday', 'weekend', 'weekend', 'weekday']:
-            for time_step in WeekMarkovChain._day_time_step_generator(time_step_size):
-                yield day, time_step
-
-    @staticmethod
-    def _all_possible_time_combinations(time_step_size):
-        # starts Tuesday so that there are all possible combinations between work and weekend days
-        for day in ['weekday', 'weekday', 'weekday', 'weekday', 'weekend', 'weekend', 'weekday']:
-            for time_step in WeekMarkovChain._day_time_step_generator(time_step_size):
-                next_day, next_time = WeekMarkovChain._add_delta_to_day_and_time(
-                    day, time_step, time_step_size
-                )
-                yield day, time_step, next_day, next_time
-
-    @staticmethod
-    def _markov_chain(time_step, day_time_series, time_step_size):
-        next_time_step = WeekMarkovChain._add_delta_to_time(time_step, time_step_size)
-        current_vector = day_time_series.ix[time_step]
-        next_vector = day_time_series.ix[next_time_step]
-        chain_elements = [((current_state, next_state), WeekMarkovChain._probability(current_state,
-                                                                                     next_state,
-                                                                                     current_vector,
-                                                                                     next_vector))
-                          for current_state in Activity
-                          for next_state in Activity]
-        return pykov.Chain(OrderedDict(chain_elements))
-
-    @staticmethod
-    def _probability(current_state, next_state, current_vector, next_vector):
-        if current_state in current_vector.unique():
-            current_mask = current_vector == current_state
-            next_mask = next_vector == next_state
-            next_instances = (current_mask & next_mask).sum()
-            current_instances = current_mask.sum()
-            return next_instances / current_instances
-        else:
-            return 0
-
     @staticmethod
     def _add_delta_to_time(time_step, delta):
         fulldate = datetime.datetime.combine(datetime.datetime(100, 1, 1), time_step)
         fulldate = fulldate + delta
         return fulldate.time()
 
-    @staticmethod
-    def _add_delta_to_day_and_time(day, time_step, delta):
-        random_date = datetime.datetime.combine(datetime.datetime(100, 1, 1), time_step)
-        updated_date = random_date + delta
-        if (random_date.date() == updated_date.date()):
-            return day, updated_date.time()
-        else:
-            next_day = 'weekend' if day == 'weekday' else 'weekday'
-            return next_day, updated_date.time()
+
+def write_week_markov_chains(markov_chains, path):
+    """Writes a collection of markov chains into one binary file.
+
+    The file consists of a short header and the transition probabilities of all chains as
+    one contiguous float64 array, so that it can be memory mapped by `read_week_markov_chains`.
+
+    Parameters:
+        * markov_chains: a dict from integer markov id, e.g. the `feature_id` of a cluster, to
+                         people.WeekMarkovChain; must not be empty, and all chains must have
+                         the same time step size
+        * path:          the path to the file to write
+    """
+    if len(markov_chains) == 0:
+        raise ValueError('There are no markov chains to write.')
+    markov_ids = [int(markov_id) for markov_id in markov_chains.keys()]
+    time_step_sizes = set(chain.time_step_size for chain in markov_chains.values())
+    if len(time_step_sizes) != 1:
+        raise ValueError('Markov chains must have one and the same time step size.')
+    transition_probabilities = np.stack([chain.transition_probabilities
+                                         for chain in markov_chains.values()])
+    header = {
+        'markov_ids': markov_ids,
+        'time_step_size_minutes': int(time_step_sizes.pop().total_seconds() / 60),
+        'shape': list(transition_probabilities.shape),
+        'dtype': '<f8'
+    }
+    header = json.dumps(header).encode('utf-8')
+    offset = len(_MARKOV_CHAINS_FILE_MAGIC) + 8 + len(header)
+    padding = -offset % _MARKOV_CHAINS_FILE_ALIGNMENT
+    with open(str(path), 'wb') as markov_chains_file:
+        markov_chains_file.write(_MARKOV_CHAINS_FILE_MAGIC)
+        markov_chains_file.write(struct.pack('<Q', len(header) + padding))
+        markov_chains_file.write(header)
+        markov_chains_file.write(b' ' * padding)
+        markov_chains_file.write(transition_probabilities.astype('<f8').tobytes())
+
+
+def read_week_markov_chains(path):
+    """Reads a collection of markov chains written by `write_week_markov_chains`.
+
+    The file is memory mapped read-only and the markov chains are views into it. Hence,
+    processes reading the same file share one copy of the chains in memory instead of having
+    their own. The chains have been validated when written, and are not validated again.
+
+    Returns:
+        a dict from markov id to people.WeekMarkovChain
+    """
+    with open(str(path), 'rb') as markov_chains_file:
+        if markov_chains_file.read(len(_MARKOV_CHAINS_FILE_MAGIC)) != _MARKOV_CHAINS_FILE_MAGIC:
+            raise ValueError('{} is not a markov chains file.'.format(path))
+        header_length, = struct.unpack('<Q', markov_chains_file.read(8))
+        header = json.loads(markov_chains_file.read(header_length).decode('utf-8'))
+    transition_probabilities = np.memmap(
+        str(path),
+        mode='r',
+        dtype=np.dtype(header['dtype']),
+        offset=len(_MARKOV_CHAINS_FILE_MAGIC) + 8 + header_length,
+        shape=tuple(header['shape'])
+    )
+    time_step_size = datetime.timedelta(minutes=header['time_step_size_minutes'])
+    return OrderedDict(
+        (markov_id, WeekMarkovChain.from_transition_probabilities(
+            transition_probabilities[index],
+            time_step_size=time_step_size,
+            trusted=True
+        ))
+        for index, markov_id in enumerate(header['markov_ids'])
+    )
+
+
+def _time_slot(time_stamp, time_step_size):
+    time_slot, remainder = divmod(time_stamp.hour * 60 + time_stamp.minute,
+                                  int(time_step_size.total_seconds() / 60))
+    if remainder != 0 or time_stamp.second != 0 or time_stamp.microsecond != 0:
+        raise ValueError('Time stamp {} does not match time step size {}.'
+                         .format(time_stamp, time_step_size))
+    return time_slot
+
+
+def _time_to_tick(time_stamp, time_step_size, number_time_slots):
+    return time_stamp.weekday() * number_time_slots + _time_slot(time_stamp, time_step_size)
+
+
+def _week_ticks(number_time_slots):
+    # the day type index and the time slot of each tick of a week, tick 0 is Monday midnight
+    return (np.repeat(_WEEKDAY_DAY_TYPE_INDEX, number_time_slots),
+            np.tile(np.arange(number_time_slots), len(_WEEKDAY_DAY_TYPE_INDEX)))
+
+
+def _splitmix64_uniform(seeds, counter):
+    # the counter-th number of the splitmix64 sequence of each seed, as a float in [0, 1)
+    with np.errstate(over='ignore'):
+        state = seeds + np.uint64(0x9E3779B97F4A7C15) * np.uint64(counter + 1)
+        state = (state ^ (state >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        state = (state ^ (state >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        state = state ^ (state >> np.uint64(31))
+    return (state >> np.uint64(11)) * (1.0 / (1 << 53))
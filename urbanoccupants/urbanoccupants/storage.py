@@ -0,0 +1,228 @@
+"""Reading and writing of intermediate artifacts like the seed or the markov time series.
+
+Artifacts are written in the columnar Feather format. Columns of enums, categoricals, and other
+objects are dictionary encoded: each value is stored as an integer code into a small dictionary
+of distinct values. Enums are stored by their names, and their types are registered in the
+metadata of the file, so that they can be restored when reading. Index levels are restored
+from their codes, without hashing their values again. Loading memory-maps the file
+and reads only the requested columns, hence no object columns need to be unpickled.
+
+Files with any other suffix than `.feather` are written and read as plain pandas pickles.
+"""
+from collections import OrderedDict
+from enum import Enum
+import importlib
+import json
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_categorical_dtype
+
+ARTIFACT_FILE_SUFFIX = '.feather'
+_METADATA_KEY = b'urbanoccupants'
+
+
+def write_artifact(data, path_to_artifact):
+    """Writes a DataFrame or Series to an artifact file.
+
+    Column labels and the name of a Series must be strings, numbers, or tuples of those. Object
+    columns and index levels must hold values of a single type, e.g. only enums, or only
+    strings; enums may be of different types.
+
+    Parameters:
+        * data:             the DataFrame or Series
+        * path_to_artifact: path to the file, its suffix determines the format, see module
+    """
+    if Path(path_to_artifact).suffix != ARTIFACT_FILE_SUFFIX:
+        data.to_pickle(str(path_to_artifact))
+        return
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    is_series = isinstance(data, pd.Series)
+    frame = data.to_frame() if is_series else data
+    arrays = OrderedDict()
+    metadata = {
+        'series': is_series,
+        'name': _json_label(data.name) if is_series else None,
+        'index': [],
+        'columns': [],
+        'column_names': list(frame.columns.names),
+        'encodings': {}
+    }
+    for i, name in enumerate(frame.index.names):
+        field = name if isinstance(name, str) and name not in frame.columns else \
+            '__index_level_{}__'.format(i)
+        arrays[field], metadata['encodings'][field] = _encode(frame.index.get_level_values(i))
+        metadata['index'].append({'field': field, 'name': name})
+    for i, label in enumerate(frame.columns):
+        field = label if isinstance(label, str) else json.dumps(_json_label(label))
+        if field in arrays:
+            raise ValueError('Column label {} is not unique.'.format(label))
+        arrays[field], metadata['encodings'][field] = _encode(frame.iloc[:, i])
+        metadata['columns'].append({'field': field, 'label': _json_label(label)})
+    table = pa.Table.from_arrays(list(arrays.values()), names=list(arrays.keys()))
+    table = table.replace_schema_metadata({_METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+    # uncompressed, to allow zero-copy reads from memory mapped files
+    feather.write_feather(table, str(path_to_artifact), compression='uncompressed')
+
+
+def read_artifact(path_to_artifact, columns=None):
+    """Reads a DataFrame or Series from an artifact file.
+
+    Parameters:
+        * path_to_artifact: path to the file written by `write_artifact`
+        * columns:          labels of the columns to read, default is all columns; the index
+                            is always read
+
+    Columns that were categoricals when written are restored as categoricals, all other
+    object columns as object columns.
+    """
+    if Path(path_to_artifact).suffix != ARTIFACT_FILE_SUFFIX:
+        data = pd.read_pickle(str(path_to_artifact))
+        return data if columns is None else data[list(columns)]
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    with pa.memory_map(str(path_to_artifact)) as source:
+        schema = pa.ipc.open_file(source).schema
+    metadata = json.loads(schema.metadata[_METADATA_KEY].decode('utf-8'))
+    column_metadata = metadata['columns']
+    if columns is not None:
+        fields = {_label(column['label']): column for column in column_metadata}
+        unknown = [label for label in columns if label not in fields]
+        if unknown:
+            raise ValueError('Artifact does not contain columns {}.'.format(unknown))
+        column_metadata = [fields[label] for label in columns]
+    index_fields = [level['field'] for level in metadata['index']]
+    column_fields = [column['field'] for column in column_metadata]
+    table = feather.read_table(str(path_to_artifact), columns=index_fields + column_fields,
+                               memory_map=True)
+    encodings = metadata['encodings']
+    index_names = [level['name'] for level in metadata['index']]
+    if len(index_fields) == 1:
+        index = pd.Index(_decode(table.column(index_fields[0]), encodings[index_fields[0]]),
+                         name=index_names[0])
+    else: # from codes, which spares the MultiIndex from hashing all values
+        levels, codes = zip(*[_decode_level(table.column(field), encodings[field])
+                              for field in index_fields])
+        index = pd.MultiIndex(levels=levels, codes=codes, names=index_names,
+                              verify_integrity=False)
+    frame = pd.DataFrame(
+        OrderedDict((i, _decode(table.column(field), encodings[field]))
+                    for i, field in enumerate(column_fields)),
+        index=index
+    )
+    labels = [_label(column['label']) for column in column_metadata]
+    if len(metadata['column_names']) > 1:
+        frame.columns = pd.MultiIndex.from_tuples(labels, names=metadata['column_names'])
+    else:
+        frame.columns = pd.Index(labels, name=metadata['column_names'][0], tupleize_cols=False)
+    if metadata['series']:
+        return frame.iloc[:, 0].rename(_label(metadata['name']))
+    return frame
+
+
+def _encode(values):
+    import pyarrow as pa
+    if is_categorical_dtype(values):
+        categorical = pd.Categorical(values)
+        codes, categories = categorical.codes, list(categorical.categories)
+        encoding = {'categorical': True, 'ordered': bool(categorical.ordered)}
+    elif np.asarray(values).dtype == object:
+        codes, categories = pd.factorize(np.asarray(values))
+        categories = list(categories)
+        encoding = {'categorical': False, 'ordered': False}
+    else:
+        return pa.array(np.asarray(values)), None
+    enum_types = _enum_types(categories)
+    if enum_types is None:
+        encoding['enum'] = None
+    elif len(set(enum_types)) == 1:
+        encoding['enum'] = _enum_type_name(enum_types[0])
+    else: # the type of each category
+        encoding['enum'] = [_enum_type_name(enum_type) for enum_type in enum_types]
+    if enum_types is not None:
+        categories = [category.name for category in categories]
+    codes = np.asarray(codes)
+    indices = pa.array(codes.astype(np.int8 if len(categories) < 2**7 else np.int32),
+                       mask=codes < 0)
+    return pa.DictionaryArray.from_arrays(indices, pa.array(categories)), encoding
+
+
+def _decode(column, encoding):
+    if encoding is None:
+        return column.to_numpy()
+    codes, categories = _decode_codes(column, encoding)
+    if encoding['categorical']:
+        return pd.Categorical.from_codes(codes, categories=categories,
+                                         ordered=encoding['ordered'])
+    values = _object_array(categories + [np.nan]) # code -1 marks missing values
+    return values[codes]
+
+
+def _decode_level(column, encoding):
+    if encoding is None:
+        codes, level = pd.factorize(column.to_numpy())
+        return level, codes
+    codes, categories = _decode_codes(column, encoding)
+    if encoding['categorical']:
+        level = pd.CategoricalIndex(categories, categories=categories,
+                                    ordered=encoding['ordered'])
+    else:
+        level = pd.Index(_object_array(categories), tupleize_cols=False)
+    return level, codes
+
+
+def _decode_codes(column, encoding):
+    array = column.combine_chunks() if hasattr(column, 'combine_chunks') else column
+    codes = array.indices.fill_null(-1).to_numpy().astype(np.int32)
+    categories = array.dictionary.to_pylist()
+    if isinstance(encoding['enum'], str):
+        enum_type = _resolve_enum_type(encoding['enum'])
+        categories = [enum_type[name] for name in categories]
+    elif encoding['enum'] is not None:
+        categories = [_resolve_enum_type(enum_type)[name]
+                      for enum_type, name in zip(encoding['enum'], categories)]
+    return codes, categories
+
+
+def _object_array(values):
+    array = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values): # element-wise, as values may be tuples
+        array[i] = value
+    return array
+
+
+def _enum_types(values):
+    types = [type(value) for value in values]
+    if values and all(issubclass(value_type, Enum) for value_type in types):
+        return types
+    elif any(isinstance(value, Enum) for value in values):
+        raise ValueError('Cannot store enums mixed with values of types {}.'.format(set(types)))
+    else:
+        return None
+
+
+def _enum_type_name(enum_type):
+    return '{}:{}'.format(enum_type.__module__, enum_type.__qualname__)
+
+
+def _resolve_enum_type(enum_name):
+    module_name, qualified_name = enum_name.split(':')
+    enum_type = importlib.import_module(module_name)
+    for name in qualified_name.split('.'):
+        enum_type = getattr(enum_type, name)
+    assert issubclass(enum_type, Enum), '{} is not an enum.'.format(enum_name)
+    return enum_type
+
+
+def _json_label(label):
+    if isinstance(label, tuple):
+        return [_json_label(part) for part in label]
+    return label
+
+
+def _label(json_label):
+    if isinstance(json_label, list):
+        return tuple(_label(part) for part in json_label)
+    return json_label
@@ -3,13 +3,16 @@ from enum import Enum
 from itertools import chain
 import math
 
+import numpy as np
 import pandas as pd
+from pandas.api.types import is_categorical_dtype
 
-from .hipf import fit_hipf
+from .hipf import fit_hipf, fit_hipf_regions, HipfTrace
 from .types import AgeStructure, EconomicActivity, HouseholdType, Qualification, Pseudo, Carer,\
     PersonalIncome, PopulationDensity, Region, DwellingType
 from .tus import AGE_MAP, ECONOMIC_ACTIVITY_MAP, HOUSEHOLDTYPE_MAP, QUALIFICATION_MAP, PSEUDO_MAP,\
-    CARER_MAP, PERSONAL_INCOME_MAP, POPULATION_DENSITY_MAP, REGION_MAP, dwellingtype_map
+    CARER_MAP, PERSONAL_INCOME_MAP, POPULATION_DENSITY_MAP, REGION_MAP, tus_raw_values,\
+    _dwellingtype_raw_values
 from .census import read_age_structure_data, read_household_type_data, \
     read_qualification_level_data, read_economic_activity_data,\
     read_pseudo_individual_data, read_pseudo_household_data, read_dwelling_type_data
@@ -20,6 +23,11 @@ Citizen = namedtuple('Citizen', ['householdId', 'markovId', 'initialActivity',
 
 RANDOM_SEED = 123456789
 MAX_HOUSEHOLD_SIZE = 70
+HIPF_RESIDUALS_TOL = 0.0001
+HIPF_WEIGHTS_TOL = 0.0001
+HIPF_MAXITER = 100
+
+_LookupTable = namedtuple('_LookupTable', ['raw_values', 'codes', 'nan_code'])
 
 
 def _unimplemented_census_read_function(geographical_layer):
@@ -27,6 +35,57 @@ def _unimplemented_census_read_function(geographical_layer):
     raise NotImplementedError()
 
 
+def _compile_lookup_table(mapping, uo_type):
+    """Compiles a mapping to members of uo_type into a lookup table over raw values.
+
+    Keys of the mapping can be pytus2000 enums, raw values, or nan. Members are represented by
+    their categorical codes, i.e. by their position in `sorted(uo_type)`, see `encode_seed`.
+    Code -1 marks missing values.
+    """
+    categories = sorted(uo_type)
+
+    def code(uo_value):
+        return -1 if pd.isnull(uo_value) else categories.index(uo_value)
+
+    nan_code = -1
+    raw_values_and_codes = []
+    for key, uo_value in mapping.items():
+        if isinstance(key, float) and math.isnan(key):
+            nan_code = code(uo_value)
+        else:
+            raw_values_and_codes.append((tus_raw_values([key])[0], code(uo_value)))
+    raw_values_and_codes.sort()
+    return _LookupTable(
+        raw_values=np.array([raw_value for raw_value, _ in raw_values_and_codes]),
+        codes=np.array([code for _, code in raw_values_and_codes], dtype=np.int16),
+        nan_code=nan_code
+    )
+
+
+def _lookup_codes(lookup_table, raw_values):
+    """Looks up the categorical codes of raw values. Unknown values map to -1."""
+    positions = np.searchsorted(lookup_table.raw_values, raw_values)
+    positions = positions.clip(0, max(len(lookup_table.raw_values) - 1, 0))
+    known = lookup_table.raw_values[positions] == raw_values
+    return np.where(
+        known,
+        lookup_table.codes[positions],
+        np.where(np.isnan(raw_values), lookup_table.nan_code, -1)
+    )
+
+
+def _feature_lookup_table(uo_type, tus_mapping):
+    if isinstance(tus_mapping, dict):
+        return _compile_lookup_table(tus_mapping, uo_type)
+    else: # tus_mapping is a vectorised function returning raw values of uo_type
+        return _compile_lookup_table({member.value: member for member in uo_type}, uo_type)
+
+
+def _feature_values(uo_type, codes, index):
+    values = pd.Categorical.from_codes(codes, categories=sorted(uo_type), ordered=True)
+    return pd.Series(values, index=index)
+
+
 class HouseholdFeature(Enum):
     """Household features to be used as controls in the creation of a synthetic population."""
     PSEUDO = (Pseudo, 'CHILD', PSEUDO_MAP, read_pseudo_household_data) # 'CHILD' is arbitrary
@@ -34,22 +93,30 @@ class HouseholdFeature(Enum):
     POPULATION_DENSITY = (PopulationDensity, 'POP_DEN2', POPULATION_DENSITY_MAP,
                           _unimplemented_census_read_function)
     REGION = (Region, 'GORPAF', REGION_MAP, _unimplemented_census_read_function)
-    DWELLING_TYPE = (DwellingType, ['HQ13A','HQ13B','HQ13C','HQ13D'],dwellingtype_map, read_dwelling_type_data)
+    DWELLING_TYPE = (DwellingType, ['HQ13A', 'HQ13B', 'HQ13C', 'HQ13D'], _dwellingtype_raw_values,
+                     read_dwelling_type_data)
 
     def __init__(self, uo_type, tus_variable_name, tus_mapping, census_read_function):
         self.uo_type = uo_type
         self.tus_variable_name = tus_variable_name
         self.tus_mapping = tus_mapping
+        self._lookup_table = _feature_lookup_table(uo_type, tus_mapping)
         self._census_read_function = census_read_function
 
     def __repr__(self):
         return str(self)
 
     def tus_value_to_uo_value(self, feature_values, age):
+        """Maps values of the TUS to values of this feature.
+
+        Returns a Series of ordered categoricals as created by `encode_seed`.
+        """
         if isinstance(feature_values, pd.Series):
-            return feature_values.map(self.tus_mapping)
+            raw_values = tus_raw_values(feature_values)
         else:
-            return feature_values.apply(self.tus_mapping, axis=1, raw=True)
+            raw_values = self.tus_mapping(feature_values)
+        codes = _lookup_codes(self._lookup_table, raw_values)
+        return _feature_values(self.uo_type, codes, feature_values.index)
 
     def read_census_data(self, geographical_layer):
         return self._census_read_function(geographical_layer)
@@ -76,6 +143,7 @@ class PeopleFeature(Enum):
         self.uo_type = uo_type
         self.tus_variable_name = tus_variable_name
         self.tus_mapping = tus_mapping
+        self._lookup_table = _feature_lookup_table(uo_type, tus_mapping)
         self._includes_below_16 = includes_below_16
         self._includes_above_74 = includes_above_74
         self._census_read_function = census_read_function
@@ -84,12 +152,18 @@ class PeopleFeature(Enum):
         return str(self)
 
     def tus_value_to_uo_value(self, feature_values, age):
-        new_values = feature_values.map(self.tus_mapping)
+        """Maps values of the TUS to values of this feature.
+
+        Returns a Series of ordered categoricals as created by `encode_seed`.
+        """
+        codes = _lookup_codes(self._lookup_table, tus_raw_values(feature_values))
+        categories = sorted(self.uo_type)
+        age = np.asarray(age)
         if not self._includes_below_16:
-            new_values[age < 16] = self.uo_type.BELOW_16
+            codes[age < 16] = categories.index(self.uo_type.BELOW_16)
         if not self._includes_above_74:
-            new_values[age > 74] = self.uo_type.ABOVE_74
-        return new_values
+            codes[age > 74] = categories.index(self.uo_type.ABOVE_74)
+        return _feature_values(self.uo_type, codes, feature_values.index)
 
     def read_census_data(self, geographical_layer):
         data = self._census_read_function(geographical_layer)
@@ -104,6 +178,58 @@ class PeopleFeature(Enum):
         return data
 
 
+def encode_seed(seed):
+    """Encodes all feature columns of a seed as ordered categoricals.
+
+    The categories of a feature column are all members of the type of the feature, ordered as
+    by the type. Values are hence stored as small integer codes, and comparisons with members
+    of the type as well as groupbys on feature columns are vectorised. Other columns are
+    untouched. Use `decode_seed` to convert feature columns back to plain enum columns.
+
+    Be aware that groupbys and crosstabs on categorical columns can contain all categories,
+    including the ones not observed in the seed.
+    """
+    seed = seed.copy()
+    for feature in chain(PeopleFeature, HouseholdFeature):
+        column = str(feature)
+        if column not in seed.columns:
+            continue
+        values = pd.Categorical(seed[column], categories=sorted(feature.uo_type), ordered=True)
+        if (pd.isnull(values) != pd.isnull(seed[column]).values).any():
+            raise ValueError('Column {} contains values not of type {}.'
+                             .format(column, feature.uo_type))
+        seed[column] = values
+    return seed
+
+
+def decode_seed(seed):
+    """Converts categorical feature columns of a seed back to plain enum columns.
+
+    This is the inverse of `encode_seed`.
+    """
+    seed = seed.copy()
+    for feature in chain(PeopleFeature, HouseholdFeature):
+        column = str(feature)
+        if column in seed.columns and is_categorical_dtype(seed[column]):
+            seed[column] = seed[column].astype(object)
+    return seed
+
+
+def cluster_sizes(seed, features):
+    """The number of people per combination of values of features that occurs in the seed.
+
+    Combinations of categories of an encoded seed that do not occur in the seed are left out,
+    hence the sizes are the same for encoded and plain seeds.
+
+    Parameters:
+        * seed:     the seed
+        * features: a feature, or a tuple of features, or their string representations
+    """
+    if not isinstance(features, tuple):
+        features = (features, )
+    return seed.groupby([str(feature) for feature in features], observed=True).size()
+
+
 def _pairing_function(x, y):
     # cantor pairing function, http://stackoverflow.com/a/919661/1856079
     return int(1 / 2 * (x + y) * (x + y + 1) + y)
@@ -144,25 +270,68 @@ def run_hipf(param_tuple):
         * param_tuple(1): the controls for the households
         * param_tuple(2): the controls for the individuals
         * param_tuple(3): the region string, not used here, only bypassed
+        * param_tuple(4): a `HipfTrace` to record the convergence of the fitting, only useful
+                          when called in the same process (optional)
 
     Returns:
         a tuple of
             * param_tuple(3)
             * the fitted weights for the households in the seed
     """
-    seed, controls_hh, controls_ppl, region = param_tuple
-    number_households = list(controls_hh.values())[0].sum()
+    seed, controls_hh, controls_ppl, region = param_tuple[:4]
+    trace = param_tuple[4] if len(param_tuple) > 4 else None
     household_weights = fit_hipf(
         reference_sample=seed,
         controls_households=controls_hh,
         controls_individuals=controls_ppl,
-        residuals_tol=0.0001,
-        weights_tol=0.0001,
-        maxiter=100
+        residuals_tol=HIPF_RESIDUALS_TOL,
+        weights_tol=HIPF_WEIGHTS_TOL,
+        maxiter=HIPF_MAXITER,
+        trace=trace
+    )
+    _check_household_weights(household_weights, controls_hh)
+    return (region, household_weights)
+
+
+def run_hipf_regions(seed, controls_hh, controls_ppl, initial_weights=None, trace=None):
+    """Performs HIPF for many geographical regions at once.
+
+    The seed is fitted to all regions together, which is much faster than fitting each region
+    on its own with `run_hipf`. See `urbanoccupants.hipf.fit_hipf_regions` for further
+    information on the algorithm.
+
+    Parameters:
+        * seed:         the seed for the fitting
+        * controls_hh:  a dict from region to the controls for the households in that region
+        * controls_ppl: a dict from region to the controls for the individuals in that region
+        * initial_weights: a dict from region to the household weights to start from, e.g. the
+                           fitted weights of the enclosing region (optional)
+        * trace:        a `HipfTrace` that records the convergence of each region (optional)
+
+    Returns:
+        a dict from region to the fitted weights for the households in the seed
+    """
+    household_weights = fit_hipf_regions(
+        reference_sample=seed,
+        controls_households=controls_hh,
+        controls_individuals=controls_ppl,
+        residuals_tol=HIPF_RESIDUALS_TOL,
+        weights_tol=HIPF_WEIGHTS_TOL,
+        maxiter=HIPF_MAXITER,
+        initial_weights=initial_weights,
+        trace=trace
     )
+    household_weights = {region: weights.rename(None)
+                         for region, weights in household_weights.iterrows()}
+    for region, weights in household_weights.items():
+        _check_household_weights(weights, controls_hh[region])
+    return household_weights
+
+
+def _check_household_weights(household_weights, controls_hh):
+    number_households = list(controls_hh.values())[0].sum()
     assert number_households - household_weights.sum() < 0.1
     assert not any(household_weights.isnull())
-    return (region, household_weights)
 
 
 def sample_households(param_tuple):
@@ -173,25 +342,33 @@ def sample_households(param_tuple):
 
     Parameters:
         * param_tuple(0): the region string
-        * param_tuple(1): the seed from which to sample
-        * param_tuple(2): the fitted weights on household level
-        * param_tuple(3): a random number for each household, to ensure reproducibility
-        * param_tuple(4): an id for each household, to ensure reproducibility
+        * param_tuple(1): the fitted weights on household level, indexed by the household ids
+                          of the seed
+        * param_tuple(2): a random number for each household, to ensure reproducibility
+        * param_tuple(3): an id for each household, to ensure reproducibility
 
     Returns:
-        a list of Households
+        a DataFrame of the sampled households, with one column per field of `Household`
     """
-    region, seed, household_weights, random_numbers, household_ids = param_tuple
+    region, household_weights, random_numbers, household_ids = param_tuple
     assert len(random_numbers) == len(household_ids)
 
     norm_hh_weights = household_weights / household_weights.sum()
-    cum_norm_hh_weights = norm_hh_weights.cumsum()
+    cum_norm_hh_weights = norm_hh_weights.cumsum().values
     assert math.isclose(cum_norm_hh_weights[-1], 1, abs_tol=0.001)
 
-    seed_hh_ids = (cum_norm_hh_weights[cum_norm_hh_weights >= random_number].index[0]
-                   for random_number in random_numbers)
-    return [Household(household_id, seed_hh_ids, region)
-            for household_id, seed_hh_ids in zip(household_ids, seed_hh_ids)]
+    # the first household whose cumulative weight is >= the random number
+    seed_hh_positions = np.searchsorted(cum_norm_hh_weights, np.asarray(random_numbers),
+                                        side='left')
+    seed_hh_positions = np.minimum(seed_hh_positions, len(cum_norm_hh_weights) - 1)
+    return pd.DataFrame(
+        {
+            'id': np.asarray(household_ids),
+            'seedId': household_weights.index.values[seed_hh_positions],
+            'region': region
+        },
+        columns=Household._fields
+    )
 
 
 def sample_citizen(param_tuple):
@@ -201,22 +378,73 @@ def sample_citizen(param_tuple):
     only one parameter, hence the inconvenient tuple parameter design.
 
     Parameters:
-        * param_tuple(0): the households for which citizens should be sampled
-        * param_tuple(1): the seed from which to sample
+        * param_tuple(0): the households for which citizens should be sampled, a DataFrame
+                          like the one returned by `sample_households`
+        * param_tuple(1): the seed from which to sample, or better its `SeedHouseholdMembers`
+                          which are much smaller to pass to other processes
 
     Returns:
-        a list of Citizens
+        a DataFrame of the sampled citizens, with one column per field of `Citizen`
     """
     households, seed = param_tuple
-    return list(chain(
-        *([Citizen(householdId=household.id,
-                   markovId=row.markov_id,
-                   initialActivity=row.initial_activity,
-                   activeMetabolicRate=row.metabolic_heat_gain_active,
-                   passiveMetabolicRate=row.metabolic_heat_gain_passive,
-                   randomSeed=_citizen_random_seed(household.id, occupant_id))
-          for occupant_id, (index, row) in enumerate(seed.ix[household.seedId, :].iterrows())]
-          for household in households)))
+    if not isinstance(seed, SeedHouseholdMembers):
+        seed = SeedHouseholdMembers(seed)
+    return seed.citizens(households)
+
+
+class SeedHouseholdMembers():
+    """CSR style index from the households of a seed to the attributes of their members.
+
+    Members are sorted by household once, so that the attributes of the members of the i-th
+    household are at `offsets[i]:offsets[i + 1]`. Only the attributes needed to create
+    citizens are kept.
+
+    Parameters:
+        * seed: the seed, indexed by (household_id, person_id), with the columns `markov_id`,
+                `initial_activity`, `metabolic_heat_gain_active`, and
+                `metabolic_heat_gain_passive`
+    """
+
+    COLUMNS = ['markov_id', 'initial_activity', 'metabolic_heat_gain_active',
+               'metabolic_heat_gain_passive']
+
+    def __init__(self, seed):
+        household_codes, household_ids = pd.factorize(seed.index.get_level_values(0))
+        self.__household_ids = pd.Index(household_ids, tupleize_cols=False)
+        order = np.argsort(household_codes, kind='mergesort') # members in the order of the seed
+        household_sizes = np.bincount(household_codes, minlength=len(household_ids))
+        self.__offsets = np.concatenate([[0], np.cumsum(household_sizes)])
+        self.__columns = {column: seed[column].values[order] for column in self.COLUMNS}
+
+    def citizens(self, households):
+        """Creates the citizens of the given households, members of a household one after another.
+
+        Parameters:
+            * households: a DataFrame like the one returned by `sample_households`
+
+        Returns:
+            a DataFrame of citizens, with one column per field of `Citizen`
+        """
+        seed_positions = self.__household_ids.get_indexer(households['seedId'].values)
+        assert (seed_positions >= 0).all(), 'Households are missing in the seed.'
+        starts = self.__offsets[seed_positions]
+        household_sizes = self.__offsets[seed_positions + 1] - starts
+        citizen_households = np.repeat(np.arange(len(households)), household_sizes)
+        occupant_ids = (np.arange(household_sizes.sum()) -
+                        np.repeat(np.cumsum(household_sizes) - household_sizes, household_sizes))
+        rows = starts[citizen_households] + occupant_ids
+        household_ids = households['id'].values[citizen_households]
+        return pd.DataFrame(
+            {
+                'householdId': household_ids,
+                'markovId': self.__columns['markov_id'][rows],
+                'initialActivity': self.__columns['initial_activity'][rows],
+                'activeMetabolicRate': self.__columns['metabolic_heat_gain_active'][rows],
+                'passiveMetabolicRate': self.__columns['metabolic_heat_gain_passive'][rows],
+                'randomSeed': _citizen_random_seed(household_ids, occupant_ids)
+            },
+            columns=Citizen._fields
+        )
 
 
 def _citizen_random_seed(household_id, occupant_id):
@@ -3,13 +3,15 @@
 The mappings bring the data into categories that are used in this study. Typically
 that means the number of categories is reduces vastly.
 """
+import datetime
 from enum import Enum
 
 import numpy as np
 import pandas as pd
 
 from pytus2000 import diary, individual, household
-from .person import WeekMarkovChain
+from .person import WeekMarkovChain, DAY_TYPES, activity_codes, activities_from_codes, \
+    transition_counts
 from .types import EconomicActivity, Qualification, HouseholdType, AgeStructure, Pseudo, Carer,\
     PersonalIncome, PopulationDensity, Region, DwellingType
 
@@ -39,10 +41,198 @@ def filter_features(seed, markov_ts, features):
     Returns:
         * (seed, markov_ts) as tuple
     """
-    seed = filter_features_and_drop_nan(seed, [str(feature) for feature in features])
-    markov_ts = markov_ts[markov_ts.index.droplevel(['daytype', 'time_of_day']).isin(seed.index)]
-    seed = seed[seed.index.isin(markov_ts.index.droplevel(['daytype', 'time_of_day']))]
-    return seed, markov_ts
+    return FeatureFilter(seed, markov_ts).filter(features)
+
+
+class FeatureFilter():
+    """Filters seed and markov time series by features, like `filter_features`.
+
+    Use this when filtering the same data sets by many sets of features. Which individuals
+    miss which feature, and which individuals have diaries, is determined once when creating
+    the filter. Filtering by a set of features only combines these masks, and the result is
+    cached per set of features.
+
+    Parameters:
+        * seed:      the seed, with index (SN1, SN2, SN3) and one column per feature
+        * markov_ts: the markov time series, a MarkovTimeSeries, or a Series or DataFrame with
+                     index (SN1, SN2, SN3, daytype, time_of_day)
+    """
+
+    def __init__(self, seed, markov_ts):
+        if not seed.index.is_unique:
+            raise ValueError('Seed index contains duplicates.')
+        self.__seed = seed
+        self.__markov_ts = markov_ts
+        self.__missing = {column: seed[column].isnull().values for column in seed.columns}
+        if isinstance(markov_ts, MarkovTimeSeries):
+            person_keys = markov_ts.person_index
+        else:
+            person_keys = markov_ts.index.droplevel(['daytype', 'time_of_day'])
+        seed_positions = seed.index.get_indexer(person_keys)
+        # position in seed of each row of the markov time series, if it must be masked by rows
+        self.__row_positions = None if isinstance(markov_ts, MarkovTimeSeries) else seed_positions
+        self.__has_diaries = np.zeros(len(seed), dtype=np.bool_)
+        self.__has_diaries[seed_positions[seed_positions >= 0]] = True
+        self.__masks = {}
+
+    def seed_mask(self, features):
+        """Masks all individuals in the seed which have all features.
+
+        Parameters:
+            * features: an iterable of features, or of their string representation
+        """
+        features = frozenset(str(feature) for feature in features)
+        if features not in self.__masks:
+            mask = np.ones(len(self.__seed), dtype=np.bool_)
+            for feature in features:
+                mask &= ~self.__missing[feature]
+            self.__masks[features] = mask
+        return self.__masks[features]
+
+    def filter_seed(self, features):
+        """Filters seed by chosen features and drops nans, like `filter_features_and_drop_nan`."""
+        features = [str(feature) for feature in features]
+        filtered_seed = self.__seed.loc[self.seed_mask(features), features]
+        assert filtered_seed.shape[0] > 0, 'Seed filtered by features {} is empty.'.format(features)
+        return filtered_seed
+
+    def filter(self, features):
+        """Filters data sets for features and drops all missing values, like `filter_features`.
+
+        Returns:
+            * (seed, markov_ts) as tuple
+        """
+        features = [str(feature) for feature in features]
+        mask = self.seed_mask(features)
+        assert mask.any(), 'Seed filtered by features {} is empty.'.format(features)
+        mask = mask & self.__has_diaries
+        seed = self.__seed.loc[mask, features]
+        if self.__row_positions is None:
+            markov_ts = self.__markov_ts.select(seed.index)
+        else:
+            in_seed = self.__row_positions >= 0
+            row_mask = np.zeros(len(self.__row_positions), dtype=np.bool_)
+            row_mask[in_seed] = mask[self.__row_positions[in_seed]]
+            markov_ts = self.__markov_ts[row_mask]
+        return seed, markov_ts
+
+
+class MarkovTimeSeries():
+    """Integer coded diaries of all people in the TUS sample.
+
+    Holds the Activities of each person as an int8 tensor of codes as by
+    `person.activity_codes`, indexed by [person, day type, time slot], where day types are
+    ordered as in `person.DAY_TYPES` and time slots start at midnight. This is a compact and
+    fast alternative to the Series of Activities with index
+    (SN1, SN2, SN3, daytype, time_of_day) that is created by scripts/tus/markovts.py.
+
+    Parameters:
+        * activity_codes: int8 array of shape (persons, day types, time slots)
+        * person_index:   pandas index of the persons, typically with levels (SN1, SN2, SN3)
+        * time_step_size: the time step size of the diaries, a datetime.timedelta object
+    """
+
+    def __init__(self, activity_codes, person_index, time_step_size):
+        number_time_slots = len(list(WeekMarkovChain._day_time_step_generator(time_step_size)))
+        self.__activity_codes = np.asarray(activity_codes, dtype=np.int8)
+        if self.__activity_codes.shape != (len(person_index), len(DAY_TYPES), number_time_slots):
+            raise ValueError('Activity codes of shape {} do not match {} persons and time step '
+                             'size {}.'.format(self.__activity_codes.shape, len(person_index),
+                                               time_step_size))
+        if not person_index.is_unique:
+            raise ValueError('Person index contains duplicates.')
+        self.__activity_codes.flags.writeable = False
+        self.__person_index = person_index
+        self.__time_step_size = time_step_size
+
+    @classmethod
+    def from_series(cls, markov_ts):
+        """Creates the time series from a Series of Activities.
+
+        Parameters:
+            * markov_ts: Series of Activities, or a DataFrame with a single column of Activities,
+                         with index (SN1, SN2, SN3, daytype, time_of_day). The time step size is
+                         derived from the number of distinct times of day.
+        """
+        if isinstance(markov_ts, pd.DataFrame):
+            assert markov_ts.shape[1] == 1, 'Markov time series must have exactly one column.'
+            markov_ts = markov_ts.iloc[:, 0]
+        if not markov_ts.index.is_unique:
+            raise ValueError('Markov time series contains duplicates.')
+        times_of_day = markov_ts.index.get_level_values('time_of_day')
+        time_step_size = datetime.timedelta(days=1) // len(times_of_day.unique())
+        time_stamps = pd.Index(list(WeekMarkovChain._day_time_step_generator(time_step_size)))
+        person_keys = markov_ts.index.droplevel(['daytype', 'time_of_day'])
+        person_index = person_keys.drop_duplicates()
+        person_positions = person_index.get_indexer(person_keys)
+        day_types = pd.Index(DAY_TYPES).get_indexer(markov_ts.index.get_level_values('daytype'))
+        time_slots = time_stamps.get_indexer(times_of_day)
+        if (day_types < 0).any() or (time_slots < 0).any():
+            raise ValueError('Markov time series contains unknown day types or times of day.')
+        codes = np.full((len(person_index), len(DAY_TYPES), len(time_stamps)), -1, dtype=np.int8)
+        codes[person_positions, day_types, time_slots] = activity_codes(markov_ts.values)
+        if (codes < 0).any():
+            raise ValueError('Markov time series does not contain both full diaries of everyone.')
+        return cls(codes, person_index, time_step_size)
+
+    @property
+    def activity_codes(self):
+        """The read-only tensor of activity codes, indexed by [person, day type, time slot]."""
+        return self.__activity_codes
+
+    @property
+    def person_index(self):
+        return self.__person_index
+
+    @property
+    def time_step_size(self):
+        return self.__time_step_size
+
+    def __len__(self):
+        return len(self.__person_index)
+
+    def select(self, person_keys):
+        """Returns the time series of the given persons only, in the given order.
+
+        Parameters:
+            * person_keys: an index or list of keys of persons, all of which must be known
+        """
+        positions = self.__person_index.get_indexer(person_keys)
+        if (positions < 0).any():
+            raise ValueError('Persons are unknown to the markov time series.')
+        return MarkovTimeSeries(self.__activity_codes[positions],
+                                self.__person_index[positions],
+                                self.__time_step_size)
+
+    def subsample(self, time_step_size):
+        """Returns the time series at a coarser time step size.
+
+        Only the activities at the time stamps of the coarser time step size are kept.
+
+        Parameters:
+            * time_step_size: the new time step size, must be a multiple of the current one
+        """
+        factor, remainder = divmod(time_step_size, self.__time_step_size)
+        if remainder or factor < 1:
+            raise ValueError('Cannot subsample markov time series from time step size {} to {}.'
+                             .format(self.__time_step_size, time_step_size))
+        return MarkovTimeSeries(self.__activity_codes[:, :, ::factor],
+                                self.__person_index,
+                                time_step_size)
+
+    def to_series(self):
+        """Creates the Series of Activities with index (SN1, SN2, SN3, daytype, time_of_day)."""
+        number_persons, number_day_types, number_time_slots = self.__activity_codes.shape
+        entries_per_person = number_day_types * number_time_slots
+        time_stamps = list(WeekMarkovChain._day_time_step_generator(self.__time_step_size))
+        index = pd.MultiIndex.from_arrays(
+            [self.__person_index.get_level_values(level).repeat(entries_per_person)
+             for level in range(self.__person_index.nlevels)] +
+            [np.tile(np.repeat(DAY_TYPES, number_time_slots), number_persons),
+             np.array(time_stamps * number_day_types * number_persons, dtype=object)],
+            names=list(self.__person_index.names) + ['daytype', 'time_of_day']
+        )
+        return pd.Series(activities_from_codes(self.__activity_codes.ravel()), index=index)
 
 
 def markov_chain_for_cluster(param_tuple):
@@ -52,7 +242,8 @@ def markov_chain_for_cluster(param_tuple):
     only one parameter, hence the inconvenient tuple parameter design.
 
     Parameters:
-        * param_tuple(0): time series for all people, with index (SN1, SN2, SN3, daytype, timeofday)
+        * param_tuple(0): time series for all people, a MarkovTimeSeries or a Series with index
+                          (SN1, SN2, SN3, daytype, timeofday)
         * param_tuple(1): a subset of the individual data set representing the cluster for which
                           the markov chain should be created, with index (SN1, SN2, SN3)
         * param_tuple(2): the tuple of people features representing the cluster, this is not used
@@ -65,21 +256,39 @@ def markov_chain_for_cluster(param_tuple):
             * the heterogeneous markov chain for the cluster
     """
     markov_ts, group_of_people, features, time_step_size = param_tuple
-    # filter by people
-    people_mask = markov_ts.index.droplevel([3, 4]).isin(group_of_people.index)
-    filtered_markov = pd.DataFrame(markov_ts)[people_mask].sort_index()
-    # filter by weekday
-    idx = pd.IndexSlice
-    filtered_markov_weekday = filtered_markov.loc[idx[:, :, :, 'weekday'], :]
-    # filter by weekend
-    filtered_markov_weekend = filtered_markov.loc[idx[:, :, :, 'weekend'], :]
-    return features, WeekMarkovChain(
-        weekday_time_series=filtered_markov_weekday.unstack(level=[0, 1, 2, 3]),
-        weekend_time_series=filtered_markov_weekend.unstack(level=[0, 1, 2, 3]),
+    if not isinstance(markov_ts, MarkovTimeSeries):
+        markov_ts = MarkovTimeSeries.from_series(markov_ts)
+    codes = markov_ts.select(group_of_people.index).subsample(time_step_size).activity_codes
+    return features, WeekMarkovChain.from_activity_codes(
+        weekday_activity_codes=codes[:, DAY_TYPES.index('weekday')],
+        weekend_activity_codes=codes[:, DAY_TYPES.index('weekend')],
         time_step_size=time_step_size
     )
 
 
+def markov_chains_for_clusters(markov_ts, cluster_labels, time_step_size):
+    """Creates heterogeneous markov chains for all clusters of the TUS sample at once.
+
+    All transitions of all clusters are counted in a single pass over the time series.
+
+    Parameters:
+        * markov_ts:      a MarkovTimeSeries containing at least all clustered people
+        * cluster_labels: a Series of the cluster label of each person, with index
+                          (SN1, SN2, SN3)
+        * time_step_size: the time step size of the markov chains, a datetime.timedelta object
+
+    Returns:
+        a dict from cluster label to the heterogeneous markov chain of the cluster
+    """
+    markov_ts = markov_ts.select(cluster_labels.index).subsample(time_step_size)
+    cluster_codes, clusters = pd.factorize(cluster_labels)
+    counts = transition_counts(markov_ts.activity_codes, cluster_codes, len(clusters))
+    return {
+        cluster: WeekMarkovChain.from_transition_counts(counts[cluster_code], time_step_size)
+        for cluster_code, cluster in enumerate(clusters)
+    }
+
+
 class Location(Enum):
     """Simplified TUS 2000 locations."""
     HOME = 1
@@ -649,26 +858,61 @@ REGION_MAP = {
 }
 
 
+def tus_raw_values(values):
+    """Returns the raw values of pytus2000 enums as floats, with nan for missing values.
+
+    Values that are already raw, like plain integers, are returned as they are. Enums are
+    resolved once per unique value, not once per value.
+    """
+    values = np.asarray(values)
+    if values.dtype != object:
+        return values.astype(np.float64)
+    labels, uniques = pd.factorize(values)
+    unique_raw_values = [value.value if isinstance(value, Enum) else value for value in uniques]
+    unique_raw_values = np.array(unique_raw_values + [np.nan], dtype=np.float64)
+    return unique_raw_values[labels] # label -1 of missing values points to the trailing nan
+
+
 def dwellingtype_map(row):
-    hq13a, hq13b, hq13c, hq13d = row
-    if hq13a == household.HQ13A.A_HOUSE_OR_BUNGALOW:
-        if hq13b == household.HQ13B.DETACHED:
-            return DwellingType.DETACHED_WHOLE_HOUSE_OR_BUNGALOW
-        elif hq13b ==  household.HQ13B.SEMI_DETACHED:
-            return DwellingType.SEMI_DETACHED_WHOLE_HOUSE_OR_BUNGALOW
-        elif hq13b == household.HQ13B.OR_TERRACEEND_OF_TERRACE:
-            return DwellingType.TERRACED_WHOLE_HOUSE_OR_BUNGALOW
-    elif hq13a == household.HQ13A.A_FLAT_OR_MAISONETTE:
-        if hq13c == household.HQ13C.A_PURPOSE_BUILT_BLOCK:
-            return DwellingType.FLAT_PURPOSE_BUILT_BLOCK
-        elif hq13c == household.HQ13C.A_CONVERTED_HOUSESOME_OTHER_KIND_OF_BUILDING:
-            return DwellingType.FLAT_CONVERTED_OR_SHARED_HOUSE
-    elif hq13a == household.HQ13A.OTHER:
-        if hq13d == household.HQ13D.A_CARAVAN__MOBILE_HOME_OR_HOUSEBOAT:
-            return DwellingType.CARAVAN
-        if hq13d == household.HQ13D.SOME_OTHER_KIND_OF_ACCOMMODATION:
-            return DwellingType.OTHER
-    elif hq13a == household.HQ13A.MISSING1:
-        return np.nan
-    elif hq13a == household.HQ13A.A_ROOMROOMS:
-        return DwellingType.OTHER
+    """Maps the four HQ13 values of one household to a `DwellingType`.
+
+    Parameters:
+        * row: the values of HQ13A, HQ13B, HQ13C, HQ13D, either pytus2000 enums or their raw
+               values
+
+    Returns the `DwellingType`, or nan where the dwelling type is missing or cannot be
+    determined.
+    """
+    raw_value = _dwellingtype_raw_values(pd.DataFrame([list(row)]))[0]
+    return np.nan if np.isnan(raw_value) else DwellingType(int(raw_value))
+
+
+def _dwellingtype_raw_values(hq13):
+    # vectorised `dwellingtype_map` of a DataFrame with columns HQ13A, HQ13B, HQ13C, HQ13D,
+    # giving the raw values of the dwelling types as floats, nan where undetermined
+    hq13a, hq13b, hq13c, hq13d = (tus_raw_values(hq13.iloc[:, i]) for i in range(4))
+    house = hq13a == household.HQ13A.A_HOUSE_OR_BUNGALOW.value
+    flat = hq13a == household.HQ13A.A_FLAT_OR_MAISONETTE.value
+    other = hq13a == household.HQ13A.OTHER.value
+    conditions_and_dwelling_types = [
+        (house & (hq13b == household.HQ13B.DETACHED.value),
+         DwellingType.DETACHED_WHOLE_HOUSE_OR_BUNGALOW),
+        (house & (hq13b == household.HQ13B.SEMI_DETACHED.value),
+         DwellingType.SEMI_DETACHED_WHOLE_HOUSE_OR_BUNGALOW),
+        (house & (hq13b == household.HQ13B.OR_TERRACEEND_OF_TERRACE.value),
+         DwellingType.TERRACED_WHOLE_HOUSE_OR_BUNGALOW),
+        (flat & (hq13c == household.HQ13C.A_PURPOSE_BUILT_BLOCK.value),
+         DwellingType.FLAT_PURPOSE_BUILT_BLOCK),
+        (flat & (hq13c == household.HQ13C.A_CONVERTED_HOUSESOME_OTHER_KIND_OF_BUILDING.value),
+         DwellingType.FLAT_CONVERTED_OR_SHARED_HOUSE),
+        (other & (hq13d == household.HQ13D.A_CARAVAN__MOBILE_HOME_OR_HOUSEBOAT.value),
+         DwellingType.CARAVAN),
+        (other & (hq13d == household.HQ13D.SOME_OTHER_KIND_OF_ACCOMMODATION.value),
+         DwellingType.OTHER),
+        (hq13a == household.HQ13A.A_ROOMROOMS.value, DwellingType.OTHER)
+    ]
+    return np.select(
+        [condition for condition, _ in conditions_and_dwelling_types],
+        [float(dwelling_type.value) for _, dwelling_type in conditions_and_dwelling_types],
+        default=np.nan
+    )
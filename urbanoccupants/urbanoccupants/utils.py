@@ -1,8 +1,23 @@
 from datetime import timedelta, datetime
+import hashlib
+import os
+from pathlib import Path
+import tempfile
+import time
 
 import yaml
 
 from . import PeopleFeature, HouseholdFeature, GeographicalLayer
+from .person import read_week_markov_chains, write_week_markov_chains
+
+MARKOV_CHAIN_CACHE_FILE_SUFFIX = '.chains'
+MARKOV_CHAIN_CACHE_TMP_FILE_SUFFIX = '.chains-tmp'
+# temporary files older than this are left behind by failed writes, younger ones may still be
+# written by another process
+MARKOV_CHAIN_CACHE_TMP_FILE_MAX_AGE = timedelta(days=1)
+# increase whenever the estimation of markov chains or their file format changes, as that
+# invalidates all cached entries
+MARKOV_CHAIN_CACHE_VERSION = 1
 
 
 def read_simulation_config(path_to_settings):
@@ -19,3 +34,99 @@ def read_simulation_config(path_to_settings):
     for time_str in ['wake-up-time', 'leave-home-time', 'come-home-time', 'bed-time']:
         settings[time_str] = datetime.strptime(settings[time_str], '%H:%M').time()
     return settings
+
+
+class MarkovChainCache():
+    """A persistent cache of markov chains on disk.
+
+    Each entry is a collection of markov chains, stored in the format of
+    `person.write_week_markov_chains` and addressed by a hash of the inputs the chains have been
+    estimated from, and by the version of the estimation. Whenever the cache grows beyond its
+    maximum size, the least recently used entries are evicted. Temporary files left behind by
+    failed writes are removed once they are older than `MARKOV_CHAIN_CACHE_TMP_FILE_MAX_AGE`.
+
+    Parameters:
+        * path_to_cache:     the directory of the cache, will be created if it does not exist
+        * max_size_in_bytes: the maximum size of all entries together
+
+    For example:
+
+    cache = MarkovChainCache('./build/markov-chain-cache', max_size_in_bytes=2**30)
+    key = cache.key(Path('./build/seed.feather'), features, time_step_size)
+    markov_chains = cache.get(key)
+    if markov_chains is None:
+        markov_chains = create_markov_chains()
+        cache.put(key, markov_chains)
+    """
+
+    def __init__(self, path_to_cache, max_size_in_bytes):
+        self.__path = Path(path_to_cache)
+        self.__path.mkdir(parents=True, exist_ok=True)
+        self.__max_size_in_bytes = max_size_in_bytes
+
+    @staticmethod
+    def key(*inputs):
+        """Creates the key of a cache entry from the inputs of the markov chains.
+
+        Inputs given as `pathlib.Path` are hashed by the content of the file. All other inputs
+        are hashed by their string representation, hence order matters. The key depends on
+        `MARKOV_CHAIN_CACHE_VERSION` as well.
+        """
+        key = hashlib.sha256()
+        key.update('version {}'.format(MARKOV_CHAIN_CACHE_VERSION).encode('utf-8'))
+        key.update(b'\0')
+        for cache_input in inputs:
+            if isinstance(cache_input, Path):
+                with cache_input.open('rb') as input_file:
+                    for chunk in iter(lambda: input_file.read(2**20), b''):
+                        key.update(chunk)
+            else:
+                key.update(str(cache_input).encode('utf-8'))
+            key.update(b'\0')
+        return key.hexdigest()
+
+    def get(self, key):
+        """Returns the markov chains for the given key, or None if they are not cached."""
+        path = self._entry_path(key)
+        if not path.exists():
+            return None
+        os.utime(str(path)) # mark as recently used
+        return read_week_markov_chains(path)
+
+    def put(self, key, markov_chains):
+        """Adds markov chains to the cache and evicts old entries if necessary.
+
+        Parameters:
+            * key:           the key of the cache entry, see `key`
+            * markov_chains: a dict from integer markov id to people.WeekMarkovChain
+        """
+        file_descriptor, tmp_path = tempfile.mkstemp(dir=str(self.__path),
+                                                     suffix=MARKOV_CHAIN_CACHE_TMP_FILE_SUFFIX)
+        os.close(file_descriptor)
+        try:
+            write_week_markov_chains(markov_chains, tmp_path)
+            os.replace(tmp_path, str(self._entry_path(key)))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        self._evict(latest_entry=self._entry_path(key))
+
+    def _entry_path(self, key):
+        return self.__path / (key + MARKOV_CHAIN_CACHE_FILE_SUFFIX)
+
+    def _evict(self, latest_entry):
+        max_tmp_file_mtime = time.time() - MARKOV_CHAIN_CACHE_TMP_FILE_MAX_AGE.total_seconds()
+        for tmp_file in self.__path.glob('*' + MARKOV_CHAIN_CACHE_TMP_FILE_SUFFIX):
+            if tmp_file.stat().st_mtime < max_tmp_file_mtime:
+                tmp_file.unlink()
+        entries = sorted(self.__path.glob('*' + MARKOV_CHAIN_CACHE_FILE_SUFFIX),
+                         key=lambda path: path.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in entries)
+        for entry in entries:
+            if size <= self.__max_size_in_bytes:
+                break
+            if entry == latest_entry: # never evict the entry just added
+                continue
+            size -= entry.stat().st_size
+            entry.unlink()